@@ -2,13 +2,15 @@
 High level functions to queue emails.
 """
 
+import copy
 import logging
+from itertools import islice
 
 
 logger = logging.getLogger(__name__)
 
 
-def queue_email_message(email_message, fail_silently=False):
+def queue_email_message(email_message, fail_silently=False, priority=None, send_at=None):
     """
     Add new messages to the email queue.
 
@@ -17,30 +19,159 @@ def queue_email_message(email_message, fail_silently=False):
 
     The ``fail_silently`` argument is not used and is only provided to match
     the signature of the ``EmailMessage.send`` function which it may emulate.
+
+    The ``priority`` (``now``, ``high``, ``normal`` or ``low``) overrides the
+    one set in the ``X-Mail-Queue-Priority`` header of the email.
+
+    With a future ``send_at`` date, the message is scheduled and it's enqueued by
+    the ``dispatch_scheduled_emails`` task when the date is reached.
+    """
+    message = _build_message(email_message, priority, send_at)
+    if message is None:
+        return 0
+
+    message.save()
+    message.add_log("Message created")
+    if message.status == message.STATUS_SCHEDULED:
+        return 1
+
+    if message.enqueue('Enqueued from a Backend or django-yubin itself.'):
+        return 1
+    else:
+        logger.exception('Error enqueuing an email', extra={'email_message': message})
+        return 0
+
+
+def queue_email_messages(email_messages, batch_size=500, priority=None, send_at=None):
+    """
+    Add many new messages to the email queue using bulk inserts.
+
+    The ``email_messages`` argument can be any iterable of Django's core mail
+    ``EmailMessage`` instances. It is consumed lazily, so only ``batch_size``
+    messages are serialized and kept in memory at a time.
+
+    Every batch is saved in its own transaction with one INSERT for the messages
+    and one more for each of their recipients, bodies and logs, and a single
+    callback is registered on commit to send the tasks of the whole batch. The
+    references to the blobs of deduplicated storage backends are added in the
+    same transaction, with a single query per different blob.
+
+    The ``priority`` overrides the one set in the headers of the emails. With a
+    future ``send_at`` date, the messages are scheduled instead of enqueued.
+
+    Returns the number of queued messages.
+    """
+    from django.db import connections, router, transaction
+
+    from . import models
+
+    using = router.db_for_write(models.Message)
+    queued = 0
+    email_messages = iter(email_messages)
+    while True:
+        batch = list(islice(email_messages, batch_size))
+        if not batch:
+            break
+
+        with transaction.atomic(using=using):
+            with models.blob_buffer():
+                messages = [message for message in (_build_message(email_message, priority, send_at)
+                                                    for email_message in batch)
+                            if message is not None]
+            if not messages:
+                continue
+
+            if connections[using].features.can_return_rows_from_bulk_insert:
+                models.Message.objects.using(using).bulk_create(messages)
+                models.Message.save_recipients(messages, using=using)
+            else:
+                # Primary keys are needed for the logs and the tasks.
+                for message in messages:
+                    message.save(using=using)
+            models.Message.save_bodies(messages, using=using)
+            if models.log_enabled(logging.INFO):
+                models.Log.objects.using(using).bulk_create(
+                    models.Log(message=message, action=message.status, log_message="Message created")
+                    for message in messages
+                )
+            scheduled = [message for message in messages if message.status == models.Message.STATUS_SCHEDULED]
+            queued += len(scheduled) + models.Message.enqueue_many(
+                [message for message in messages if message.status != models.Message.STATUS_SCHEDULED],
+                'Enqueued from a Backend or django-yubin itself.')
+
+    return queued
+
+
+def _build_message(email_message, priority=None, send_at=None):
     """
+    Returns an unsaved ``Message`` for the ``email_message`` or ``None`` if it
+    has no recipients. It's scheduled if ``send_at`` is in the future.
+
+    The priority header isn't saved with the email, but the ``email_message`` keeps it.
+    """
+    from django.utils.timezone import now
+
     from . import models, settings
 
     if settings.MAILER_TEST_MODE and settings.MAILER_TEST_EMAIL:
         email_message = _set_message_test_mode(email_message, settings.MAILER_TEST_EMAIL)
 
     if not email_message.recipients():
-        return 0
-
-    message = models.Message.objects.create(
+        return None
+
+    header_priority = _get_priority_header(email_message)
+    if priority is not None:
+        priority = models.Message.get_priority(priority)
+    elif header_priority is not None:
+        try:
+            priority = models.Message.get_priority(header_priority)
+        except ValueError:
+            logger.warning('Invalid %s header: %s', models.Message.PRIORITY_HEADER, header_priority)
+    if priority is None:
+        priority = models.Message.PRIORITY_NORMAL
+
+    return models.Message(
         to_address=','.join(email_message.to),
         cc_address=','.join(email_message.cc),
         bcc_address=','.join(email_message.bcc),
         from_address=email_message.from_email,
         subject=email_message.subject,
-        message_data=email_message.message().as_string(),
-        storage=settings.MAILER_STORAGE_BACKEND)
-    message.add_log("Message created")
+        message_bytes=_message_bytes(email_message),
+        storage=settings.MAILER_STORAGE_BACKEND,
+        priority=priority,
+        send_at=send_at,
+        status=models.Message.STATUS_SCHEDULED if send_at and send_at > now() else models.Message.STATUS_CREATED,
+        last_log="Message created")
 
-    if message.enqueue('Enqueued from a Backend or django-yubin itself.'):
-        return 1
-    else:
-        logger.exception('Error enqueuing an email', extra={'email_message': message})
-        return 0
+
+def _is_priority_header(header):
+    from .models import Message
+
+    return header.lower() == Message.PRIORITY_HEADER.lower()
+
+
+def _get_priority_header(email_message):
+    """
+    Returns the value of the priority header of the ``email_message``, without removing it.
+    """
+    value = None
+    for header, header_value in email_message.extra_headers.items():
+        if _is_priority_header(header):
+            value = header_value
+    return value
+
+
+def _message_bytes(email_message):
+    """
+    Returns the bytes of the ``email_message`` without its priority header, serialized from a
+    copy with a copy of its headers, so the ``email_message`` isn't changed.
+    """
+    headers = {header: value for header, value in email_message.extra_headers.items()
+               if not _is_priority_header(header)}
+    if len(headers) != len(email_message.extra_headers):
+        email_message = copy.copy(email_message)
+        email_message.extra_headers = headers
+    return email_message.message().as_bytes()
 
 
 def _set_message_test_mode(email_message, mailer_test_email):
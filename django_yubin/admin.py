@@ -1,4 +1,6 @@
 from django.contrib import admin, messages as dj_messages
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.urls import re_path, reverse
@@ -26,10 +28,12 @@ class LogInline(admin.TabularInline):
 
 @admin.register(models.Message)
 class MessageAdmin(admin.ModelAdmin):
+    # Prefix of the names of the views of the email.
+    url_name_prefix = 'mail'
 
     @admin.display(description=_('Show'))
     def message_link(self, instance):
-        url = reverse('admin:mail_detail', args=(instance.id,))
+        url = reverse(f'admin:{self.url_name_prefix}_detail', args=(instance.id,))
         return mark_safe(f'<a href="{url}" onclick="return showAddAnotherPopup(this);">Show</a>')
 
     @admin.display(description=_('Message data'))
@@ -42,25 +46,37 @@ class MessageAdmin(admin.ModelAdmin):
         return mark_safe(instance.storage.split('.')[-1])
 
     list_display = ('from_address', 'to_address', 'subject', 'date_created', 'date_sent',
-                    'date_enqueued', 'status', 'storage_class', 'message_link')
-    list_filter = ('date_created', 'date_sent', 'date_enqueued', 'status')
+                    'date_enqueued', 'status', 'priority', 'storage_class', 'message_link')
+    list_filter = ('date_created', 'send_at', 'date_sent', 'date_enqueued', 'status', 'priority')
     fields = ('from_address', 'to_address', 'cc_address', 'bcc_address', 'subject', 'message_data',
-              'storage', 'date_sent', 'sent_count', 'date_enqueued', 'enqueued_count', 'status')
+              'storage', 'send_at', 'date_sent', 'sent_count', 'date_enqueued', 'enqueued_count', 'next_attempt_at',
+              'status', 'priority', 'last_log')
     readonly_fields = ('to_address', 'cc_address', 'bcc_address', 'from_address', 'subject', 'message_data',
-                       'storage', 'date_created')
+                       'storage', 'date_created', 'last_log')
     search_fields = ('to_address', 'subject', 'from_address')
     date_hierarchy = 'date_created'
     ordering = ('-date_created',)
     actions = ['enqueue_action', 'mark_as_sent_action', 'mark_as_created_action']
     inlines = [LogInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Full addresses are looked up in the index of recipients, other terms, like domains
+        # or parts of an address, in the search fields.
+        term = search_term.strip()
+        try:
+            validate_email(term)
+        except ValidationError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.for_recipient(term), False
+
     def enqueue_action(self, request, queryset):
         failed, queued = [], []
-        for message in queryset:
-            if message.enqueue('Enqueued from the admin.'):
-                queued.append(str(message.pk))
-            else:
-                failed.append(str(message.pk))
+        with models.log_buffer():
+            for message in queryset:
+                if message.enqueue('Enqueued from the admin.'):
+                    queued.append(str(message.pk))
+                else:
+                    failed.append(str(message.pk))
 
         msg = _("{q_count} emails enqueued: {q} | {f_count} emails failed: {f}".format(
                     q_count=len(queued), q=','.join(queued),
@@ -79,34 +95,37 @@ class MessageAdmin(admin.ModelAdmin):
     enqueue_action.short_description = _('Enqueue selected messages')
 
     def mark_as_sent_action(self, request, queryset):
-        for message in queryset:
-            message.mark_as(models.Message.STATUS_SENT, 'Marked as sent from the admin.')
+        with models.log_buffer():
+            for message in queryset:
+                message.mark_as(models.Message.STATUS_SENT, 'Marked as sent from the admin.')
         self.message_user(request, _("Emails marked as sent."), level=dj_messages.SUCCESS)
     mark_as_sent_action.short_description = _('Mark as sent selected messages')
 
     def mark_as_created_action(self, request, queryset):
-        for message in queryset:
-            message.mark_as(models.Message.STATUS_CREATED, 'Marked as created from the admin.')
+        with models.log_buffer():
+            for message in queryset:
+                message.mark_as(models.Message.STATUS_CREATED, 'Marked as created from the admin.')
         self.message_user(request, _("Emails marked as created."), level=dj_messages.SUCCESS)
     mark_as_created_action.short_description = _('Mark as created selected messages')
 
     def get_urls(self):
         urls = super(MessageAdmin, self).get_urls()
+        prefix = self.url_name_prefix
         custom_urls = [
             re_path(r'^mail/(?P<pk>\d+)/$',
                     self.admin_site.admin_view(self.detail_view),
-                    name='mail_detail'),
+                    name=f'{prefix}_detail'),
             re_path(r'^mail/attachment/(?P<pk>\d+)/(?P<signature>[0-9a-f]{32})/$',
                     self.admin_site.admin_view(self.download_view),
-                    name="mail_download"),
+                    name=f'{prefix}_download'),
             re_path(r'^mail/html/(?P<pk>\d+)/$',
                     self.admin_site.admin_view(self.html_view),
-                    name="mail_html"),
+                    name=f'{prefix}_html'),
         ]
         return custom_urls + urls
 
     def detail_view(self, request, pk):
-        instance = models.Message.objects.get(pk=pk)
+        instance = self.model.objects.get(pk=pk)
         msg = instance.get_message_parser()
         context = {
             "subject": msg.subject,
@@ -126,11 +145,13 @@ class MessageAdmin(admin.ModelAdmin):
             ],
             "is_popup": True,
             "object": instance,
+            "html_url_name": f'admin:{self.url_name_prefix}_html',
+            "download_url_name": f'admin:{self.url_name_prefix}_download',
         }
         return render(request, "django_yubin/message_detail.html", context)
 
     def download_view(self, request, pk, signature):
-        instance = models.Message.objects.get(pk=pk)
+        instance = self.model.objects.get(pk=pk)
         msg = instance.get_message_parser()
         attachment = mailparser_utils.get_attachment(msg, signature)
         response = HttpResponse(content_type=attachment['mail_content_type'])
@@ -140,15 +161,58 @@ class MessageAdmin(admin.ModelAdmin):
 
     @xframe_options_sameorigin
     def html_view(self, request, pk):
-        instance = models.Message.objects.get(pk=pk)
+        instance = self.model.objects.get(pk=pk)
         msg = instance.get_message_parser()
         context = {"msg_html": "</br>".join(msg.text_html)}
         return render(request, "django_yubin/html_detail.html", context)
 
 
+@admin.register(models.MessageArchive)
+class MessageArchiveAdmin(MessageAdmin):
+    url_name_prefix = 'archive'
+
+    @admin.display(description=_('Message data'))
+    def message_data(self, instance):
+        backend = import_string(instance.storage)
+        return mark_safe(backend.admin_display_message_data(self, instance))
+
+    list_display = ('from_address', 'to_address', 'subject', 'date_created', 'date_sent', 'priority',
+                    'storage_class', 'message_link')
+    list_filter = ('date_sent', 'priority')
+    fields = ('from_address', 'to_address', 'cc_address', 'bcc_address', 'subject', 'message_data',
+              'storage', 'date_created', 'date_sent', 'sent_count', 'enqueued_count', 'priority', 'last_log',
+              'log', 'date_archived')
+    readonly_fields = fields
+    date_hierarchy = 'date_sent'
+    ordering = ('-date_sent',)
+    actions = []
+    inlines = []
+
+    def get_queryset(self, request):
+        # Emails are only read by the views that show them.
+        return super().get_queryset(request).defer('_message_data', '_binary_data')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Archived messages have no recipients, they are searched in the search fields.
+        return admin.ModelAdmin.get_search_results(self, request, queryset, search_term)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(models.Blacklist)
 class BlacklistAdmin(admin.ModelAdmin):
     list_display = ('email', 'date_added')
+    search_fields = ('email',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact lookup of the normalized address, that uses its index.
+        if not search_term:
+            return queryset, False
+        return queryset.filter(address=models.Blacklist.normalize(search_term)), False
 
 
 @admin.register(models.Log)
@@ -3,23 +3,41 @@ Email backends.
 """
 
 from django.core.mail.backends.base import BaseEmailBackend
+from django.db import router, transaction
 
-from django_yubin import queue_email_message
+from django_yubin import queue_email_message, queue_email_messages
 
 
 class QueuedEmailBackend(BaseEmailBackend):
     """
     A wrapper that manages a queued SMTP system.
+
+    The ``priority`` of the queued emails and the ``send_at`` date to schedule
+    them can be given when getting the connection, e.g.
+    ``get_connection(priority='high')``.
     """
 
+    def __init__(self, fail_silently=False, priority=None, send_at=None, **kwargs):
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        self.priority = priority
+        self.send_at = send_at
+
     def send_messages(self, email_messages):
         """
         Add new messages to the email queue.
 
         The ``email_messages`` argument should be one or more instances
         of Django's core mail ``EmailMessage`` class.
+
+        Several messages are queued in bulk inside a single transaction, so
+        either all of them are queued or none.
         """
-        num_sent = 0
-        for email_message in email_messages:
-            num_sent += queue_email_message(email_message)
-        return num_sent
+        email_messages = list(email_messages)
+        if not email_messages:
+            return 0
+        if len(email_messages) == 1:
+            return queue_email_message(email_messages[0], priority=self.priority, send_at=self.send_at)
+
+        from .models import Message
+        with transaction.atomic(using=router.db_for_write(Message)):
+            return queue_email_messages(email_messages, priority=self.priority, send_at=self.send_at)
@@ -0,0 +1,383 @@
+"""
+Blacklist lookups.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+
+from . import models, settings, tasks
+
+
+# Key of the Django cache with the current version of the blacklist, changed when it changes.
+VERSION_CACHE_KEY = 'django_yubin:blacklist:version'
+
+# Key of the Django cache with the current version of the blacklist filters, changed when they
+# must be rebuilt.
+FILTER_VERSION_CACHE_KEY = 'django_yubin:blacklist:filter_version'
+
+
+def get_version(cache, key):
+    """
+    Returns the version saved in the ``key`` of the ``cache``, creating it if needed.
+    """
+    version = cache.get(key)
+    if version is None:
+        # Evicted or never set: every process must agree on a new one.
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+class BlacklistCache:
+    """
+    Process-local copy of the blacklist.
+
+    The normalized addresses of the rules are loaded lazily from the database in a
+    frozenset and are reloaded when the version saved in the Django cache changes, so
+    every lookup only needs a cache read and a memory lookup. ``invalidate`` changes
+    the version, and with it the blacklist of every process sharing the cache.
+
+    ``hits`` and ``misses`` count how many lookups have used the loaded addresses and
+    how many have needed to load them.
+    """
+
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._addresses = None
+        self._version = None
+        self.hits = self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_version(self):
+        return get_version(self.cache, VERSION_CACHE_KEY)
+
+    def get_addresses(self):
+        """
+        Returns a frozenset with the blacklisted addresses, loading them if they have changed.
+        """
+        version = self.get_version()
+        with self._lock:
+            if self._addresses is not None and version is not None and version == self._version:
+                self.hits += 1
+                return self._addresses
+            self.misses += 1
+
+        # The version is read before loading, so changes saved meanwhile invalidate it again.
+        addresses = frozenset(models.Blacklist.objects.values_list('address', flat=True).iterator())
+        with self._lock:
+            self._addresses, self._version = addresses, version
+        return addresses
+
+    def get_blacklisted(self, emails):
+        """
+        Returns the blacklisted ``emails``.
+        """
+        blacklisted = self.get_addresses()
+        lookup_addresses = models.Blacklist.lookup_addresses
+        return [email for email in emails if not blacklisted.isdisjoint(lookup_addresses(email))]
+
+    def invalidate(self):
+        """
+        Forces every process to reload the blacklist.
+        """
+        self.cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._addresses = self._version = None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings sized for ``capacity`` items with a false positive rate
+    of ``error_rate``.
+
+    Its bits are kept in a ``bytearray`` or, when it's loaded from a file, in a
+    copy-on-write memory map, so the processes loading the same file share its
+    pages until they add items.
+    """
+    MAGIC = b'YUBINBF1'
+    # Magic, number of bits, number of hashes, capacity, count, last primary key and version.
+    HEADER = struct.Struct('<8sQQQQQ32s')
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.num_bits = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self.last_pk = 0
+        self.version = ''
+        self._data = bytearray(math.ceil(self.num_bits / 8))
+        self._offset = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        data, offset = self._data, self._offset
+        for position in self._positions(item):
+            data[offset + (position >> 3)] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        data, offset = self._data, self._offset
+        return all(data[offset + (position >> 3)] & (1 << (position & 7)) for position in self._positions(item))
+
+    def save(self, path):
+        """
+        Saves the filter in ``path`` atomically, so readers never see a half written filter.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.yubin-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.num_bits, self.num_hashes, self.capacity,
+                                         self.count, self.last_pk, self.version.encode()))
+                f.write(self._data[self._offset:])
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the filter saved in ``path`` or ``None`` if it doesn't exist or it's not valid.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, num_bits, num_hashes, capacity, count, last_pk, version = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or len(data) != cls.HEADER.size + math.ceil(num_bits / 8):
+            return None
+
+        bloom = cls.__new__(cls)
+        bloom.capacity, bloom.num_bits, bloom.num_hashes = capacity, num_bits, num_hashes
+        bloom.count, bloom.last_pk, bloom.version = count, last_pk, version.rstrip(b'\0').decode()
+        bloom._data, bloom._offset = data, cls.HEADER.size
+        return bloom
+
+
+class BlacklistFilter:
+    """
+    Process-local Bloom filter of the normalized blacklisted addresses.
+
+    Lookups only need to query the database when the filter reports a possible
+    match. When the blacklist version changes, the rows with a primary key greater
+    than the last loaded one are added to the filter. Every ``CHECK_INTERVAL``
+    seconds, and when it's loaded, it's also checked that it has as many rows as the
+    database up to that primary key, otherwise a row has been committed after rows
+    with greater primary keys and it's rebuilt. It's also rebuilt when it's full or
+    the filter version changes, after ``invalidate``. With ``path``, built filters are
+    saved in that file and the rest of processes load them from it instead of
+    building them again, querying the database while another process builds it.
+
+    ``negatives`` counts the lookups answered without querying the database,
+    ``positives`` the ones that have needed it and ``false_positives`` the positives
+    that were not blacklisted.
+    """
+    CHECK_INTERVAL = 60
+    # Seconds after which the build of a filter saved in ``path`` is considered dead.
+    BUILD_TIMEOUT = 600
+
+    def __init__(self, cache_alias='default', error_rate=0.001, path=None):
+        self.cache_alias = cache_alias
+        self.error_rate = error_rate
+        self.path = path
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._versions = None
+        self._check_at = 0
+        self.negatives = self.positives = self.false_positives = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_bloom(self):
+        """
+        Returns the up to date Bloom filter, loading, building or updating it if needed, or
+        ``None`` while another process builds it.
+        """
+        # Versions are read before loading, so changes saved meanwhile invalidate them again.
+        versions = (get_version(self.cache, VERSION_CACHE_KEY), get_version(self.cache, FILTER_VERSION_CACHE_KEY))
+        with self._lock:
+            bloom = self._bloom
+            check = time.monotonic() >= self._check_at
+            if bloom is not None and None not in versions and versions == self._versions and not check:
+                return bloom
+
+            if bloom is None or bloom.version != versions[1]:
+                bloom = BloomFilter.load(self.path) if self.path else None
+                if bloom is None or bloom.version != versions[1]:
+                    bloom = self.build(versions[1])
+                    if bloom is None:
+                        return None
+                check = True
+            if not self._update(bloom, check) or bloom.count > bloom.capacity:
+                bloom = self.build(versions[1])
+                if bloom is None:
+                    return None
+
+            self._bloom, self._versions = bloom, versions
+            if check:
+                self._check_at = time.monotonic() + self.CHECK_INTERVAL
+            return bloom
+
+    def build(self, version):
+        """
+        Builds a new filter from the database and saves it in ``path`` if any. Returns
+        ``None`` if another process is building the filter of ``path``.
+        """
+        lock_key = '%s:build' % FILTER_VERSION_CACHE_KEY
+        if self.path and not self.cache.add(lock_key, version or '', timeout=self.BUILD_TIMEOUT):
+            return None
+        try:
+            bloom = BloomFilter(max(models.Blacklist.objects.count() * 2, 1000), self.error_rate)
+            bloom.version = version or ''
+            self._update(bloom)
+            if self.path:
+                bloom.save(self.path)
+        finally:
+            if self.path:
+                self.cache.delete(lock_key)
+        return bloom
+
+    def _update(self, bloom, check=False):
+        """
+        Adds the rows with a primary key greater than the last loaded one to the filter.
+
+        With ``check``, returns if the filter has every row up to its last primary key: the
+        rows counted in the database are the ones it has loaded, none committed late.
+        """
+        rows = models.Blacklist.objects.filter(pk__gt=bloom.last_pk).order_by()
+        for pk, address in rows.values_list('pk', 'address').iterator():
+            bloom.add(address)
+            bloom.last_pk = max(bloom.last_pk, pk)
+        return not check or models.Blacklist.objects.filter(pk__lte=bloom.last_pk).count() == bloom.count
+
+    def might_be_blacklisted(self, emails):
+        """
+        Returns ``False`` if none of the ``emails`` is blacklisted and ``True`` if any can be.
+        """
+        bloom = self.get_bloom()
+        lookup_addresses = models.Blacklist.lookup_addresses
+        if bloom is None or any(address in bloom for email in emails for address in lookup_addresses(email)):
+            self.positives += 1
+            return True
+        self.negatives += 1
+        return False
+
+    def invalidate(self):
+        """
+        Makes every process build a new filter, or load it from ``path``, on its next use,
+        and returns its version.
+        """
+        version = uuid.uuid4().hex
+        self.cache.set(FILTER_VERSION_CACHE_KEY, version, timeout=None)
+        return version
+
+    def rebuild(self, version=None):
+        """
+        Builds a new filter, saving it in ``path`` if any, and makes every process use it.
+
+        With the ``version`` returned by ``invalidate`` it's only built if the filter hasn't
+        been invalidated again, by a later change that builds it again. Returns ``None`` when
+        it isn't built.
+        """
+        if version is None:
+            version = self.invalidate()
+        elif version != self.cache.get(FILTER_VERSION_CACHE_KEY):
+            return None
+        bloom = self.build(version)
+        if bloom is not None:
+            with self._lock:
+                # Checked again on its next use.
+                self._bloom, self._versions = bloom, None
+        return bloom
+
+    def clear(self):
+        with self._lock:
+            self._bloom = self._versions = None
+
+    def stats(self):
+        return {'negatives': self.negatives, 'positives': self.positives, 'false_positives': self.false_positives}
+
+
+blacklist_cache = BlacklistCache(settings.MAILER_BLACKLIST_CACHE_ALIAS)
+
+blacklist_filter = BlacklistFilter(
+    settings.MAILER_BLACKLIST_CACHE_ALIAS,
+    error_rate=settings.MAILER_BLACKLIST_FILTER_ERROR_RATE,
+    path=settings.MAILER_BLACKLIST_FILTER_FILE,
+)
+
+
+# Last invalidations of this thread.
+_local = threading.local()
+
+
+def get_blacklisted(emails):
+    """
+    Returns the blacklisted ``emails``, using the process-local blacklist when
+    ``MAILER_BLACKLIST_CACHE`` is enabled or a single query otherwise. With
+    ``MAILER_BLACKLIST_FILTER`` the query is skipped when the Bloom filter tells that
+    no email is blacklisted.
+    """
+    if settings.MAILER_BLACKLIST_CACHE:
+        return blacklist_cache.get_blacklisted(emails)
+    if settings.MAILER_BLACKLIST_FILTER and not blacklist_filter.might_be_blacklisted(emails):
+        return []
+
+    blacklisted = models.Blacklist.get_blacklisted(emails)
+    if settings.MAILER_BLACKLIST_FILTER and not blacklisted:
+        blacklist_filter.false_positives += 1
+    return blacklisted
+
+
+def invalidate(modified=False, changed_at=None):
+    """
+    Makes every process reload its blacklist and update its filter. Pass ``modified=True``
+    when blacklisted addresses have been modified or deleted, not only added, to make
+    every process use a new filter, built by the ``rebuild_blacklist_filter`` task when
+    it's saved in ``MAILER_BLACKLIST_FILTER_FILE`` and Celery is used.
+
+    With ``changed_at``, the ``time.monotonic()`` of the change, nothing is done if this
+    thread has already done it since then, like for every deleted row of a queryset.
+    """
+    done_at = getattr(_local, 'modified_at' if modified else 'invalidated_at', None)
+    if changed_at is not None and done_at is not None and done_at > changed_at:
+        return
+    _local.invalidated_at = time.monotonic()
+    if modified:
+        _local.modified_at = _local.invalidated_at
+
+    if modified and settings.MAILER_BLACKLIST_FILTER and not settings.MAILER_BLACKLIST_CACHE:
+        # Before changing the blacklist version, so the rest of processes don't update the old filter.
+        version = blacklist_filter.invalidate()
+        if blacklist_filter.path and settings.MAILER_USE_CELERY:
+            tasks.rebuild_blacklist_filter.delay(version)
+    blacklist_cache.invalidate()
@@ -0,0 +1,56 @@
+"""
+Process-local caches.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the total size of its values.
+
+    The size of every value is given when it's added. Values bigger than the whole
+    cache are not saved and a ``max_size`` of 0 disables the cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = self.misses = 0
+        self._data = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size):
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        _, size = self._data.pop(key, (None, 0))
+        self.size -= size
@@ -5,24 +5,235 @@ Functions here actually handle the sending of messages.
 """
 
 import logging
+import os
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from functools import partial
 
 from django.core.mail import get_connection
+from django.core.mail.backends import console, locmem, smtp
 from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
 
-from . import models, settings
+from . import blacklist, models, ratelimit, settings, tasks
 
 
 logger = logging.getLogger(__name__)
 
+# Backends that only need the serialized message and the envelope of the emails they send.
+RAW_MESSAGE_BACKENDS = (smtp.EmailBackend, console.EmailBackend, locmem.EmailBackend)
 
-@transaction.atomic
-def send_db_message(message_pk, log_message=None):
+
+class ConnectionPool:
+    """
+    Process-local pool of open backend connections.
+
+    Connections are grouped by backend path and connection options. Before reusing
+    a SMTP connection it's validated with a NOOP command and it's reopened if the
+    server has dropped it. Connections are recycled after sending ``max_messages``
+    messages or being idle for more than ``max_idle`` seconds.
+
+    ``hits``, ``misses`` and ``reconnects`` count how many times an idle connection
+    has been reused, a new connection has been opened and an idle connection has
+    been reopened because it was not usable anymore.
+    """
+
+    def __init__(self, max_messages=100, max_idle=60):
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {}  # key -> [entry, ...]
+        self._in_use = {}  # id(connection) -> entry
+        self.hits = self.misses = self.reconnects = 0
+
+    def _check_pid(self):
+        # Connections opened before forking (e.g. Celery prefork pool) must not be shared.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def acquire(self, backend, **kwargs):
+        """
+        Returns an open connection, reusing an idle one when possible.
+        """
+        key = (backend, tuple(sorted(kwargs.items())))
+        entry = None
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.get(key)
+            while idle and entry is None:
+                entry = idle.pop()
+                if time.monotonic() - entry['last_used'] > self.max_idle:
+                    self._close(entry['connection'])
+                    entry = None
+
+        if entry is None:
+            connection = get_connection(backend=backend, **kwargs)
+            connection.open()
+            entry = {'key': key, 'connection': connection, 'messages': 0}
+            self.misses += 1
+        elif not self._is_usable(entry['connection']):
+            self._close(entry['connection'])
+            entry['connection'].open()
+            entry['messages'] = 0
+            self.reconnects += 1
+        else:
+            self.hits += 1
+
+        with self._lock:
+            self._in_use[id(entry['connection'])] = entry
+        return entry['connection']
+
+    def release(self, connection, messages=1):
+        """
+        Returns the connection to the pool after sending ``messages`` messages through it.
+        """
+        with self._lock:
+            entry = self._in_use.pop(id(connection), None)
+            if entry is None:
+                return
+            entry['messages'] += messages
+            entry['last_used'] = time.monotonic()
+            if entry['messages'] < self.max_messages:
+                self._idle.setdefault(entry['key'], []).append(entry)
+                return
+        self._close(connection)
+
+    def clear(self):
+        """
+        Closes all the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for entry in entries:
+                self._close(entry['connection'])
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'reconnects': self.reconnects}
+
+    @staticmethod
+    def _is_usable(connection):
+        # Only SMTP-like backends keep a session that can be checked.
+        session = getattr(connection, 'connection', None)
+        if session is None or not hasattr(session, 'noop'):
+            return True
+        try:
+            return session.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.warning('Error closing a pooled connection', exc_info=True)
+
+
+connection_pool = ConnectionPool(
+    max_messages=settings.MAILER_CONNECTION_POOL_MAX_MESSAGES,
+    max_idle=settings.MAILER_CONNECTION_POOL_MAX_IDLE,
+)
+
+
+def open_connection():
+    """
+    Returns an open connection of the real backend, taken from the pool when it's enabled.
+    """
+    if settings.MAILER_CONNECTION_POOL:
+        return connection_pool.acquire(settings.USE_BACKEND)
+    connection = get_connection(backend=settings.USE_BACKEND)
+    connection.open()
+    return connection
+
+
+def close_connection(connection, messages=1):
+    """
+    Closes a connection returned by ``open_connection`` after sending ``messages``
+    messages, or returns it to the pool when it's enabled.
+    """
+    if settings.MAILER_CONNECTION_POOL:
+        connection_pool.release(connection, messages)
+    else:
+        connection.close()
+
+
+class MessageRateLimited(ratelimit.RateLimited):
+    """
+    The locked ``message`` can't be sent before ``wait`` seconds.
+    """
+    def __init__(self, message, wait):
+        super().__init__(wait)
+        self.message = message
+
+
+def send_db_message(message_pk, log_message=None, connection=None, claim=None):
     """
     Sends a django_yubin.models.Message by its PK.
+
+    An already opened backend ``connection`` can be passed to reuse it, otherwise
+    a new one is created.
+
+    With a ``claim`` filter, the message is sent if it still matches it and no other
+    transaction has locked it, whatever its status, otherwise it's skipped.
+
+    The logs of the message are saved at once after the message transaction, so the
+    message row is locked as little as possible.
+
+    When a rate limit is configured the tokens are taken once the message is locked
+    and checked, so skipped messages don't use them, and when the message has to wait
+    it's unlocked while it sleeps and it's locked and checked again. Sent by Celery,
+    messages that should wait more than ``MAILER_RATE_LIMIT_MAX_WAIT`` seconds are
+    enqueued again to be sent when the limit allows it.
+    """
+    max_wait = settings.MAILER_RATE_LIMIT_MAX_WAIT if settings.MAILER_USE_CELERY else None
+    waited = 0.0
+    with models.log_buffer():
+        while True:
+            try:
+                sent = _send_db_message(message_pk, log_message, connection, claim)
+            except MessageRateLimited as e:
+                try:
+                    waited = ratelimit.rate_limiter.sleep(e.wait, waited, max_wait)
+                except ratelimit.RateLimited:
+                    _requeue_rate_limited(e.message, e.wait, log_message)
+                    return False
+            else:
+                ratelimit.rate_limiter.add_wait(waited)
+                return sent
+
+
+def _requeue_rate_limited(message, wait, log_message):
+    """
+    Enqueues the message again to be sent after ``wait`` seconds.
     """
+    msg = "Sending rate limited, retrying in %.2f seconds." % wait
+    logger.info(msg)
+    message.add_log(msg)
+    kwargs = {'message_pk': message.pk, 'log_message': log_message}
+    transaction.on_commit(partial(tasks.send_email.apply_async, kwargs=kwargs, countdown=wait,
+                                  queue=message.get_celery_queue()))
+
+
+@transaction.atomic
+def _send_db_message(message_pk, log_message, connection, claim=None):
     try:
         # Lock the message
-        message = models.Message.objects.select_for_update().get(pk=message_pk)
+        if claim is None:
+            message = models.Message.objects.select_for_update().get(pk=message_pk)
+        else:
+            message = models.Message.objects.select_for_update(skip_locked=True) \
+                                            .filter(claim, pk=message_pk).first()
+            if message is None:
+                # Another worker is sending it or has already sent it.
+                return False
     except Exception:
         msg = 'Could not fetch and lock the message from the database'
         logger.exception(msg, extra={'message_pk': message_pk})
@@ -30,19 +241,30 @@ def send_db_message(message_pk, log_message=None):
 
     # Messages in STATUS_QUEUED can be sent to keep compatibility with previous yubin version.
     # In future versions that condition can be removed and only check `can_be_enqueued()`.
-    if message.status != models.Message.STATUS_QUEUED:
+    # Claimed messages were checked when they were claimed.
+    if claim is None and message.status != models.Message.STATUS_QUEUED:
         if not message.can_be_enqueued():
             msg = "Message can not be enqueued in it's current status."
             logger.warning(msg)
-            message.add_log(msg)
+            message.add_log(msg, level=logging.WARNING)
             return False
 
-    message.mark_as(models.Message.STATUS_QUEUED, log_message)
-    message.mark_as(models.Message.STATUS_IN_PROCESS, "Trying to send the message.")
-
     recipients = message.recipients()
-    if models.Blacklist.objects.filter(email__in=recipients).exists():
-        msg = "Not sending due blacklisted email in: %s" % recipients
+    blacklisted = blacklist.get_blacklisted(recipients)
+    if ratelimit.rate_limiter.enabled and not blacklisted and not settings.PAUSE_SEND:
+        # Nothing has been changed yet, the transaction is rolled back to wait.
+        limits = ratelimit.rate_limiter.get_limits(recipients, settings.USE_BACKEND)
+        wait = ratelimit.rate_limiter.try_acquire(limits)
+        if wait:
+            raise MessageRateLimited(message, wait)
+
+    message.mark_as(models.Message.STATUS_IN_PROCESS, enqueued=True)
+    if log_message is not None:
+        message.add_log(log_message, action=models.Message.STATUS_QUEUED)
+    message.add_log("Trying to send the message.")
+
+    if blacklisted:
+        msg = "Not sending due blacklisted email in: %s" % blacklisted
         logger.info(msg)
         message.mark_as(models.Message.STATUS_BLACKLISTED, msg)
         return False
@@ -54,8 +276,14 @@ def send_db_message(message_pk, log_message=None):
         return False
 
     try:
-        connection = get_connection(backend=settings.USE_BACKEND)
-        connection.send_messages([message.get_email_message()])
+        if connection is None:
+            connection = open_connection()
+            try:
+                send_email_message(connection, get_email_message(message, connection))
+            finally:
+                close_connection(connection)
+        else:
+            send_email_message(connection, get_email_message(message, connection))
         msg = "Message sent %s" % message
         logger.info(msg)
         message.mark_as(models.Message.STATUS_SENT, msg)
@@ -64,3 +292,95 @@ def send_db_message(message_pk, log_message=None):
         logger.exception("Message sending has failed", extra={'email_message': message})
         message.mark_as(models.Message.STATUS_FAILED, str(e))
         return False
+
+
+def send_db_messages(message_pks, log_message=None, claim=None):
+    """
+    Sends many django_yubin.models.Message by their PKs reusing the same backend
+    connection.
+
+    Every message is locked, sent and marked in its own transaction, so a failure
+    only affects its message. Look at ``send_db_message`` for ``claim``. Returns the
+    number of sent messages.
+    """
+    try:
+        connection = open_connection()
+    except Exception:
+        logger.exception('Could not open a shared connection, every message will open its own.')
+        connection = None
+
+    sent = 0
+    try:
+        for message_pk in message_pks:
+            sent += send_db_message(message_pk, log_message, connection=connection, claim=claim)
+    finally:
+        if connection is not None:
+            close_connection(connection, messages=len(message_pks))
+    return sent
+
+
+def get_email_message(message, connection):
+    """
+    Returns the EmailMessage to send the message through the connection.
+
+    When ``MAILER_SEND_RAW`` is enabled and the backend supports it, the stored
+    MIME message is sent as is instead of parsing and building it again.
+    """
+    if settings.MAILER_SEND_RAW and isinstance(connection, RAW_MESSAGE_BACKENDS):
+        return message.get_raw_email_message()
+    return message.get_email_message()
+
+
+def send_email_message(connection, email_message):
+    """
+    Sends an EmailMessage through the connection reconnecting once if the server has
+    dropped the session, for example after a timeout between messages of a batch.
+    """
+    try:
+        return connection.send_messages([email_message])
+    except smtplib.SMTPServerDisconnected:
+        logger.warning('The server has closed the connection, reconnecting.')
+        connection.close()
+        connection.open()
+        return connection.send_messages([email_message])
+
+
+def send_queued_messages(batch_size=100, created_before=None):
+    """
+    Claims up to ``batch_size`` queued messages, and created messages older than
+    ``created_before`` if given, by priority and sends them using the same connection.
+
+    Messages are picked with ``SELECT ... FOR UPDATE SKIP LOCKED`` and marked as in
+    process, with a lease of ``MAILER_CLAIM_TIMEOUT`` seconds in ``next_attempt_at``, in
+    the same transaction, so other workers don't pick them again. Then every message is
+    locked, sent and committed in its own transaction, skipping it if its lease has
+    expired and another worker has claimed it. Messages whose lease has expired, e.g.
+    because their worker has died, are queued again.
+
+    Returns the number of claimed messages.
+    """
+    statuses = Q(status=models.Message.STATUS_QUEUED)
+    if created_before is not None:
+        statuses |= Q(status=models.Message.STATUS_CREATED, date_created__lt=created_before)
+
+    claimed_at = now()
+    lease = claimed_at + timedelta(seconds=settings.MAILER_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        expired = models.Message.objects \
+            .filter(status=models.Message.STATUS_IN_PROCESS, next_attempt_at__lte=claimed_at) \
+            .update(status=models.Message.STATUS_QUEUED, next_attempt_at=None)
+        if expired:
+            logger.warning('%d claimed email(s) not sent in %d seconds, queued again.',
+                           expired, settings.MAILER_CLAIM_TIMEOUT)
+        message_pks = list(
+            models.Message.objects.select_for_update(skip_locked=True)
+            .filter(statuses)
+            .order_by('priority', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if message_pks:
+            models.Message.objects.filter(pk__in=message_pks) \
+                .update(status=models.Message.STATUS_IN_PROCESS, next_attempt_at=lease)
+    if message_pks:
+        send_db_messages(message_pks, claim=Q(status=models.Message.STATUS_IN_PROCESS, next_attempt_at=lease))
+    return len(message_pks)
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Message, MessageArchive
+
+
+class Command(BaseCommand):
+    help = ('Delete emails created before the given days, and archived emails sent before them, in batches, '
+            'each one in its own transaction, optionally limiting the emails deleted per second.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-d',
+            '--days',
+            type=int,
+            default=90,
+            help='Delete emails created before these days.',
+        )
+        parser.add_argument(
+            '-a',
+            '--archive-days',
+            type=int,
+            default=None,
+            help='Delete archived emails sent before these days. By default, the same days as emails.',
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of emails deleted in every transaction.',
+        )
+        parser.add_argument(
+            '-r',
+            '--rate',
+            type=float,
+            default=None,
+            help='Maximum number of emails deleted per second.',
+        )
+
+    def handle(self, *args, **options):
+        def progress(count):
+            if options['verbosity'] > 0:
+                self.stdout.write(f'{count} emails deleted...')
+
+        def archive_progress(count):
+            if options['verbosity'] > 0:
+                self.stdout.write(f'{count} archived emails deleted...')
+
+        (total, deleted), cutoff_date = Message.delete_old(options['days'], options['batch_size'], options['rate'],
+                                                           progress)
+        self.stdout.write(f'{deleted.get(Message._meta.label, 0)} emails created before {cutoff_date} deleted '
+                          f'({total} rows in total).')
+
+        archive_days = options['days'] if options['archive_days'] is None else options['archive_days']
+        (_, deleted), cutoff_date = MessageArchive.delete_old(archive_days, options['batch_size'], options['rate'],
+                                                              archive_progress)
+        self.stdout.write(f'{deleted.get(MessageArchive._meta.label, 0)} archived emails sent before {cutoff_date} '
+                          f'deleted.')
@@ -0,0 +1,95 @@
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.utils.timezone import now
+
+from ...engine import connection_pool, send_queued_messages
+from ...models import Message
+
+
+class Command(BaseCommand):
+    help = ('Send queued emails from the database without Celery. Many workers can run in parallel, '
+            'in the same or in different hosts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of emails claimed and sent at once by every thread.',
+        )
+        parser.add_argument(
+            '-c',
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Number of threads sending emails.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1,
+            help='Seconds to wait when there are no queued emails.',
+        )
+        parser.add_argument(
+            '--created-older-than',
+            type=int,
+            default=None,
+            help='Also send created emails older than these seconds, e.g. emails whose Celery task has been lost.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when there are no queued emails instead of waiting for new ones.',
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.claimed = 0
+        self.lock = threading.Lock()
+
+        threads = []
+        try:
+            if options['concurrency'] == 1:
+                self.work(options)
+            else:
+                threads = [threading.Thread(target=self.work, args=(options,))
+                           for _ in range(options['concurrency'])]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(0.5)
+        except KeyboardInterrupt:
+            # Let the threads finish sending their current batch.
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            connection_pool.clear()
+
+        # This output is checked in tests.
+        self.stdout.write('Claimed email(s): %d' % self.claimed)
+
+    def work(self, options):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                Message.dispatch_scheduled(options['batch_size'])
+                created_before = None
+                if options['created_older_than'] is not None:
+                    created_before = now() - timedelta(seconds=options['created_older_than'])
+                claimed = send_queued_messages(options['batch_size'], created_before)
+                with self.lock:
+                    self.claimed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                self.stop.wait(options['sleep'])
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_yubin', '0012_alter_blacklist_id_alter_log_id_alter_message_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='digest')),
+                ('data', models.BinaryField(verbose_name='data')),
+                ('size', models.PositiveIntegerField(verbose_name='size')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='references')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+            ],
+            options={
+                'verbose_name': 'blob',
+                'verbose_name_plural': 'blobs',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_yubin', '0013_blob'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='log',
+            options={'ordering': ('-date', '-id'), 'verbose_name': 'log', 'verbose_name_plural': 'logs'},
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='date'),
+        ),
+    ]
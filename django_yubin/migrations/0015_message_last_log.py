@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_yubin', '0014_log_date_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='last_log',
+            field=models.CharField(blank=True, help_text='Last status change, saved even if its log is not', max_length=255, verbose_name='last log'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Lower, Trim
+
+import django_yubin.models
+
+
+def normalize_addresses(apps, schema_editor):
+    """
+    Same normalization as ``Blacklist.normalize``, in chunks of primary keys. Databases without
+    Unicode-aware ``LOWER`` (SQLite) only lowercase ASCII characters.
+    """
+    Blacklist = apps.get_model('django_yubin', 'Blacklist')
+    queryset = Blacklist.objects.using(schema_editor.connection.alias)
+    bounds = queryset.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if bounds['min_pk'] is None:
+        return
+    batch_size = 10000
+    for start in range(bounds['min_pk'], bounds['max_pk'] + 1, batch_size):
+        queryset.filter(pk__gte=start, pk__lt=start + batch_size).update(address=Lower(Trim('email')))
+
+
+def delete_duplicates(apps, schema_editor):
+    """
+    Keeps the oldest row of every normalized address.
+    """
+    Blacklist = apps.get_model('django_yubin', 'Blacklist')
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        Blacklist.objects.using(db_alias)
+        .values('address')
+        .annotate(count=Count('pk'), first_pk=Min('pk'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates.iterator():
+        Blacklist.objects.using(db_alias).filter(address=duplicate['address']).exclude(
+            pk=duplicate['first_pk']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_yubin', '0015_message_last_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blacklist',
+            name='email',
+            field=models.CharField(help_text='An email address, @domain for all the addresses of a domain or @*.domain for all the addresses of its subdomains.', max_length=200, validators=[django_yubin.models.validate_blacklist_email], verbose_name='email'),
+        ),
+        migrations.AddField(
+            model_name='blacklist',
+            name='address',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200, verbose_name='address'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(normalize_addresses, migrations.RunPython.noop),
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='blacklist',
+            name='address',
+            field=models.CharField(editable=False, max_length=200, unique=True, verbose_name='address'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:23
+
+from django.db import migrations, models
+
+import django_yubin.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes are created concurrently on PostgreSQL.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0016_blacklist_address'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Now'), (1, 'High'), (3, 'Normal'), (5, 'Low')], default=3, verbose_name='priority'),
+        ),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['status', 'priority', 'id'], name='django_yubin_msg_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+import django_yubin.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes are created concurrently on PostgreSQL.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0017_message_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='send_at',
+            field=models.DateTimeField(blank=True, help_text='Date when a scheduled message is enqueued', null=True, verbose_name='send at'),
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='action',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Created'), (1, 'Queued'), (2, 'In process'), (3, 'Sent'), (4, 'Failed'), (5, 'Blacklisted'), (6, 'Discarded'), (7, 'Scheduled')], default=0, verbose_name='action'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Created'), (1, 'Queued'), (2, 'In process'), (3, 'Sent'), (4, 'Failed'), (5, 'Blacklisted'), (6, 'Discarded'), (7, 'Scheduled')], default=0),
+        ),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(condition=models.Q(('send_at__isnull', False)), fields=['status', 'send_at', 'id'], name='django_yubin_msg_schedule_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:29
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+from django.utils.timezone import now
+
+import django_yubin.operations
+
+
+def schedule_retries(apps, schema_editor):
+    """
+    Failed, blacklisted and discarded messages were retried on every sweep, they are due
+    now. In chunks of primary keys.
+    """
+    Message = apps.get_model('django_yubin', 'Message')
+    queryset = Message.objects.using(schema_editor.connection.alias).filter(status__in=(4, 5, 6))
+    bounds = queryset.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if bounds['min_pk'] is None:
+        return
+    next_attempt_at = now()
+    batch_size = 10000
+    for start in range(bounds['min_pk'], bounds['max_pk'] + 1, batch_size):
+        queryset.filter(pk__gte=start, pk__lt=start + batch_size).update(next_attempt_at=next_attempt_at)
+
+
+class Migration(migrations.Migration):
+    # Indexes are created concurrently on PostgreSQL.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0018_message_send_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='Date when a failed message is retried', null=True, verbose_name='next attempt at'),
+        ),
+        migrations.RunPython(schedule_retries, migrations.RunPython.noop),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(condition=models.Q(('next_attempt_at__isnull', False)), fields=['status', 'next_attempt_at', 'id'], name='django_yubin_msg_retry_idx'),
+        ),
+    ]
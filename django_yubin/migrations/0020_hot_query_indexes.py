@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:31
+
+from django.db import migrations, models
+
+import django_yubin.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes are created concurrently on PostgreSQL.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0019_message_next_attempt_at'),
+    ]
+
+    operations = [
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='log',
+            index=models.Index(fields=['date', 'id'], name='django_yubin_log_date_idx'),
+        ),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['status', 'date_created'], name='django_yubin_msg_status_idx'),
+        ),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['date_created'], name='django_yubin_msg_created_idx'),
+        ),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['date_sent'], name='django_yubin_msg_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:34
+
+from django.db import migrations, models, transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.utils.module_loading import import_string
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+# The storage backends of this app that saved emails in the message rows when this migration
+# was written. They are frozen here, so later changes of the storage backends don't change
+# what it does.
+DATABASE_STORAGES = frozenset([
+    'django_yubin.storage_backends.DatabaseStorageBackend',
+    'django_yubin.storage_backends.CompressedDatabaseStorageBackend',
+    'django_yubin.storage_backends.DeduplicatedDatabaseStorageBackend',
+])
+FILE_STORAGES = frozenset([
+    'django_yubin.storage_backends.FileStorageBackend',
+    'django_yubin.storage_backends.CompressedFileStorageBackend',
+    'django_yubin.storage_backends.DeduplicatedFileStorageBackend',
+])
+DATABASE_STORAGE_CLASS = 'django_yubin.storage_backends.DatabaseStorageBackend'
+
+
+def is_database_storage(storage):
+    """
+    Returns whether the storage backend ``storage`` saves emails in the database: it's one of
+    ``DATABASE_STORAGES``, or a custom backend that extends ``DatabaseStorageBackend``, found
+    by the names of its base classes.
+    """
+    if storage in DATABASE_STORAGES:
+        return True
+    if storage in FILE_STORAGES:
+        return False
+    try:
+        backend = import_string(storage)
+    except ImportError:
+        return False
+    return isinstance(backend, type) and any(
+        '%s.%s' % (base.__module__, base.__qualname__) == DATABASE_STORAGE_CLASS for base in backend.__mro__)
+
+
+def get_database_storages(Message, db_alias):
+    """
+    Returns the storage backends of the messages that save emails in the database.
+    """
+    storages = Message.objects.using(db_alias).values_list('storage', flat=True).order_by().distinct()
+    return [storage for storage in storages if is_database_storage(storage)]
+
+
+def move_bodies(apps, schema_editor):
+    """
+    Moves the emails of the database storage backends from the message rows to their bodies,
+    with an ``INSERT ... SELECT`` per chunk of primary keys. Every chunk is committed on its
+    own, so it can be stopped and run again.
+    """
+    Message = apps.get_model('django_yubin', 'Message')
+    MessageBody = apps.get_model('django_yubin', 'MessageBody')
+    connection = schema_editor.connection
+    db_alias = connection.alias
+    storages = get_database_storages(Message, db_alias)
+    if not storages:
+        return
+
+    messages = Message.objects.using(db_alias).filter(storage__in=storages).exclude(_message_data='')
+    bounds = messages.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if bounds['min_pk'] is None:
+        return
+    qn = connection.ops.quote_name
+    insert_sql = 'INSERT INTO %s (%s, %s) ' % (
+        qn(MessageBody._meta.db_table),
+        qn(MessageBody._meta.get_field('message').column),
+        qn(MessageBody._meta.get_field('data').column),
+    )
+    for start in range(bounds['min_pk'], bounds['max_pk'] + 1, BATCH_SIZE):
+        chunk = messages.filter(pk__gte=start, pk__lt=start + BATCH_SIZE)
+        select_sql, params = chunk.values_list('pk', '_message_data').query.get_compiler(db_alias).as_sql()
+        with transaction.atomic(using=db_alias):
+            with connection.cursor() as cursor:
+                cursor.execute(insert_sql + select_sql, params)
+            chunk.update(_message_data='')
+
+
+def restore_bodies(apps, schema_editor):
+    """
+    Moves the emails back from the bodies to the message rows.
+    """
+    Message = apps.get_model('django_yubin', 'Message')
+    MessageBody = apps.get_model('django_yubin', 'MessageBody')
+    db_alias = schema_editor.connection.alias
+    bodies = MessageBody.objects.using(db_alias)
+    bounds = bodies.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if bounds['min_pk'] is None:
+        return
+    for start in range(bounds['min_pk'], bounds['max_pk'] + 1, BATCH_SIZE):
+        with transaction.atomic(using=db_alias):
+            Message.objects.using(db_alias).filter(pk__gte=start, pk__lt=start + BATCH_SIZE, body__isnull=False) \
+                .update(_message_data=Subquery(bodies.filter(pk=OuterRef('pk')).values('data')[:1]))
+            bodies.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).delete()
+
+
+class Migration(migrations.Migration):
+    # Emails are moved in chunks committed one by one.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0020_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageBody',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='django_yubin.message', verbose_name='message')),
+                ('data', models.TextField(verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'message body',
+                'verbose_name_plural': 'message bodies',
+            },
+        ),
+        migrations.RunPython(move_bodies, restore_bodies),
+    ]
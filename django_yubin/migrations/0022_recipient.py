@@ -0,0 +1,91 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:38
+
+from email.utils import parseaddr
+
+from django.db import migrations, models, transaction
+from django.db.models import Max, Min
+import django.db.models.deletion
+
+import django_yubin.operations
+
+
+BATCH_SIZE = 1000
+
+KIND_TO = 0
+KIND_CC = 1
+KIND_BCC = 2
+
+
+def parse_recipients(to_address, cc_address, bcc_address):
+    """
+    Returns the ``(kind, address)`` pairs of the comma separated addresses of a message,
+    without duplicates, with the lowercase addresses without their display names.
+
+    It's a frozen copy of ``django_yubin.models.parse_recipients`` as it was when this
+    migration was written, so later changes of the models don't change what it does.
+    """
+    pairs = []
+    for kind, addresses in ((KIND_TO, to_address), (KIND_CC, cc_address), (KIND_BCC, bcc_address)):
+        for address in addresses.split(','):
+            address = (parseaddr(address)[1] or address).strip().lower()
+            if address and (kind, address) not in pairs:
+                pairs.append((kind, address))
+    return pairs
+
+
+def create_recipients(apps, schema_editor):
+    """
+    Creates the recipients of the existing messages with a bulk INSERT per chunk of primary
+    keys. Every chunk is committed on its own and skips the messages that already have
+    recipients, so it can be stopped and run again.
+    """
+    Message = apps.get_model('django_yubin', 'Message')
+    Recipient = apps.get_model('django_yubin', 'Recipient')
+    db_alias = schema_editor.connection.alias
+    messages = Message.objects.using(db_alias)
+    bounds = messages.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if bounds['min_pk'] is None:
+        return
+    for start in range(bounds['min_pk'], bounds['max_pk'] + 1, BATCH_SIZE):
+        chunk = messages.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).exclude(
+            pk__in=Recipient.objects.using(db_alias).filter(message_id__gte=start, message_id__lt=start + BATCH_SIZE)
+            .values('message_id'))
+        recipients = [
+            Recipient(message_id=pk, kind=kind, address=address)
+            for pk, to_address, cc_address, bcc_address in chunk.values_list(
+                'pk', 'to_address', 'cc_address', 'bcc_address')
+            for kind, address in parse_recipients(to_address, cc_address, bcc_address)
+        ]
+        with transaction.atomic(using=db_alias):
+            Recipient.objects.using(db_alias).bulk_create(recipients)
+
+
+class Migration(migrations.Migration):
+    # Recipients are created in chunks committed one by one, and their index is created
+    # concurrently on PostgreSQL after them.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0021_message_body'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'To'), (1, 'Cc'), (2, 'Bcc')], verbose_name='kind')),
+                ('address', models.CharField(max_length=254, verbose_name='address')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='django_yubin.message', verbose_name='message')),
+            ],
+            options={
+                'verbose_name': 'recipient',
+                'verbose_name_plural': 'recipients',
+            },
+        ),
+        migrations.RunPython(create_recipients, migrations.RunPython.noop),
+        django_yubin.operations.AddIndexConcurrently(
+            model_name='recipient',
+            index=models.Index(fields=['address', 'message'], name='django_yubin_rcpt_address_idx'),
+        ),
+    ]
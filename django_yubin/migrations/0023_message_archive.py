@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_yubin', '0022_recipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_address', models.TextField(verbose_name='to addresses')),
+                ('cc_address', models.TextField(blank=True, default='', verbose_name='cc addresses')),
+                ('bcc_address', models.TextField(blank=True, default='', verbose_name='bcc addresses')),
+                ('from_address', models.CharField(max_length=200, verbose_name='from address')),
+                ('subject', models.CharField(max_length=255, verbose_name='subject')),
+                ('_message_data', models.TextField(db_column='message_data', verbose_name='message data')),
+                ('storage', models.CharField(max_length=200, verbose_name='storage backend')),
+                ('date_created', models.DateTimeField(verbose_name='date created')),
+                ('date_sent', models.DateTimeField(blank=True, null=True, verbose_name='date sent')),
+                ('sent_count', models.PositiveSmallIntegerField(default=0, verbose_name='sent count')),
+                ('enqueued_count', models.PositiveSmallIntegerField(default=0, verbose_name='enqueued count')),
+                ('priority', models.PositiveSmallIntegerField(choices=[(0, 'Now'), (1, 'High'), (3, 'Normal'), (5, 'Low')], default=3, verbose_name='priority')),
+                ('last_log', models.CharField(blank=True, max_length=255, verbose_name='last log')),
+                ('log', models.TextField(blank=True, help_text='Logs of the message, one per line', verbose_name='log')),
+                ('date_archived', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date archived')),
+            ],
+            options={
+                'verbose_name': 'archived message',
+                'verbose_name_plural': 'archived messages',
+                'ordering': ('-date_sent',),
+                'indexes': [models.Index(fields=['date_sent', 'id'], name='django_yubin_arch_sent_idx')],
+            },
+        ),
+    ]
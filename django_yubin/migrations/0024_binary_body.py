@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:28
+
+import base64
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+
+BATCH_SIZE = 1000
+
+# The header of the compressed emails when this migration was written, frozen here like the
+# rest of this migration.
+COMPRESSION_HEADER = b'YUBIN '
+
+
+def to_text(data):
+    """
+    Returns the text form of an email saved as bytes: compressed emails are encoded with
+    base64 like the text compressed storage backends did, the rest are decoded.
+    """
+    if not data.startswith(COMPRESSION_HEADER):
+        return data.decode(settings.DEFAULT_CHARSET)
+    header, data = data.split(b'\n', 1)
+    return (header + b'+base64\n' + base64.b64encode(data)).decode('ascii')
+
+
+def restore_text_bodies(apps, schema_editor):
+    """
+    Moves the emails saved as bytes back to the text fields, in chunks committed one by one,
+    before the binary fields are removed.
+    """
+    db_alias = schema_editor.connection.alias
+    for model_name, data_field, binary_field in (('MessageBody', 'data', 'binary_data'),
+                                                 ('MessageArchive', '_message_data', '_binary_data')):
+        model = apps.get_model('django_yubin', model_name)
+        rows = model.objects.using(db_alias).filter(**{'%s__isnull' % binary_field: False})
+        while True:
+            with transaction.atomic(using=db_alias):
+                chunk = list(rows.values_list('pk', binary_field)[:BATCH_SIZE])
+                for pk, data in chunk:
+                    model.objects.using(db_alias).filter(pk=pk).update(
+                        **{data_field: to_text(bytes(data)), binary_field: None})
+            if len(chunk) < BATCH_SIZE:
+                break
+
+
+class Migration(migrations.Migration):
+    # Emails are moved back in chunks committed one by one.
+    atomic = False
+
+    dependencies = [
+        ('django_yubin', '0023_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagearchive',
+            name='_binary_data',
+            field=models.BinaryField(blank=True, db_column='binary_data', null=True, verbose_name='binary data'),
+        ),
+        migrations.AddField(
+            model_name='messagebody',
+            name='binary_data',
+            field=models.BinaryField(blank=True, null=True, verbose_name='binary data'),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, restore_text_bodies),
+    ]
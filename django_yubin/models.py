@@ -1,19 +1,28 @@
 import datetime
 import logging
 import email
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from email import policy
 from email import encoders as Encoders
 from email.mime.base import MIMEBase
+from email.utils import parseaddr
 from functools import partial
 
+from django.conf import settings as django_settings
 from django.core.exceptions import FieldError
+from django.core.validators import validate_email
 from django.core.mail.message import (
         ADDRESS_HEADERS,
         EmailMessage,
         EmailMultiAlternatives,
     )
-from django.db import models, transaction
-from django.db.models import F
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, Q, sql
+from django.db.models.functions import Greatest
 from django.utils.module_loading import import_string
 from django.utils.text import Truncator
 from django.utils.timezone import now
@@ -21,6 +30,8 @@ from django.utils.translation import gettext_lazy as _
 from mailparser import MailParser
 
 from . import mailparser_utils, tasks
+from . import settings as yubin_settings
+from .cache import LRUCache
 
 
 logger = logging.getLogger(__name__)
@@ -28,14 +39,168 @@ logger = logging.getLogger(__name__)
 
 PARSED_HEADERS_TO_IGNORE = ADDRESS_HEADERS.union({"content-type", "subject", "mime-version"})
 
+# Parsed messages shared by all the Message instances of the process.
+message_parser_cache = LRUCache(yubin_settings.MAILER_PARSER_CACHE_SIZE)
+
+# Logs waiting to be saved by the current ``log_buffer``.
+_buffered_logs = ContextVar('django_yubin_buffered_logs', default=None)
+
+# Blob references waiting to be added by the current ``blob_buffer``.
+_buffered_blobs = ContextVar('django_yubin_buffered_blobs', default=None)
+
+
+def log_enabled(level):
+    """
+    Returns if logs of the given logging ``level`` are saved according to ``MAILER_LOG_LEVEL``.
+    """
+    min_level = yubin_settings.MAILER_LOG_LEVEL
+    if isinstance(min_level, str):
+        min_level = logging.getLevelName(min_level.upper())
+    return level >= min_level
+
+
+def can_return_from_update(connection):
+    """
+    Returns if the new values of the counters of a message are returned by its UPDATE with
+    ``RETURNING`` instead of being read with another query.
+    """
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert)
+
+
+@contextmanager
+def log_buffer():
+    """
+    Collects the logs added with ``Message.add_log`` and saves all of them with a
+    single query per database when exiting, even if an exception has been raised.
+
+    Nested buffers are saved by the outermost one.
+    """
+    if _buffered_logs.get() is not None:
+        yield
+        return
+
+    logs = []
+    token = _buffered_logs.set(logs)
+    try:
+        yield
+    finally:
+        _buffered_logs.reset(token)
+        databases = defaultdict(list)
+        for log in logs:
+            databases[log._state.db].append(log)
+        for using, database_logs in databases.items():
+            Log.objects.using(using).bulk_create(database_logs)
+
+
+@contextmanager
+def blob_buffer():
+    """
+    Collects the references added with ``Blob.acquire`` and adds them when exiting
+    without errors, with a single query for all the references to the same blob.
+
+    Nested buffers are added by the outermost one.
+    """
+    if _buffered_blobs.get() is not None:
+        yield
+        return
+
+    blobs = {}
+    token = _buffered_blobs.set(blobs)
+    try:
+        yield
+    finally:
+        _buffered_blobs.reset(token)
+    # Always in the same order, so concurrent buffers don't deadlock.
+    for digest in sorted(blobs):
+        data, count = blobs[digest]
+        Blob.acquire(digest, data, count)
+
+
+def force_body_str(data):
+    """
+    Returns the email saved by a database storage backend, text or bytes, as text.
+    """
+    return data.decode(django_settings.DEFAULT_CHARSET) if isinstance(data, bytes) else data
+
+
+def force_body_bytes(data):
+    """
+    Returns the email saved by a database storage backend, text or bytes, as bytes.
+    """
+    return data if isinstance(data, bytes) else data.encode(django_settings.DEFAULT_CHARSET)
+
+
+class RawMIMEMessage(email.message.Message):
+    """
+    A MIME message that serializes already encoded data as is.
+    """
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+
+    def as_bytes(self, unixfrom=False, policy=None, linesep='\n'):
+        return self.data.replace(b'\r\n', b'\n').replace(b'\n', linesep.encode('ascii'))
+
+    def as_string(self, unixfrom=False, maxheaderlen=0, policy=None, linesep='\n'):
+        return self.as_bytes(linesep=linesep).decode(django_settings.DEFAULT_CHARSET)
+
+    __bytes__ = as_bytes
+    __str__ = as_string
+
+
+class RawEmailMessage(EmailMessage):
+    """
+    An EmailMessage that sends an already serialized MIME message without
+    parsing and building it again.
+
+    Only the envelope (sender and recipients) is taken from the arguments, the
+    headers and the content of the email are the ones in ``data``.
+    """
+    def __init__(self, data, from_email, to=None, cc=None, bcc=None):
+        super().__init__(from_email=from_email, to=to, cc=cc, bcc=bcc)
+        self.data = data
+
+    def message(self):
+        return RawMIMEMessage(self.data)
+
 
 class MessageQuerySet(models.QuerySet):
     def retryable(self, max_retries=0):
-        qs = self.filter(status__gte=self.model.STATUS_FAILED)
+        qs = self.filter(status__in=self.model.WARNING_STATUSES)
         if max_retries > 0:
             qs = qs.filter(enqueued_count__lt=max_retries)
         return qs
 
+    def for_recipient(self, email):
+        """
+        Returns the messages sent to ``email`` as to, cc or bcc recipient, looked up in
+        the index of their normalized ``Recipient`` addresses.
+        """
+        message_pks = Recipient.objects.filter(address=Recipient.normalize(email)).values('message_id')
+        return self.filter(pk__in=message_pks)
+
+    def oldest_pending(self):
+        """
+        Returns the date since the oldest created, queued or in process message is
+        pending, its sending date if it was scheduled or its creation date otherwise,
+        or ``None`` if there are no pending messages.
+
+        Every status is queried on its own, so every query only reads the first entry
+        of a range of the status indexes.
+        """
+        dates = []
+        for status in (self.model.STATUS_CREATED, self.model.STATUS_QUEUED, self.model.STATUS_IN_PROCESS):
+            messages = self.filter(status=status)
+            dates += [
+                messages.filter(send_at__isnull=True).order_by('date_created')
+                        .values_list('date_created', flat=True).first(),
+                messages.filter(send_at__isnull=False).order_by('send_at')
+                        .values_list('send_at', flat=True).first(),
+            ]
+        dates = [date for date in dates if date is not None]
+        return min(dates) if dates else None
+
 
 class MessageManager(models.Manager):
     def get_queryset(self):
@@ -44,6 +209,12 @@ class MessageManager(models.Manager):
     def retryable(self, max_retries=0):
         return self.get_queryset().retryable(max_retries=max_retries)
 
+    def for_recipient(self, email):
+        return self.get_queryset().for_recipient(email)
+
+    def oldest_pending(self):
+        return self.get_queryset().oldest_pending()
+
 
 class Message(models.Model):
     """
@@ -56,6 +227,10 @@ class Message(models.Model):
     STATUS_FAILED = 4
     STATUS_BLACKLISTED = 5
     STATUS_DISCARDED = 6
+    # Waiting for its ``send_at`` date to be enqueued.
+    STATUS_SCHEDULED = 7
+    # Statuses logged with WARNING level, the rest are logged with INFO level.
+    WARNING_STATUSES = (STATUS_FAILED, STATUS_BLACKLISTED, STATUS_DISCARDED)
     STATUS_CHOICES = (
         (STATUS_CREATED, _('Created')),
         (STATUS_QUEUED, _('Queued')),
@@ -64,8 +239,29 @@ class Message(models.Model):
         (STATUS_FAILED, _('Failed')),
         (STATUS_BLACKLISTED, _('Blacklisted')),
         (STATUS_DISCARDED, _('Discarded')),
+        (STATUS_SCHEDULED, _('Scheduled')),
     )
 
+    # Lower values are sent first.
+    PRIORITY_NOW = 0
+    PRIORITY_HIGH = 1
+    PRIORITY_NORMAL = 3
+    PRIORITY_LOW = 5
+    PRIORITY_CHOICES = (
+        (PRIORITY_NOW, _('Now')),
+        (PRIORITY_HIGH, _('High')),
+        (PRIORITY_NORMAL, _('Normal')),
+        (PRIORITY_LOW, _('Low')),
+    )
+    PRIORITIES = {
+        'now': PRIORITY_NOW,
+        'high': PRIORITY_HIGH,
+        'normal': PRIORITY_NORMAL,
+        'low': PRIORITY_LOW,
+    }
+    # Header to set the priority of an email, removed before saving it.
+    PRIORITY_HEADER = 'X-Mail-Queue-Priority'
+
     to_address = models.TextField(_('to addresses'))
     cc_address = models.TextField(_('cc addresses'), blank=True, default="")
     bcc_address = models.TextField(_('bcc addresses'), blank=True, default="")
@@ -74,9 +270,11 @@ class Message(models.Model):
     from_address = models.CharField(_('from address'), max_length=200)
     subject = models.CharField(_('subject'), max_length=255)
 
-    # This field is for internal use in storage backends. They can use it to save the email
-    # like the DatabaseSorageBackend, the file path like the FileStorageBackend, etc.
-    # Other users must access this data through the ``message_data`` property.
+    # This field is for internal use in storage backends. They can use it to save the file path
+    # like the FileStorageBackend, etc. The database storage backends save the email in its
+    # MessageBody, and only read it from this field in messages saved by previous versions.
+    # Other users must access this data through the ``message_bytes`` property or, when they need
+    # text, the ``message_data`` property.
     _message_data = models.TextField(_('message data'), db_column='message_data')
 
     @property
@@ -88,6 +286,18 @@ class Message(models.Model):
     def message_data(self, data):
         storage_backend = import_string(self.storage)
         storage_backend.set_message_data(self, data)
+        self._clear_message_parser()
+
+    @property
+    def message_bytes(self):
+        storage_backend = import_string(self.storage)
+        return storage_backend.get_message_bytes(self)
+
+    @message_bytes.setter
+    def message_bytes(self, data):
+        storage_backend = import_string(self.storage)
+        storage_backend.set_message_bytes(self, data)
+        self._clear_message_parser()
 
     storage = models.CharField(_('storage backend'), max_length=200, blank=False,
                                default="django_yubin.storage_backends.DatabaseStorageBackend")
@@ -100,19 +310,121 @@ class Message(models.Model):
     enqueued_count = models.PositiveSmallIntegerField(_('enqueued count'), default=0,
                                                       help_text=_('Times the message has been enqueued'))
     status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=STATUS_CREATED)
+    priority = models.PositiveSmallIntegerField(_('priority'), choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL)
+    last_log = models.CharField(_('last log'), max_length=255, blank=True,
+                                help_text=_('Last status change, saved even if its log is not'))
+    send_at = models.DateTimeField(_('send at'), null=True, blank=True,
+                                   help_text=_('Date when a scheduled message is enqueued'))
+    next_attempt_at = models.DateTimeField(_('next attempt at'), null=True, blank=True,
+                                           help_text=_('Date when a failed message is retried'))
 
     objects = MessageManager()
 
+    _message_parser = None
+
     class Meta:
         ordering = ('date_created',)
         verbose_name = _('message')
         verbose_name_plural = _('messages')
+        indexes = [
+            # Next messages to send.
+            models.Index(fields=['status', 'priority', 'id'], name='django_yubin_msg_queue_idx'),
+            # Next scheduled messages to enqueue. Partial, ordinary sends don't touch it.
+            models.Index(fields=['status', 'send_at', 'id'], name='django_yubin_msg_schedule_idx',
+                         condition=Q(send_at__isnull=False)),
+            # Next failed messages to retry. Partial, ordinary sends don't touch it.
+            models.Index(fields=['status', 'next_attempt_at', 'id'], name='django_yubin_msg_retry_idx',
+                         condition=Q(next_attempt_at__isnull=False)),
+            # Health check and admin status filter, ordered by date.
+            models.Index(fields=['status', 'date_created'], name='django_yubin_msg_status_idx'),
+            # Default ordering, admin date hierarchy and deletion of old messages.
+            models.Index(fields=['date_created'], name='django_yubin_msg_created_idx'),
+            # Admin date sent filter.
+            models.Index(fields=['date_sent'], name='django_yubin_msg_sent_idx'),
+        ]
+
+    # Body set by the database storage backends, saved with the message: text or, for the
+    # backends that save bytes, bytes.
+    _body_data = None
 
     def __init__(self, *args, **kwargs):
         if '_message_data' in kwargs:
-            raise FieldError("_message_data can not be used for creating instances, use message_data.")
+            raise FieldError("_message_data can not be used for creating instances, use message_bytes "
+                             "or message_data.")
         return super().__init__(*args, **kwargs)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            Recipient.objects.using(kwargs.get('using')).bulk_create(self.build_recipients())
+        if self._body_data is not None:
+            body = MessageBody.from_data(self, self._body_data)
+            body.save(force_insert=adding, using=kwargs.get('using'))
+            self._body_data = None
+
+    def _get_body(self):
+        """
+        Returns the email saved by the database storage backends, as text or bytes: the one
+        set since the message was saved, the one in its ``MessageBody`` or, in messages saved
+        by previous versions, the one in the message row.
+        """
+        if self._body_data is not None:
+            return self._body_data
+        if self.pk is not None:
+            try:
+                return self.body.get_data()
+            except MessageBody.DoesNotExist:
+                pass
+        return self._message_data
+
+    def get_body_data(self):
+        """
+        Returns the email saved by the database storage backends as text.
+        """
+        return force_body_str(self._get_body())
+
+    def get_body_bytes(self):
+        """
+        Returns the email saved by the database storage backends as bytes.
+        """
+        return force_body_bytes(self._get_body())
+
+    def set_body_data(self, data):
+        """
+        Sets the email saved by the database storage backends, saved with the message. Bytes
+        are saved in the binary field of its ``MessageBody``.
+        """
+        self._body_data = data
+        # Moved out of the message row of messages saved by previous versions.
+        self._message_data = ''
+
+    @classmethod
+    def save_bodies(cls, messages, using=None):
+        """
+        Saves the bodies of many messages created with ``bulk_create`` with a single INSERT.
+        """
+        bodies = [MessageBody.from_data(message, message._body_data)
+                  for message in messages if message._body_data is not None]
+        MessageBody.objects.using(using).bulk_create(bodies)
+        for message in messages:
+            message._body_data = None
+
+    def build_recipients(self):
+        """
+        Returns the unsaved ``Recipient`` rows of the message.
+        """
+        return [Recipient(message=self, kind=kind, address=address)
+                for kind, address in parse_recipients(self.to_address, self.cc_address, self.bcc_address)]
+
+    @classmethod
+    def save_recipients(cls, messages, using=None):
+        """
+        Saves the recipients of many messages created with ``bulk_create`` with a single INSERT.
+        """
+        Recipient.objects.using(using).bulk_create(
+            recipient for message in messages for recipient in message.build_recipients())
+
     def __str__(self):
         recipients = self.to_address
         if self.cc_address:
@@ -121,6 +433,34 @@ class Message(models.Model):
             recipients += ', %s' % self.bcc_address
         return '%s: %s' % (recipients, self.subject)
 
+    @classmethod
+    def get_priority(cls, value):
+        """
+        Returns the priority for a priority name (``now``, ``high``, ``normal`` or ``low``)
+        or number. Raises ``ValueError`` if it's not valid.
+        """
+        if isinstance(value, str):
+            value = value.strip().lower()
+            if value in cls.PRIORITIES:
+                return cls.PRIORITIES[value]
+            if value == 'now-not-queued':
+                # Old django-yubin priority, emails are always queued now.
+                return cls.PRIORITY_NOW
+        try:
+            priority = int(value)
+        except (TypeError, ValueError):
+            priority = None
+        if priority not in cls.PRIORITIES.values():
+            raise ValueError('Invalid email priority: %r' % (value,))
+        return priority
+
+    def get_celery_queue(self):
+        """
+        Returns the Celery queue for the priority of the message, if any.
+        """
+        names = {priority: name for name, priority in self.PRIORITIES.items()}
+        return yubin_settings.MAILER_CELERY_PRIORITY_QUEUES.get(names.get(self.priority))
+
     def to(self):
         return [email.strip() for email in self.to_address.split(",") if email.strip()]
 
@@ -134,8 +474,41 @@ class Message(models.Model):
         return self.to() + self.cc() + self.bcc()
 
     def get_message_parser(self):
-        message = email.message_from_string(self.message_data, policy=policy.default)
-        return MailParser(message)
+        """
+        Returns the parsed message.
+
+        It's cached in the instance and, if ``MAILER_PARSER_CACHE_SIZE`` is set, also in a
+        process-wide cache shared by all the instances of the same message.
+        """
+        if self._message_parser is None:
+            key = self._message_parser_cache_key()
+            parser = message_parser_cache.get(key) if key is not None else None
+            if parser is None:
+                data = self.message_bytes
+                parser = MailParser(email.message_from_bytes(data, policy=policy.default))
+                if key is not None:
+                    message_parser_cache.set(key, parser, len(data))
+            self._message_parser = parser
+        return self._message_parser
+
+    def _message_parser_cache_key(self):
+        return (self.pk, self.storage) if self.pk is not None else None
+
+    def _clear_message_parser(self):
+        self._message_parser = None
+        message_parser_cache.delete(self._message_parser_cache_key())
+
+    def get_raw_email_message(self):
+        """
+        Returns a RawEmailMessage that sends the stored MIME message as is.
+        """
+        return RawEmailMessage(
+            self.message_bytes,
+            from_email=self.from_address,
+            to=self.to(),
+            cc=self.cc(),
+            bcc=self.bcc(),
+        )
 
     def get_email_message(self):
         """
@@ -208,77 +581,441 @@ class Message(models.Model):
 
         return email
 
-    def add_log(self, log_message):
-        Log.objects.create(message=self, action=self.status, log_message=log_message)
+    def add_log(self, log_message, action=None, level=None):
+        """
+        Logs an action, by default the current status. The log is saved at once or,
+        inside a ``log_buffer``, when the buffer exits.
 
-    def mark_as(self, status, log_message=None):
-        should_refresh_from_db = False
+        Logs with a logging ``level`` lower than ``MAILER_LOG_LEVEL`` are not saved. By
+        default failures are logged with WARNING level and the rest with INFO level.
+        """
+        action = self.status if action is None else action
+        if level is None:
+            level = logging.WARNING if action in self.WARNING_STATUSES else logging.INFO
+        if not log_enabled(level):
+            return
 
-        self.status = status
-        if status is self.STATUS_SENT:
-            self.date_sent = now()
-            self.sent_count = F('sent_count') + 1
-            should_refresh_from_db = True
-        elif status is self.STATUS_QUEUED:
-            self.date_enqueued = now()
-            self.enqueued_count = F('enqueued_count') + 1
-            should_refresh_from_db = True
-        self.save()
+        log = Log(message=self, action=action, log_message=log_message)
+        logs = _buffered_logs.get()
+        if logs is None:
+            log.save()
+        else:
+            logs.append(log)
 
-        if should_refresh_from_db:
-            self.refresh_from_db()
+    def mark_as(self, status, log_message=None, enqueued=False):
+        """
+        Changes the status of the message and optionally logs it. The log message is
+        also saved as the last log of the message.
+
+        Marking it as queued, or passing ``enqueued=True`` with any other status,
+        also updates its enqueued date and counter. Marking it as sent updates its
+        sent date and counter. Marking it as failed, blacklisted or discarded
+        schedules its next retry.
+
+        Only these fields are updated, with a single query.
+        """
+        values, counters = {'status': status}, []
+        values['next_attempt_at'] = None
+        if status in self.WARNING_STATUSES:
+            values['next_attempt_at'] = now() + datetime.timedelta(seconds=self.get_retry_delay())
+        if log_message is not None:
+            values['last_log'] = Truncator(log_message).chars(255)
+        if status == self.STATUS_QUEUED or enqueued:
+            values['date_enqueued'] = now()
+            counters.append('enqueued_count')
+        if status == self.STATUS_SENT:
+            values['date_sent'] = now()
+            counters.append('sent_count')
+        self._update(values, counters)
 
         if log_message is not None:
             self.add_log(log_message)
 
+    def _update(self, values, counters=()):
+        """
+        Updates the ``values`` and increments the ``counters`` of the message with a
+        single UPDATE and sets their new values in the instance.
+
+        New counter values are returned by the UPDATE on databases that support it
+        and read with a narrow SELECT on the rest.
+        """
+        for field, value in values.items():
+            setattr(self, field, value)
+        if self.pk is None:
+            for field in counters:
+                setattr(self, field, getattr(self, field) + 1)
+            self.save()
+            return
+
+        values = dict(values, **{field: F(field) + 1 for field in counters})
+        queryset = Message.objects.using(self._state.db).filter(pk=self.pk)
+        connection = connections[queryset.db]
+        if not counters:
+            queryset.update(**values)
+            return
+        if can_return_from_update(connection):
+            query = queryset.query.chain(sql.UpdateQuery)
+            query.add_update_values(values)
+            update_sql, params = query.get_compiler(queryset.db).as_sql()
+            returning = ', '.join(connection.ops.quote_name(self._meta.get_field(field).column)
+                                  for field in counters)
+            with connection.cursor() as cursor:
+                cursor.execute('%s RETURNING %s' % (update_sql, returning), params)
+                new_values = cursor.fetchone()
+        else:
+            queryset.update(**values)
+            new_values = queryset.values_list(*counters).get()
+        for field, value in zip(counters, new_values):
+            setattr(self, field, value)
+
     def can_be_enqueued(self):
         return self.status in (
             self.STATUS_CREATED,
             self.STATUS_FAILED,
             self.STATUS_BLACKLISTED,
-            self.STATUS_DISCARDED
+            self.STATUS_DISCARDED,
+            self.STATUS_SCHEDULED,
         )
 
     def enqueue(self, log_message=None):
         """
-        Sends the task to enqueue the message on commit.
+        Sends the task to enqueue the message on commit or, when ``MAILER_USE_CELERY`` is
+        disabled, marks it as queued for the ``yubin_worker`` command.
         """
         if not self.can_be_enqueued():
-            self.add_log("Message can not be enqueued in it's current status")
+            self.add_log("Message can not be enqueued in it's current status", level=logging.WARNING)
             return False
 
-        transaction.on_commit(partial(tasks.send_email.delay, message_pk=self.pk, log_message=log_message))
+        if not yubin_settings.MAILER_USE_CELERY:
+            # The sending date and counter are updated when it's sent.
+            self._update({'status': self.STATUS_QUEUED})
+            if log_message is not None:
+                self.add_log(log_message)
+            return True
+
+        queue = self.get_celery_queue()
+        if queue:
+            transaction.on_commit(partial(tasks.send_email.apply_async,
+                                          kwargs={'message_pk': self.pk, 'log_message': log_message}, queue=queue))
+        else:
+            transaction.on_commit(partial(tasks.send_email.delay, message_pk=self.pk, log_message=log_message))
         return True
 
     @classmethod
-    def retry_messages(cls, max_retries=3):
-        enqueued = 0
-        messages = cls.objects.retryable(max_retries)
+    def enqueue_many(cls, messages, log_message=None):
+        """
+        Sends the tasks to enqueue the messages with a single callback on commit or, when
+        ``MAILER_USE_CELERY`` is disabled, marks them as queued with a single query.
+
+        Returns the number of messages that will be enqueued.
+        """
+        enqueued = []
         for message in messages:
-            enqueued += message.enqueue('Retry sending the email.')
-        failed = len(messages) - enqueued
+            if message.can_be_enqueued():
+                enqueued.append(message)
+            else:
+                message.add_log("Message can not be enqueued in it's current status", level=logging.WARNING)
+        if not enqueued:
+            return 0
+
+        message_pks = [message.pk for message in enqueued]
+        if not yubin_settings.MAILER_USE_CELERY:
+            cls.objects.filter(pk__in=message_pks).update(status=cls.STATUS_QUEUED)
+            with log_buffer():
+                for message in enqueued:
+                    message.status = cls.STATUS_QUEUED
+                    if log_message is not None:
+                        message.add_log(log_message)
+            return len(enqueued)
+
+        # A callback for every Celery queue, in priority order.
+        queues = {}
+        for message in sorted(enqueued, key=lambda message: message.priority):
+            queues.setdefault(message.get_celery_queue(), []).append(message.pk)
+        for queue, message_pks in queues.items():
+            transaction.on_commit(partial(send_emails_delay, message_pks, log_message=log_message, queue=queue))
+        return len(enqueued)
+
+    @classmethod
+    def _process_batches(cls, queryset, date_field, batch_size, process, after_batch=None):
+        """
+        Calls ``process`` with the messages of the ``queryset`` in batches of ``batch_size``
+        messages ordered by ``date_field`` and primary key, and ``after_batch``, if given,
+        with every batch once its transaction has finished.
+
+        Every batch is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` and processed in
+        its own transaction, and it continues after the last message of the previous one,
+        so many processes can run in parallel and, with an index on the filtered fields and
+        ``date_field``, no batch scans the messages already processed.
+        """
+        last = None
+        while True:
+            with transaction.atomic():
+                messages = queryset.select_for_update(skip_locked=True)
+                if last is not None:
+                    messages = messages.filter(Q(**{date_field + '__gt': last[0]}) |
+                                               Q(**{date_field: last[0], 'pk__gt': last[1]}))
+                messages = list(messages.order_by(date_field, 'pk')[:batch_size])
+                if not messages:
+                    return
+                # Before processing, that may change the dates.
+                last = (getattr(messages[-1], date_field), messages[-1].pk)
+                process(messages)
+            if after_batch is not None:
+                after_batch(messages)
+            if len(messages) < batch_size:
+                return
+
+    @classmethod
+    def dispatch_scheduled(cls, batch_size=500, until=None):
+        """
+        Enqueues the scheduled messages whose ``send_at`` date is before ``until``, by
+        default now, in batches of ``batch_size`` messages.
+
+        Returns the number of enqueued messages.
+        """
+        log_message = 'Scheduled sending date reached.'
+        enqueued = 0
+
+        def dispatch(messages):
+            nonlocal enqueued
+            cls.objects.filter(pk__in=[message.pk for message in messages]).update(
+                status=cls.STATUS_CREATED, last_log=log_message)
+            for message in messages:
+                message.status = cls.STATUS_CREATED
+            enqueued += cls.enqueue_many(messages, log_message)
+
+        queryset = cls.objects.filter(status=cls.STATUS_SCHEDULED, send_at__lte=until or now()) \
+                              .only('pk', 'send_at', 'status', 'priority')
+        cls._process_batches(queryset, 'send_at', batch_size, dispatch)
+        return enqueued
+
+    @classmethod
+    def retry_messages(cls, max_retries=3, batch_size=500):
+        """
+        Enqueues again the failed, blacklisted and discarded messages whose next attempt
+        date has been reached, in batches of ``batch_size`` messages. Messages that have
+        been enqueued ``max_retries`` times, if greater than zero, are not retried again.
+
+        The next attempt of the retried messages is postponed by their retry delay until
+        they change their status, so they are retried again if their task is lost.
+
+        Returns the number of enqueued messages and the number of messages that could not
+        be enqueued.
+        """
+        enqueued = failed = 0
+
+        def retry(messages):
+            nonlocal enqueued, failed
+            retried = []
+            for message in messages:
+                if max_retries <= 0 or message.enqueued_count < max_retries:
+                    message.next_attempt_at = now() + datetime.timedelta(seconds=message.get_retry_delay())
+                    retried.append(message)
+                else:
+                    # Exhausted, it's not due anymore.
+                    message.next_attempt_at = None
+            cls.objects.bulk_update(messages, ['next_attempt_at'])
+            count = cls.enqueue_many(retried, 'Retry sending the email.')
+            enqueued += count
+            failed += len(retried) - count
+
+        until = now()
+        for status in cls.WARNING_STATUSES:
+            # A status at a time, so every batch is an ordered range of the retry index.
+            queryset = cls.objects.filter(status=status, next_attempt_at__lte=until) \
+                                  .only('pk', 'next_attempt_at', 'status', 'priority', 'enqueued_count')
+            cls._process_batches(queryset, 'next_attempt_at', batch_size, retry)
         return enqueued, failed
 
+    def get_retry_delay(self):
+        """
+        Returns the seconds to wait before retrying the message, that grow exponentially
+        with the times it has been enqueued up to ``MAILER_RETRY_BACKOFF_MAX``, with a
+        random jitter so messages failed at once are not retried at once.
+        """
+        delay = min(yubin_settings.MAILER_RETRY_BACKOFF * 2 ** max(self.enqueued_count - 1, 0),
+                    yubin_settings.MAILER_RETRY_BACKOFF_MAX)
+        return random.uniform(delay / 2, delay)
+
+    @classmethod
+    def delete_old(cls, days=90, batch_size=1000, rate=None, progress=None):
+        """
+        Deletes mails created before `days` days in batches of ``batch_size`` messages,
+        oldest first, every batch in its own transaction.
+
+        Messages and the rows that depend on them are deleted with a DELETE per table, and
+        the storage objects of every batch are deleted in bulk once it's committed. With a
+        ``rate``, no more than ``rate`` messages are deleted per second. The progress is
+        logged after every batch and passed to ``progress``, if given, with the number of
+        deleted messages.
+
+        Returns the deletion data like Django's ``QuerySet.delete`` and the cutoff date.
+        """
+        cutoff_date = now() - datetime.timedelta(days)
+        queryset = cls.objects.filter(date_created__lt=cutoff_date) \
+                              .only('pk', 'date_created', 'storage', '_message_data')
+        return cls._delete_batches(queryset, 'date_created', batch_size, rate, progress), cutoff_date
+
     @classmethod
-    def delete_old(cls, days=90):
+    def _delete_batches(cls, queryset, date_field, batch_size, rate=None, progress=None):
+        """
+        Deletes the messages or archived messages of the ``queryset`` like ``delete_old``,
+        in batches ordered by ``date_field``.
+
+        Returns the deletion data like Django's ``QuerySet.delete``.
+        """
+        label = queryset.model._meta.label
+        deleted = Counter()
+        started = time.monotonic()
+
+        def delete(messages):
+            if yubin_settings.MAILER_STORAGE_DELETE:
+                for storage, storage_messages in cls._group_by_storage(messages).items():
+                    import_string(storage).prepare_delete_messages_data(storage_messages)
+                transaction.on_commit(partial(cls._delete_storage, messages), using=messages[0]._state.db)
+            deleted.update(cls._delete_rows(messages))
+
+        def throttle(messages):
+            count = deleted[label]
+            logger.info('Deleted %d %s.', count, queryset.model._meta.verbose_name_plural)
+            if progress is not None:
+                progress(count)
+            if rate:
+                wait = started + count / rate - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+
+        cls._process_batches(queryset, date_field, batch_size, delete, throttle)
+        deleted = {label: count for label, count in deleted.items() if count}
+        return sum(deleted.values()), deleted
+
+    @staticmethod
+    def _delete_rows(messages):
         """
-        Deletes mails created before `days` days.
+        Deletes the messages or archived messages and the rows that depend on them with a
+        DELETE per table, without sending signals nor deleting their storage objects.
 
-        Returns the deletion data from Django and the cuttoff date.
+        Returns the number of deleted rows by model, like ``QuerySet.delete``.
+        """
+        model = messages[0]._meta.model
+        using = messages[0]._state.db
+        pks = [message.pk for message in messages]
+        deleted = Counter()
+        for relation in model._meta.related_objects:
+            if relation.on_delete is not models.CASCADE:
+                continue
+            _, related_deleted = relation.related_model._base_manager.using(using).filter(
+                **{'%s__in' % relation.field.name: pks}).delete()
+            deleted.update(related_deleted)
+        deleted[model._meta.label] += model._base_manager.using(using).filter(pk__in=pks)._raw_delete(using)
+        for message in messages:
+            message._clear_message_parser()
+        return deleted
+
+    @classmethod
+    def archive_sent(cls, days=30, batch_size=500):
+        """
+        Moves the messages sent before `days` days to ``MessageArchive`` in batches of
+        ``batch_size`` messages, oldest first, every batch in its own transaction.
+
+        Emails saved by the database storage backends are moved to the archive and the rest
+        of storage objects are kept. The logs of every message are compacted into the
+        ``log`` field of its archive.
+
+        Returns the number of archived messages.
         """
         cutoff_date = now() - datetime.timedelta(days)
-        deleted = cls.objects.defer("_message_data").filter(date_created__lt=cutoff_date).delete()
-        return deleted, cutoff_date
+        statuses = dict(cls.STATUS_CHOICES)
+        archived = 0
+
+        def archive(messages):
+            nonlocal archived
+            using = messages[0]._state.db
+            pks = [message.pk for message in messages]
+            bodies = {
+                message_id: data if binary_data is None else bytes(binary_data)
+                for message_id, data, binary_data in MessageBody.objects.using(using).filter(message__in=pks)
+                .values_list('message_id', 'data', 'binary_data')
+            }
+            logs = defaultdict(list)
+            for message_id, date, action, log_message in Log.objects.using(using).filter(message__in=pks) \
+                    .order_by('date', 'pk').values_list('message_id', 'date', 'action', 'log_message'):
+                logs[message_id].append('%s %s: %s' % (date.isoformat(' ', 'seconds'), statuses.get(action, action),
+                                                       log_message))
+            MessageArchive.objects.using(using).bulk_create(
+                MessageArchive.from_message(message, bodies.get(message.pk, message._message_data),
+                                            '\n'.join(logs[message.pk]))
+                for message in messages
+            )
+            cls._delete_rows(messages)
+            archived += len(messages)
+
+        queryset = cls.objects.filter(status=cls.STATUS_SENT, date_sent__lt=cutoff_date)
+        cls._process_batches(queryset, 'date_sent', batch_size, archive)
+        return archived
+
+    @staticmethod
+    def _group_by_storage(messages):
+        """
+        Returns the messages grouped by their storage backend.
+        """
+        by_storage = defaultdict(list)
+        for message in messages:
+            by_storage[message.storage].append(message)
+        return by_storage
+
+    @staticmethod
+    def _delete_storage(messages):
+        """
+        Deletes the storage objects of deleted messages with a call per storage backend.
+        Failures are logged, the messages are already deleted.
+        """
+        for storage, storage_messages in Message._group_by_storage(messages).items():
+            try:
+                import_string(storage).delete_messages_data(storage_messages)
+            except Exception:
+                logger.exception('Could not delete the storage objects of %d messages', len(storage_messages),
+                                 extra={'storage': storage})
+
+
+def send_emails_delay(message_pks, log_message=None, queue=None):
+    """
+    Sends one task per message, to the given Celery ``queue`` if any.
+    """
+    for message_pk in message_pks:
+        if queue:
+            tasks.send_email.apply_async(kwargs={'message_pk': message_pk, 'log_message': log_message}, queue=queue)
+        else:
+            tasks.send_email.delay(message_pk=message_pk, log_message=log_message)
+
+
+def validate_blacklist_email(value):
+    """
+    Validates an email address or a domain rule: ``@example.com`` for the addresses of
+    a domain and ``@*.example.com`` for the addresses of its subdomains.
+    """
+    if value.startswith('@*.'):
+        value = 'blacklist' + value.replace('@*.', '@', 1)
+    elif value.startswith('@'):
+        value = 'blacklist' + value
+    validate_email(value)
 
 
 class Blacklist(models.Model):
     """
-    A blacklisted email address.
+    A blacklisted email address or domain.
 
     Messages attempted to be sent to e-mail addresses which appear on this
     blacklist will be skipped entirely.
+
+    ``address`` is the normalized ``email``, unique and indexed, that is used
+    for the lookups.
     """
-    email = models.EmailField(_('email'), max_length=200)
+    email = models.CharField(_('email'), max_length=200, validators=[validate_blacklist_email],
+                             help_text=_('An email address, @domain for all the addresses of a domain or '
+                                         '@*.domain for all the addresses of its subdomains.'))
+    address = models.CharField(_('address'), max_length=200, unique=True, editable=False)
     date_added = models.DateTimeField(_('date added'), default=now)
 
     class Meta:
@@ -289,6 +1026,319 @@ class Blacklist(models.Model):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        self.address = self.normalize(self.email)
+        if kwargs.get('update_fields') is not None and 'email' in kwargs['update_fields']:
+            kwargs['update_fields'] = {'address', *kwargs['update_fields']}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def normalize(email):
+        """
+        Returns the lowercase address without the display name.
+
+        >>> Blacklist.normalize(' John <John@Example.com>')
+        'john@example.com'
+        """
+        return (parseaddr(email)[1] or email).strip().lower()
+
+    @classmethod
+    def lookup_addresses(cls, email):
+        """
+        Returns the normalized addresses of the rules that blacklist ``email``: the address
+        itself, its domain and the wildcards of its parent domains.
+
+        >>> Blacklist.lookup_addresses('John@Mail.Example.com')
+        ['john@mail.example.com', '@mail.example.com', '@*.example.com', '@*.com']
+        """
+        address = cls.normalize(email)
+        _, at, domain = address.rpartition('@')
+        if not at or not domain:
+            return [address]
+        addresses = [address, '@' + domain]
+        labels = domain.split('.')
+        addresses.extend('@*.' + '.'.join(labels[i:]) for i in range(1, len(labels)))
+        return addresses
+
+    @classmethod
+    def get_blacklisted(cls, emails):
+        """
+        Returns the blacklisted ``emails`` with a single indexed query.
+        """
+        lookups = {email: cls.lookup_addresses(email) for email in emails}
+        if not lookups:
+            return []
+        addresses = {address for addresses in lookups.values() for address in addresses}
+        blacklisted = set(cls.objects.filter(address__in=addresses).values_list('address', flat=True))
+        return [email for email, addresses in lookups.items() if not blacklisted.isdisjoint(addresses)]
+
+
+def parse_recipients(to_address, cc_address='', bcc_address=''):
+    """
+    Returns the ``(kind, address)`` pairs of the comma separated addresses of a message,
+    without duplicates, with the addresses normalized by ``Recipient.normalize``.
+    """
+    pairs = []
+    for kind, addresses in ((Recipient.KIND_TO, to_address), (Recipient.KIND_CC, cc_address),
+                            (Recipient.KIND_BCC, bcc_address)):
+        for address in addresses.split(','):
+            address = Recipient.normalize(address)
+            if address and (kind, address) not in pairs:
+                pairs.append((kind, address))
+    return pairs
+
+
+class Recipient(models.Model):
+    """
+    A recipient of a message.
+
+    Recipients are saved when messages are created, with their normalized address, to
+    find the messages sent to an address with an indexed lookup.
+    """
+    KIND_TO = 0
+    KIND_CC = 1
+    KIND_BCC = 2
+    KIND_CHOICES = (
+        (KIND_TO, _('To')),
+        (KIND_CC, _('Cc')),
+        (KIND_BCC, _('Bcc')),
+    )
+
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, verbose_name=_('message'))
+    kind = models.PositiveSmallIntegerField(_('kind'), choices=KIND_CHOICES)
+    address = models.CharField(_('address'), max_length=254)
+
+    class Meta:
+        verbose_name = _('recipient')
+        verbose_name_plural = _('recipients')
+        indexes = [
+            # Messages sent to an address.
+            models.Index(fields=['address', 'message'], name='django_yubin_rcpt_address_idx'),
+        ]
+
+    def __str__(self):
+        return self.address
+
+    @staticmethod
+    def normalize(address):
+        """
+        Returns the lowercase address without the display name.
+
+        >>> Recipient.normalize(' John <John@Example.com>')
+        'john@example.com'
+        """
+        return Blacklist.normalize(address)
+
+
+class MessageBody(models.Model):
+    """
+    The email of a message saved by the database storage backends.
+
+    It's saved in its own table, so the queries of messages only read their metadata.
+    """
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, primary_key=True, related_name='body',
+                                   verbose_name=_('message'))
+    data = models.TextField(_('data'))
+    # Emails saved as bytes, like the compressed ones, instead of ``data``.
+    binary_data = models.BinaryField(_('binary data'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('message body')
+        verbose_name_plural = _('message bodies')
+
+    def __str__(self):
+        return str(self.message_id)
+
+    @classmethod
+    def from_data(cls, message, data):
+        """
+        Returns an unsaved body of ``message`` with the email ``data``, text or bytes.
+        """
+        if isinstance(data, bytes):
+            return cls(message=message, data='', binary_data=data)
+        return cls(message=message, data=data)
+
+    def get_data(self):
+        """
+        Returns the email, text or bytes if it was saved as bytes.
+        """
+        return self.data if self.binary_data is None else bytes(self.binary_data)
+
+
+class Blob(models.Model):
+    """
+    A big MIME part shared by several messages.
+
+    Deduplicated storage backends save big MIME parts once, identified by the SHA-256
+    of their content, and count the messages that reference them to delete them when
+    no message needs them anymore.
+    """
+    digest = models.CharField(_('digest'), max_length=64, unique=True)
+    data = models.BinaryField(_('data'))
+    size = models.PositiveIntegerField(_('size'))
+    ref_count = models.PositiveIntegerField(_('references'), default=0)
+    date_created = models.DateTimeField(_('date created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('blob')
+        verbose_name_plural = _('blobs')
+
+    def __str__(self):
+        return self.digest
+
+    @classmethod
+    def acquire(cls, digest, data, count=1):
+        """
+        Adds ``count`` references to the blob, creating it if it doesn't exist.
+
+        Inside a ``blob_buffer`` the references are added when exiting it.
+        """
+        buffered = _buffered_blobs.get()
+        if buffered is not None:
+            buffered[digest] = (data, buffered.get(digest, (data, 0))[1] + count)
+            return
+
+        if cls.objects.filter(digest=digest).update(ref_count=F('ref_count') + count):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(digest=digest, data=data, size=len(data), ref_count=count)
+        except IntegrityError:
+            # Created meanwhile by another process.
+            cls.objects.filter(digest=digest).update(ref_count=F('ref_count') + count)
+
+    @classmethod
+    def release(cls, digests):
+        """
+        Removes a reference to each blob, deleting the ones that are not referenced anymore.
+        Digests can be repeated, with an UPDATE per different digest.
+        """
+        if not digests:
+            return
+        for digest, count in Counter(digests).items():
+            cls.objects.filter(digest=digest, ref_count__gt=0).update(
+                ref_count=Greatest(F('ref_count') - count, 0))
+        cls.objects.filter(digest__in=digests, ref_count=0).delete()
+
+    @classmethod
+    def get_data(cls, digests):
+        """
+        Returns a dictionary with the content of the blobs by their digest.
+        """
+        return {
+            digest: bytes(data)
+            for digest, data in cls.objects.filter(digest__in=digests).values_list('digest', 'data')
+        }
+
+
+class MessageArchive(models.Model):
+    """
+    A sent message moved out of the ``Message`` table by ``Message.archive_sent``, with
+    the same primary key.
+
+    Its email is read with the storage backend of the message. Emails saved by the database
+    storage backends are saved in the archive itself.
+    """
+    id = models.BigIntegerField(_('ID'), primary_key=True)
+    to_address = models.TextField(_('to addresses'))
+    cc_address = models.TextField(_('cc addresses'), blank=True, default="")
+    bcc_address = models.TextField(_('bcc addresses'), blank=True, default="")
+    from_address = models.CharField(_('from address'), max_length=200)
+    subject = models.CharField(_('subject'), max_length=255)
+    # Like ``Message._message_data`` in messages saved by previous versions: the email for the
+    # database storage backends and the file path for the file storage backends.
+    _message_data = models.TextField(_('message data'), db_column='message_data')
+    # Like ``MessageBody.binary_data``, the emails saved as bytes instead of ``_message_data``.
+    _binary_data = models.BinaryField(_('binary data'), null=True, blank=True, db_column='binary_data')
+    storage = models.CharField(_('storage backend'), max_length=200)
+    date_created = models.DateTimeField(_('date created'))
+    date_sent = models.DateTimeField(_('date sent'), null=True, blank=True)
+    sent_count = models.PositiveSmallIntegerField(_('sent count'), default=0)
+    enqueued_count = models.PositiveSmallIntegerField(_('enqueued count'), default=0)
+    priority = models.PositiveSmallIntegerField(_('priority'), choices=Message.PRIORITY_CHOICES,
+                                                default=Message.PRIORITY_NORMAL)
+    last_log = models.CharField(_('last log'), max_length=255, blank=True)
+    log = models.TextField(_('log'), blank=True, help_text=_('Logs of the message, one per line'))
+    date_archived = models.DateTimeField(_('date archived'), default=now)
+
+    class Meta:
+        ordering = ('-date_sent',)
+        verbose_name = _('archived message')
+        verbose_name_plural = _('archived messages')
+        indexes = [
+            # Default ordering, admin date hierarchy and deletion of old archived messages.
+            models.Index(fields=['date_sent', 'id'], name='django_yubin_arch_sent_idx'),
+        ]
+
+    _message_parser = None
+
+    def __str__(self):
+        return '%s: %s' % (self.to_address, self.subject)
+
+    @classmethod
+    def delete_old(cls, days=90, batch_size=1000, rate=None, progress=None):
+        """
+        Deletes the archived messages sent before `days` days in batches of ``batch_size``
+        archived messages, oldest first, like ``Message.delete_old``, deleting their storage
+        objects in bulk once every batch is committed.
+
+        Returns the deletion data like Django's ``QuerySet.delete`` and the cutoff date.
+        """
+        cutoff_date = now() - datetime.timedelta(days)
+        queryset = cls.objects.filter(date_sent__lt=cutoff_date) \
+                              .only('pk', 'date_sent', 'storage', '_message_data')
+        return Message._delete_batches(queryset, 'date_sent', batch_size, rate, progress), cutoff_date
+
+    @classmethod
+    def from_message(cls, message, data, log=''):
+        """
+        Returns an unsaved archive of ``message``, with the ``data`` of its storage backend,
+        text or the bytes of a database storage backend.
+        """
+        binary_data = None
+        if isinstance(data, bytes):
+            data, binary_data = '', data
+        return cls(id=message.pk, to_address=message.to_address, cc_address=message.cc_address,
+                   bcc_address=message.bcc_address, from_address=message.from_address, subject=message.subject,
+                   _message_data=data, _binary_data=binary_data, storage=message.storage,
+                   date_created=message.date_created, date_sent=message.date_sent, sent_count=message.sent_count,
+                   enqueued_count=message.enqueued_count, priority=message.priority,
+                   last_log=message.last_log, log=log)
+
+    @property
+    def message_data(self):
+        return import_string(self.storage).get_message_data(self)
+
+    @property
+    def message_bytes(self):
+        return import_string(self.storage).get_message_bytes(self)
+
+    def _get_body(self):
+        return self._message_data if self._binary_data is None else bytes(self._binary_data)
+
+    def get_body_data(self):
+        """
+        Returns the email saved by the database storage backends as text.
+        """
+        return force_body_str(self._get_body())
+
+    def get_body_bytes(self):
+        """
+        Returns the email saved by the database storage backends as bytes.
+        """
+        return force_body_bytes(self._get_body())
+
+    def get_message_parser(self):
+        """
+        Returns the parsed message, cached in the instance.
+        """
+        if self._message_parser is None:
+            self._message_parser = MailParser(email.message_from_bytes(self.message_bytes, policy=policy.default))
+        return self._message_parser
+
+    def _clear_message_parser(self):
+        self._message_parser = None
+
 
 class Log(models.Model):
     """
@@ -297,11 +1347,16 @@ class Log(models.Model):
     message = models.ForeignKey(Message, verbose_name=_('message'), editable=False, on_delete=models.CASCADE)
     action = models.PositiveSmallIntegerField(_('action'), choices=Message.STATUS_CHOICES,
                                               default=Message.STATUS_CREATED)
-    date = models.DateTimeField(_('date'), auto_now_add=True)
+    # Not auto_now_add, buffered logs must keep the date of the action and not the one when they are saved.
+    date = models.DateTimeField(_('date'), default=now, editable=False)
     log_message = models.TextField(_('log'), blank=True)
 
     class Meta:
-        ordering = ('-date',)
+        ordering = ('-date', '-id')
+        indexes = [
+            # Default ordering.
+            models.Index(fields=['date', 'id'], name='django_yubin_log_date_idx'),
+        ]
         verbose_name = _('log')
         verbose_name_plural = _('logs')
 
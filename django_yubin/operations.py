@@ -0,0 +1,43 @@
+"""
+Migration operations.
+"""
+
+from django.db import NotSupportedError
+from django.db.migrations.operations import AddIndex
+
+
+class AddIndexConcurrently(AddIndex):
+    """
+    Adds an index without locking the table against writes while it's built, with
+    ``CREATE INDEX CONCURRENTLY``, on PostgreSQL and like ``AddIndex`` on the rest of
+    databases.
+
+    Unlike ``django.contrib.postgres.operations.AddIndexConcurrently`` it can be used in
+    migrations that run on any database. Migrations using it must set ``atomic = False``.
+    """
+
+    def describe(self):
+        return 'Concurrently create index %s on %s' % (self.index.name, self.model_name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+    def _ensure_not_in_transaction(self, schema_editor):
+        if schema_editor.connection.in_atomic_block:
+            raise NotSupportedError(
+                'The %s operation cannot be executed inside a transaction, set Migration.atomic = False.'
+                % self.__class__.__name__
+            )
@@ -0,0 +1,178 @@
+"""
+Rate limits of the sent emails shared by all the processes.
+"""
+
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+class RateLimited(Exception):
+    """
+    The email can't be sent before ``wait`` seconds.
+    """
+    def __init__(self, wait):
+        super().__init__('Rate limit exceeded, wait %.2f seconds' % wait)
+        self.wait = wait
+
+
+def parse_rate(rate):
+    """
+    Returns the ``(number, seconds)`` of a rate like ``'10/s'``, ``'100/m'`` or ``'1000/h'``.
+    ``(number, seconds)`` tuples are returned as is.
+    """
+    if isinstance(rate, (tuple, list)):
+        number, seconds = rate
+        return int(number), float(seconds)
+    number, _, period = str(rate).partition('/')
+    try:
+        return int(number), PERIODS[period.strip().lower()[:1]]
+    except (KeyError, ValueError):
+        raise ValueError('Invalid rate: %r' % (rate,))
+
+
+class RateLimiter:
+    """
+    Limits the number of emails sent in every time window, globally, per backend and
+    per recipient domain.
+
+    Tokens are counted with ``add`` and ``incr`` of a Django cache, that must be shared
+    by all the processes sending emails, in fixed windows of the rate period: a
+    ``'10/s'`` rate allows 10 emails every second. An email takes a token from every
+    limit that applies to it; when any of them is exhausted, the rest are given back
+    and it has to wait until the window ends.
+
+    ``waits`` counts the emails that have waited, ``wait_time`` the total seconds they
+    have slept, ``max_wait_time`` the longest wait of a single email and ``requeues``
+    the emails that would have had to wait too much.
+    """
+    KEY_PREFIX = 'django_yubin:ratelimit'
+
+    def __init__(self, rate=None, backends=None, domains=None, cache_alias='default'):
+        self.rate = parse_rate(rate) if rate else None
+        self.backends = {backend: parse_rate(rate) for backend, rate in (backends or {}).items()}
+        self.domains = {domain.lower(): parse_rate(rate) for domain, rate in (domains or {}).items()}
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self.waits = self.requeues = 0
+        self.wait_time = self.max_wait_time = 0.0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.backends or self.domains)
+
+    def get_limits(self, recipients, backend=None):
+        """
+        Returns the ``(scope, (number, seconds))`` limits that apply to an email.
+        """
+        limits = []
+        if self.rate:
+            limits.append(('global', self.rate))
+        if backend in self.backends:
+            limits.append(('backend:%s' % backend, self.backends[backend]))
+        if self.domains:
+            domains = sorted({email.rpartition('@')[2].strip().lower() for email in recipients})
+            for domain in domains:
+                # Every domain without its own limit has its own '*' limit.
+                rate = self.domains.get(domain) or self.domains.get('*')
+                if rate:
+                    limits.append(('domain:%s' % domain, rate))
+        return limits
+
+    def try_acquire(self, limits, now=None):
+        """
+        Takes a token of every limit. Returns 0 if all of them have been taken, otherwise
+        gives them back and returns the seconds to wait for the next window.
+        """
+        now = time.time() if now is None else now
+        taken = []
+        for scope, (number, seconds) in limits:
+            window = int(now // seconds)
+            key = '%s:%s:%d' % (self.KEY_PREFIX, scope, window)
+            self.cache.add(key, 0, timeout=int(seconds) + 1)
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                # Expired between add and incr.
+                self.cache.add(key, 1, timeout=int(seconds) + 1)
+                count = 1
+            taken.append(key)
+            if count > number:
+                for key in taken:
+                    try:
+                        self.cache.decr(key)
+                    except ValueError:
+                        pass
+                return (window + 1) * seconds - now
+        return 0
+
+    def acquire(self, recipients, backend=None, max_wait=None):
+        """
+        Waits until the email can be sent. Raises ``RateLimited`` if it should wait more
+        than ``max_wait`` seconds in total, ``None`` waits as long as needed.
+
+        Returns the seconds waited.
+        """
+        limits = self.get_limits(recipients, backend)
+        waited = 0.0
+        while limits:
+            wait = self.try_acquire(limits)
+            if not wait:
+                break
+            waited = self.sleep(wait, waited, max_wait)
+        self.add_wait(waited)
+        return waited
+
+    def sleep(self, wait, waited=0.0, max_wait=None):
+        """
+        Sleeps ``wait`` seconds more after having waited ``waited`` seconds, or raises
+        ``RateLimited`` if it should wait more than ``max_wait`` seconds in total.
+
+        Returns the seconds waited in total.
+        """
+        if max_wait is not None and waited + wait > max_wait:
+            with self._lock:
+                self.requeues += 1
+            raise RateLimited(wait)
+        time.sleep(wait)
+        return waited + wait
+
+    def add_wait(self, waited):
+        """
+        Adds the seconds an email has waited to the stats.
+        """
+        if waited:
+            logger.debug('Sending rate limited, waited %.2f seconds', waited)
+            with self._lock:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+    def stats(self):
+        return {
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+            'requeues': self.requeues,
+        }
+
+
+rate_limiter = RateLimiter(
+    rate=settings.MAILER_RATE_LIMIT,
+    backends=settings.MAILER_RATE_LIMIT_BACKENDS,
+    domains=settings.MAILER_RATE_LIMIT_DOMAINS,
+    cache_alias=settings.MAILER_RATE_LIMIT_CACHE_ALIAS,
+)
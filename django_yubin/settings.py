@@ -1,12 +1,29 @@
+import logging
+
 from django.conf import settings
 
 
 # Provide a way of temporarily pausing the sending of mail.
 PAUSE_SEND = getattr(settings, "MAILER_PAUSE_SEND", False)
 
+# Send emails with Celery tasks. When False, queued emails are sent by the yubin_worker command.
+MAILER_USE_CELERY = getattr(settings, "MAILER_USE_CELERY", True)
+
+# Emails claimed by the yubin_worker command that haven't been sent after these seconds, e.g. because the
+# worker has died, are queued again. It should be longer than sending a batch of emails.
+MAILER_CLAIM_TIMEOUT = getattr(settings, "MAILER_CLAIM_TIMEOUT", 600)
+
+# Celery queues of the send_email tasks of every priority ("now", "high", "normal" and "low"). Emails with
+# priorities without a queue use the default one.
+MAILER_CELERY_PRIORITY_QUEUES = getattr(settings, "MAILER_CELERY_PRIORITY_QUEUES", {})
+
 # Real backend to send emails.
 USE_BACKEND = getattr(settings, 'MAILER_USE_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 
+# Send the stored MIME messages as is, without parsing and building them again, when the real
+# backend supports it.
+MAILER_SEND_RAW = getattr(settings, 'MAILER_SEND_RAW', False)
+
 # When MAILER_TEST_MODE is True, recipient addresses of all messages are replaced with
 # the email addresses set in MAILER_TEST_EMAIL before being sent.
 MAILER_TEST_MODE = getattr(settings, "MAILER_TEST_MODE", False)
@@ -23,8 +40,61 @@ MAILER_STORAGE_BACKEND = getattr(
     "django_yubin.storage_backends.DatabaseStorageBackend",
 )
 
+# Compression used by the compressed storage backends: "zlib" or "lzma".
+MAILER_STORAGE_COMPRESSION = getattr(settings, "MAILER_STORAGE_COMPRESSION", "zlib")
+
+# MIME parts of this size or bigger are saved only once by the deduplicated storage backends.
+MAILER_STORAGE_BLOB_MIN_SIZE = getattr(settings, "MAILER_STORAGE_BLOB_MIN_SIZE", 16 * 1024)
+
+# Minimum level of the message logs saved in the database, as a python logging level or its name.
+# Failures are logged with WARNING level and the rest with INFO level.
+MAILER_LOG_LEVEL = getattr(settings, "MAILER_LOG_LEVEL", logging.INFO)
+
+# Failed, blacklisted and discarded messages are retried after these seconds, doubled after every
+# attempt up to MAILER_RETRY_BACKOFF_MAX seconds. Every delay is randomly shortened up to a half.
+MAILER_RETRY_BACKOFF = getattr(settings, "MAILER_RETRY_BACKOFF", 60)
+MAILER_RETRY_BACKOFF_MAX = getattr(settings, "MAILER_RETRY_BACKOFF_MAX", 3600)
+
 # Delete storage data when deleting messages from the database.
 MAILER_STORAGE_DELETE = getattr(settings, "MAILER_STORAGE_DELETE", True)
 
+# Threads deleting the files of old messages at once with ``delete_old_emails``.
+MAILER_STORAGE_DELETE_THREADS = getattr(settings, "MAILER_STORAGE_DELETE_THREADS", 4)
+
+# Maximum size in bytes of the emails whose parsed messages are cached in every process. Zero
+# disables the cache.
+MAILER_PARSER_CACHE_SIZE = getattr(settings, "MAILER_PARSER_CACHE_SIZE", 0)
+
 # Subdirectory to save emails when using the FileStorageBackend.
 MAILER_FILE_STORAGE_DIR = getattr(settings, "MAILER_FILE_STORAGE_DIR", 'yubin')
+
+# Keep a process-local copy of the blacklist, reloaded when the blacklist changes. Processes are notified
+# of changes through the Django cache MAILER_BLACKLIST_CACHE_ALIAS, that must be shared by all of them.
+MAILER_BLACKLIST_CACHE = getattr(settings, "MAILER_BLACKLIST_CACHE", False)
+MAILER_BLACKLIST_CACHE_ALIAS = getattr(settings, "MAILER_BLACKLIST_CACHE_ALIAS", "default")
+
+# Check blacklisted emails with a process-local Bloom filter before querying the database, with this
+# false positive rate. Filters can be saved in a file shared by all the processes.
+MAILER_BLACKLIST_FILTER = getattr(settings, "MAILER_BLACKLIST_FILTER", False)
+MAILER_BLACKLIST_FILTER_ERROR_RATE = getattr(settings, "MAILER_BLACKLIST_FILTER_ERROR_RATE", 0.001)
+MAILER_BLACKLIST_FILTER_FILE = getattr(settings, "MAILER_BLACKLIST_FILTER_FILE", None)
+
+# Keep a process-local pool of open connections of the real backend to reuse them between messages.
+MAILER_CONNECTION_POOL = getattr(settings, "MAILER_CONNECTION_POOL", False)
+
+# Pooled connections are closed after sending this number of messages...
+MAILER_CONNECTION_POOL_MAX_MESSAGES = getattr(settings, "MAILER_CONNECTION_POOL_MAX_MESSAGES", 100)
+
+# ... or after being idle for this number of seconds.
+MAILER_CONNECTION_POOL_MAX_IDLE = getattr(settings, "MAILER_CONNECTION_POOL_MAX_IDLE", 60)
+
+# Maximum rate of sent emails shared by all the processes, like "10/s", "600/m" or "10000/h", globally,
+# per backend path and per recipient domain ("*" limits every other domain on its own). Emails wait until
+# they can be sent, up to MAILER_RATE_LIMIT_MAX_WAIT seconds when sent by Celery, after that they are
+# enqueued again to be sent when the limit allows it. Tokens are counted in the Django cache
+# MAILER_RATE_LIMIT_CACHE_ALIAS, that must be shared by all the processes.
+MAILER_RATE_LIMIT = getattr(settings, "MAILER_RATE_LIMIT", None)
+MAILER_RATE_LIMIT_BACKENDS = getattr(settings, "MAILER_RATE_LIMIT_BACKENDS", {})
+MAILER_RATE_LIMIT_DOMAINS = getattr(settings, "MAILER_RATE_LIMIT_DOMAINS", {})
+MAILER_RATE_LIMIT_MAX_WAIT = getattr(settings, "MAILER_RATE_LIMIT_MAX_WAIT", 5)
+MAILER_RATE_LIMIT_CACHE_ALIAS = getattr(settings, "MAILER_RATE_LIMIT_CACHE_ALIAS", "default")
@@ -1,11 +1,29 @@
-from django.db.models.signals import post_delete
+import time
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.utils.module_loading import import_string
 
-from . import settings as yubin_settings
+from . import blacklist, settings as yubin_settings
+
+
+@receiver(pre_delete, sender='django_yubin.Message', dispatch_uid='django_yubin_prepare_delete_storage')
+@receiver(pre_delete, sender='django_yubin.MessageArchive', dispatch_uid='django_yubin_prepare_delete_archive_storage')
+def prepare_delete_message_storage_callback(sender, **kwargs):
+    """
+    Lets storage backends read what they need to delete the storage objects before the
+    rows that depend on the message, like its body, are deleted.
+    """
+    if yubin_settings.MAILER_STORAGE_DELETE:
+        message = kwargs['instance']
+        storage_backend = import_string(message.storage)
+        storage_backend.prepare_delete_message_data(message)
 
 
 @receiver(post_delete, sender='django_yubin.Message', dispatch_uid='django_yubin_delete_storage')
+@receiver(post_delete, sender='django_yubin.MessageArchive', dispatch_uid='django_yubin_delete_archive_storage')
 def delete_message_storage_callback(sender, **kwargs):
     """
     Deleting storage objects in the post_delete signal assures that they will be deleted always:
@@ -17,3 +35,28 @@ def delete_message_storage_callback(sender, **kwargs):
         message = kwargs['instance']
         storage_backend = import_string(message.storage)
         storage_backend.delete_message_data(message)
+
+
+@receiver(post_delete, sender='django_yubin.Message', dispatch_uid='django_yubin_delete_message_parser')
+def delete_message_parser_callback(sender, **kwargs):
+    """
+    Removes the deleted message from the process-wide cache of parsed messages.
+    """
+    kwargs['instance']._clear_message_parser()
+
+
+@receiver(post_save, sender='django_yubin.Blacklist', dispatch_uid='django_yubin_save_blacklist')
+@receiver(post_delete, sender='django_yubin.Blacklist', dispatch_uid='django_yubin_delete_blacklist')
+def invalidate_blacklist_callback(sender, **kwargs):
+    """
+    Invalidates the process-local blacklists and filters once the change is committed, so no
+    process can load the old blacklist with the new version.
+
+    Modified and deleted rows make every process use a new filter, once per transaction. ``bulk_create``,
+    ``update`` and raw queries don't send these signals, call ``blacklist.invalidate``
+    after using them.
+    """
+    if yubin_settings.MAILER_BLACKLIST_CACHE or yubin_settings.MAILER_BLACKLIST_FILTER:
+        modified = kwargs.get('created') is not True
+        transaction.on_commit(partial(blacklist.invalidate, modified=modified, changed_at=time.monotonic()),
+                              using=kwargs.get('using'))
@@ -1,19 +1,39 @@
+import base64
+import email
+import hashlib
 import logging
+import lzma
 import os
+import zlib
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
 from uuid import uuid4
 
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.db.models import prefetch_related_objects
 from django.utils.module_loading import import_string
 
 from . import settings as yubin_settings
-from .models import Message
+from .models import Blob, Message, MessageBody
 
 
 logger = logging.getLogger(__name__)
 
+# Compressed emails start with a header line like b"YUBIN zlib\n" or b"YUBIN lzma+base64\n". RFC 822
+# header names can't have spaces, so it can't be confused with the first line of an email.
+COMPRESSION_HEADER = b'YUBIN '
+
+COMPRESSION_CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# Header of the MIME parts whose content has been moved to a Blob, its value is the blob digest.
+BLOB_HEADER = 'X-Yubin-Blob'
+
 
 class StorageBackendException(Exception):
     pass
@@ -32,6 +52,61 @@ class BaseStorageBackend(ABC):
     @abstractmethod
     def delete_message_data(cls, message): pass
 
+    @classmethod
+    def has_message_data(cls, message):
+        """
+        Returns if an email has been saved for the message.
+        """
+        return bool(message._message_data)
+
+    @classmethod
+    def prepare_delete_message_data(cls, message):
+        """
+        Called before deleting a message and the rows that depend on it, like its
+        ``MessageBody``, to read what ``delete_message_data`` will need.
+        """
+
+    @classmethod
+    def prepare_delete_messages_data(cls, messages):
+        """
+        Calls ``prepare_delete_message_data`` for many messages deleted at once. Override it
+        in backends that can read what they need in bulk.
+        """
+        for message in messages:
+            cls.prepare_delete_message_data(message)
+
+    @classmethod
+    def prefetch_message_data(cls, messages):
+        """
+        Reads the emails of many messages at once before they are read one by one. Override
+        it in backends that can read them in bulk.
+        """
+
+    @classmethod
+    def delete_messages_data(cls, messages):
+        """
+        Deletes the storage objects of many deleted messages. Override it in backends that
+        can delete them in bulk.
+        """
+        for message in messages:
+            cls.delete_message_data(message)
+
+    @classmethod
+    def get_message_bytes(cls, message):
+        """
+        Returns the email as bytes. Override it in backends that can save bytes natively
+        to avoid decoding and encoding full emails.
+        """
+        return cls.get_message_data(message).encode(settings.DEFAULT_CHARSET)
+
+    @classmethod
+    def set_message_bytes(cls, message, data):
+        """
+        Saves the email from bytes. Override it in backends that can save bytes natively
+        to avoid decoding and encoding full emails.
+        """
+        cls.set_message_data(message, data.decode(settings.DEFAULT_CHARSET))
+
     @classmethod
     def admin_display_message_data(cls, model_admin, message):
         return f'''
@@ -41,33 +116,66 @@ class BaseStorageBackend(ABC):
 
 
 class DatabaseStorageBackend(BaseStorageBackend):
+    """
+    Saves emails in the ``MessageBody`` of their messages, as text or, if ``binary`` is
+    ``True``, as bytes.
+    """
+    binary = False
+
     @classmethod
     def get_message_data(cls, message):
-        return message._message_data
+        return message.get_body_data()
 
     @classmethod
     def set_message_data(cls, message, data):
-        message._message_data = data
+        message.set_body_data(data)
+
+    @classmethod
+    def get_message_bytes(cls, message):
+        return message.get_body_bytes()
+
+    @classmethod
+    def set_message_bytes(cls, message, data):
+        message.set_body_data(data if cls.binary else data.decode(settings.DEFAULT_CHARSET))
+
+    @classmethod
+    def has_message_data(cls, message):
+        return bool(message.get_body_bytes())
+
+    @classmethod
+    def prefetch_message_data(cls, messages):
+        # Archived messages keep their emails in their rows.
+        prefetch_related_objects([message for message in messages if isinstance(message, Message)], 'body')
 
     @classmethod
     def delete_message_data(cls, message):
         pass
 
+    @classmethod
+    def delete_messages_data(cls, messages):
+        pass
+
 
 class FileStorageBackend(BaseStorageBackend):
     storage = default_storage
 
     @classmethod
     def get_message_data(cls, message):
-        file = cls.storage.open(cls.get_path(message), 'rb')
-        content = file.read().decode(settings.DEFAULT_CHARSET)
-        file.close()
-        return content
+        return cls.get_message_bytes(message).decode(settings.DEFAULT_CHARSET)
 
     @classmethod
     def set_message_data(cls, message, data):
+        cls.set_message_bytes(message, data.encode(settings.DEFAULT_CHARSET))
+
+    @classmethod
+    def get_message_bytes(cls, message):
+        with cls.storage.open(cls.get_path(message), 'rb') as file:
+            return file.read()
+
+    @classmethod
+    def set_message_bytes(cls, message, data):
         path = cls.get_path(message)
-        new_path = cls.storage.save(path, ContentFile(data.encode(settings.DEFAULT_CHARSET)))
+        new_path = cls.storage.save(path, ContentFile(data))
         if message._message_data:
             cls.storage.delete(message._message_data)
         message._message_data = new_path
@@ -77,10 +185,38 @@ class FileStorageBackend(BaseStorageBackend):
         return message._message_data or \
             os.path.join(yubin_settings.MAILER_FILE_STORAGE_DIR, f"{str(uuid4())}.msg")
 
+    @classmethod
+    def prepare_delete_message_data(cls, message):
+        # The path can't be read once the row is deleted, like in archived messages listed by the admin.
+        if '_message_data' in message.get_deferred_fields():
+            message.refresh_from_db(fields=['_message_data'])
+        super().prepare_delete_message_data(message)
+
     @classmethod
     def delete_message_data(cls, message):
         cls.storage.delete(cls.get_path(message))
 
+    @classmethod
+    def delete_messages_data(cls, messages):
+        """
+        Deletes the files of many messages with ``MAILER_STORAGE_DELETE_THREADS`` threads,
+        logging the ones that can't be deleted.
+        """
+        paths = [message._message_data for message in messages if message._message_data]
+
+        def delete(path):
+            try:
+                cls.storage.delete(path)
+            except Exception:
+                logger.exception('Could not delete the email file %s', path)
+
+        if yubin_settings.MAILER_STORAGE_DELETE_THREADS > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(yubin_settings.MAILER_STORAGE_DELETE_THREADS) as executor:
+                list(executor.map(delete, paths))
+        else:
+            for path in paths:
+                delete(path)
+
     @classmethod
     def admin_display_message_data(cls, model_admin, message):
         return f'''
@@ -94,12 +230,201 @@ class FileStorageBackend(BaseStorageBackend):
         '''.strip()
 
 
+def compress_message_data(data, codec='zlib', text=False):
+    """
+    Compresses an email adding a header with the format. If ``text`` is ``True``
+    the compressed data is encoded with base64 to be saved as text.
+    """
+    compress, _ = COMPRESSION_CODECS[codec]
+    data = compress(data)
+    if text:
+        codec += '+base64'
+        data = base64.b64encode(data)
+    return COMPRESSION_HEADER + codec.encode('ascii') + b'\n' + data
+
+
+def decompress_message_data(data):
+    """
+    Decompresses an email compressed with ``compress_message_data``. Data without the
+    compression header is returned as is.
+    """
+    if not data.startswith(COMPRESSION_HEADER):
+        return data
+    header, data = data.split(b'\n', 1)
+    codec, _, encoding = header[len(COMPRESSION_HEADER):].decode('ascii').partition('+')
+    if encoding == 'base64':
+        data = base64.b64decode(data)
+    _, decompress = COMPRESSION_CODECS[codec]
+    return decompress(data)
+
+
+class BytesStorageBackendMixin:
+    """
+    Implements the text methods of a storage backend on top of its bytes methods.
+    """
+    @classmethod
+    def get_message_data(cls, message):
+        return cls.get_message_bytes(message).decode(settings.DEFAULT_CHARSET)
+
+    @classmethod
+    def set_message_data(cls, message, data):
+        cls.set_message_bytes(message, data.encode(settings.DEFAULT_CHARSET))
+
+
+class CompressedStorageBackendMixin(BytesStorageBackendMixin):
+    """
+    Compresses emails before saving them with the storage backend it's mixed with.
+
+    Emails saved without compression are still readable. The storage backend must
+    implement ``get_message_bytes`` and ``set_message_bytes``, and if it saves text
+    ``text`` must be ``True``.
+    """
+    text = False
+
+    @classmethod
+    def get_message_bytes(cls, message):
+        return decompress_message_data(super().get_message_bytes(message))
+
+    @classmethod
+    def set_message_bytes(cls, message, data):
+        data = compress_message_data(data, yubin_settings.MAILER_STORAGE_COMPRESSION, cls.text)
+        super().set_message_bytes(message, data)
+
+
+class CompressedDatabaseStorageBackend(CompressedStorageBackendMixin, DatabaseStorageBackend):
+    binary = True
+
+
+class CompressedFileStorageBackend(CompressedStorageBackendMixin, FileStorageBackend):
+    pass
+
+
+def extract_blobs(data, min_size):
+    """
+    Moves the content of the MIME parts of ``min_size`` bytes or more to blobs.
+
+    Returns the email with these parts replaced by references to their blobs. The blob
+    headers the email already had are removed, only the references added here are trusted.
+    """
+    msg = email.message_from_bytes(data, policy=policy.compat32)
+    changed = False
+    for part in msg.walk():
+        if part[BLOB_HEADER] is not None:
+            del part[BLOB_HEADER]
+            changed = True
+        if part.is_multipart():
+            continue
+        content = part.get_payload()
+        if not isinstance(content, str) or len(content) < min_size:
+            continue
+        # The payload is kept as it was encoded in the email (base64, quoted-printable, 8bit...).
+        content = content.encode('ascii', 'surrogateescape')
+        digest = hashlib.sha256(content).hexdigest()
+        Blob.acquire(digest, content)
+        part[BLOB_HEADER] = digest
+        part.set_payload(digest)
+        changed = True
+    return msg.as_bytes() if changed else data
+
+
+def get_blob_digests(data):
+    """
+    Returns the digests of the blobs referenced by an email.
+    """
+    if BLOB_HEADER.encode('ascii') not in data:
+        return []
+    msg = email.message_from_bytes(data, policy=policy.compat32)
+    return [part[BLOB_HEADER] for part in msg.walk() if part[BLOB_HEADER]]
+
+
+def restore_blobs(data):
+    """
+    Replaces the references to blobs of an email with the content of the blobs.
+    """
+    if BLOB_HEADER.encode('ascii') not in data:
+        return data
+    msg = email.message_from_bytes(data, policy=policy.compat32)
+    parts = [part for part in msg.walk() if part[BLOB_HEADER]]
+    if not parts:
+        return data
+    blobs = Blob.get_data({part[BLOB_HEADER] for part in parts})
+    for part in parts:
+        digest = part[BLOB_HEADER]
+        if digest not in blobs:
+            raise StorageBackendException(f'Blob {digest} not found')
+        del part[BLOB_HEADER]
+        part.set_payload(blobs[digest].decode('ascii', 'surrogateescape'))
+    return msg.as_bytes()
+
+
+class DeduplicatedStorageBackendMixin(BytesStorageBackendMixin):
+    """
+    Saves the big MIME parts of the emails, like attachments, only once no matter how
+    many emails have them, and the rest of the email with the storage backend it's
+    mixed with.
+
+    Parts of ``settings.MAILER_STORAGE_BLOB_MIN_SIZE`` bytes or more are saved in
+    ``Blob`` objects identified by the hash of their content, and the email keeps
+    a reference to them. The storage backend must implement ``get_message_bytes`` and
+    ``set_message_bytes``.
+    """
+    @classmethod
+    def get_message_bytes(cls, message):
+        return restore_blobs(super().get_message_bytes(message))
+
+    @classmethod
+    def set_message_bytes(cls, message, data):
+        if cls.has_message_data(message):
+            Blob.release(get_blob_digests(super().get_message_bytes(message)))
+        data = extract_blobs(data, yubin_settings.MAILER_STORAGE_BLOB_MIN_SIZE)
+        super().set_message_bytes(message, data)
+
+    @classmethod
+    def prepare_delete_message_data(cls, message):
+        # Database bodies are deleted before the message.
+        message._blob_digests = get_blob_digests(super().get_message_bytes(message))
+        super().prepare_delete_message_data(message)
+
+    @classmethod
+    def prepare_delete_messages_data(cls, messages):
+        cls.prefetch_message_data(messages)
+        super().prepare_delete_messages_data(messages)
+
+    @classmethod
+    def delete_message_data(cls, message):
+        Blob.release(cls._get_blob_digests(message))
+        super().delete_message_data(message)
+
+    @classmethod
+    def delete_messages_data(cls, messages):
+        Blob.release([digest for message in messages for digest in cls._get_blob_digests(message)])
+        for message in messages:
+            # Already released.
+            message._blob_digests = []
+        super().delete_messages_data(messages)
+
+    @classmethod
+    def _get_blob_digests(cls, message):
+        digests = getattr(message, '_blob_digests', None)
+        if digests is None:
+            digests = get_blob_digests(super().get_message_bytes(message))
+        return digests
+
+
+class DeduplicatedDatabaseStorageBackend(DeduplicatedStorageBackendMixin, DatabaseStorageBackend):
+    pass
+
+
+class DeduplicatedFileStorageBackend(DeduplicatedStorageBackendMixin, FileStorageBackend):
+    pass
+
+
 def db2file():
     """
     Migrate emails from DatabaseStorageBackend to FileStorageBackend.
     """
     backend = import_string(yubin_settings.MAILER_STORAGE_BACKEND)
-    if backend != FileStorageBackend:
+    if not issubclass(backend, FileStorageBackend):
         raise StorageBackendException(
             f'settings.MAILER_STORAGE_BACKEND should be {FileStorageBackend} instead of {backend}')
 
@@ -108,10 +433,11 @@ def db2file():
         .only('pk', '_message_data', 'storage')
     for message in messages:
         db_message_data = DatabaseStorageBackend.get_message_data(message)
-        DatabaseStorageBackend.set_message_data(message, data='')
+        message._message_data = ''
         message.storage = yubin_settings.MAILER_STORAGE_BACKEND
         message.message_data = db_message_data
         message.save()
+        MessageBody.objects.filter(message=message).delete()
         logger.info(f'Message {message.pk} migrated. Saved in {message._message_data}')
 
 
@@ -121,7 +447,7 @@ def file2db(delete=False):
     from the file storage.
     """
     backend = import_string(yubin_settings.MAILER_STORAGE_BACKEND)
-    if backend != DatabaseStorageBackend:
+    if not issubclass(backend, DatabaseStorageBackend):
         raise StorageBackendException(
             f'settings.MAILER_STORAGE_BACKEND should be {DatabaseStorageBackend} instead of {backend}')
 
@@ -1,4 +1,5 @@
 from celery import shared_task
+from celery.signals import worker_process_shutdown
 
 
 @shared_task()
@@ -11,20 +12,72 @@ def send_email(message_pk, log_message=None):
 
 
 @shared_task()
-def retry_emails(max_retries=3):
+def send_emails(message_pks, log_message=None):
     """
-    Retry sending retryable emails enqueueing them again.
+    Send many emails from database Message PKs using the same connection.
+    """
+    from .engine import send_db_messages
+    return send_db_messages(message_pks, log_message)
+
+
+@shared_task()
+def retry_emails(max_retries=3, batch_size=500):
+    """
+    Retry sending retryable emails whose next attempt date has been reached enqueueing them again.
     """
     from .models import Message
-    enqueued, failed = Message.retry_messages(max_retries)
+    enqueued, failed = Message.retry_messages(max_retries, batch_size)
     return enqueued, failed
 
 
 @shared_task()
-def delete_old_emails(days=90):
+def dispatch_scheduled_emails(batch_size=500):
     """
-    Delete emails created before `days` days (default 90).
+    Enqueue the scheduled emails whose sending date has been reached.
     """
     from .models import Message
-    deleted, cutoff_date = Message.delete_old(days)
-    return deleted, cutoff_date
+    return Message.dispatch_scheduled(batch_size)
+
+
+@shared_task()
+def delete_old_emails(days=90, batch_size=1000, rate=None, archive_days=None):
+    """
+    Delete emails created before `days` days (default 90) and archived emails sent before
+    `archive_days` days (default `days`) in batches, no more than `rate` emails per second
+    if given.
+    """
+    from .models import Message, MessageArchive
+    (total, deleted), cutoff_date = Message.delete_old(days, batch_size, rate)
+    (archive_total, archive_deleted), _ = MessageArchive.delete_old(
+        days if archive_days is None else archive_days, batch_size, rate)
+    return (total + archive_total, {**deleted, **archive_deleted}), cutoff_date
+
+
+@shared_task()
+def archive_sent_emails(days=30, batch_size=500):
+    """
+    Move the emails sent before `days` days (default 30) to the archive.
+    """
+    from .models import Message
+    return Message.archive_sent(days, batch_size)
+
+
+@shared_task()
+def rebuild_blacklist_filter(version=None):
+    """
+    Rebuild the Bloom filter of the blacklist, dropping the deleted addresses, and make
+    every process use it. With the `version` of an invalidated filter, it's skipped if
+    the filter has been invalidated again.
+    """
+    from .blacklist import blacklist_filter
+    bloom = blacklist_filter.rebuild(version)
+    return None if bloom is None else bloom.count
+
+
+@worker_process_shutdown.connect
+def close_connection_pool(**kwargs):
+    """
+    Close the pooled connections of the real backend when a worker process exits.
+    """
+    from .engine import connection_pool
+    connection_pool.clear()
@@ -15,10 +15,9 @@ class MailHealthCheckView(View):
                                 content_type='text/plain', status=400)
         oldest, too_old = 0, False
 
-        message = Message.objects.filter(status__lt=Message.STATUS_SENT) \
-                                 .order_by('date_created').first()
-        if message:
-            seconds = (timezone.now().astimezone() - message.date_created.astimezone()).total_seconds()
+        oldest_pending = Message.objects.oldest_pending()
+        if oldest_pending:
+            seconds = (timezone.now().astimezone() - oldest_pending.astimezone()).total_seconds()
             oldest = round(seconds / 60)  # to minutes
             too_old = oldest > threshold
 
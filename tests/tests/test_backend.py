@@ -1,25 +1,71 @@
 from unittest.mock import patch
 
+from django.core.mail import EmailMessage
 from django.test import TestCase
 from django_yubin.backends import QueuedEmailBackend
+from django_yubin.models import Message
 
 
+@patch('django_yubin.backends.queue_email_messages', side_effect=lambda messages, priority, send_at: len(messages))
 @patch('django_yubin.backends.queue_email_message', return_value=1)
 class TestBackend(TestCase):
 
-    def test_send_no_messages(self, queue_email_message_mock):
+    def test_send_no_messages(self, queue_email_message_mock, queue_email_messages_mock):
         """
         Test that no messages are enqueued if no emails are passed.
         """
         sent = QueuedEmailBackend().send_messages([])
         self.assertEqual(sent, 0)
         self.assertFalse(queue_email_message_mock.called)
+        self.assertFalse(queue_email_messages_mock.called)
 
-    def test_send_many_messages(self, queue_email_message_mock):
+    def test_send_one_message(self, queue_email_message_mock, queue_email_messages_mock):
         """
-        Test that all messages are passed to the enqueue function.
+        Test that a single message is passed to the enqueue function.
+        """
+        sent = QueuedEmailBackend().send_messages([0])
+        self.assertEqual(sent, 1)
+        self.assertEqual(queue_email_message_mock.call_count, 1)
+        self.assertFalse(queue_email_messages_mock.called)
+
+    def test_send_priority(self, queue_email_message_mock, queue_email_messages_mock):
+        """
+        Test that the priority of the connection is passed to the enqueue functions.
+        """
+        backend = QueuedEmailBackend(priority='high')
+        backend.send_messages([0])
+        queue_email_message_mock.assert_called_once_with(0, priority='high', send_at=None)
+        backend.send_messages([0, 1])
+        queue_email_messages_mock.assert_called_once_with([0, 1], priority='high', send_at=None)
+
+    def test_send_many_messages(self, queue_email_message_mock, queue_email_messages_mock):
+        """
+        Test that all messages are passed to the bulk enqueue function.
         """
         num_messages = 5
         sent = QueuedEmailBackend().send_messages(range(num_messages))
         self.assertEqual(sent, num_messages)
-        self.assertEqual(queue_email_message_mock.call_count, num_messages)
+        self.assertFalse(queue_email_message_mock.called)
+        queue_email_messages_mock.assert_called_once_with(list(range(num_messages)), priority=None, send_at=None)
+
+
+class TestBackendBatch(TestCase):
+
+    def test_send_many_messages(self):
+        emails = [
+            EmailMessage('subject', 'body', 'from@abc.com', ['to@abc.com']),
+            EmailMessage('subject', 'body', 'from@abc.com', []),
+            EmailMessage('subject', 'body', 'from@abc.com', ['to@abc.com']),
+        ]
+        with self.captureOnCommitCallbacks() as callbacks:
+            sent = QueuedEmailBackend().send_messages(emails)
+        self.assertEqual(sent, 2)
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(len(callbacks), 1)
+
+    @patch('django_yubin.models.Message.enqueue_many', side_effect=RuntimeError('Mock error'))
+    def test_send_many_messages_fail(self, enqueue_many_mock):
+        emails = [EmailMessage('subject', 'body', 'from@abc.com', ['to@abc.com']) for _ in range(3)]
+        with self.assertRaises(RuntimeError):
+            QueuedEmailBackend().send_messages(emails)
+        self.assertFalse(Message.objects.exists())
@@ -0,0 +1,266 @@
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase
+
+from django_yubin import settings, tasks
+from django_yubin.blacklist import (FILTER_VERSION_CACHE_KEY, VERSION_CACHE_KEY, BlacklistCache, BlacklistFilter,
+                                    BloomFilter, blacklist_cache, blacklist_filter, get_blacklisted, invalidate)
+from django_yubin.models import Blacklist, validate_blacklist_email
+
+
+class TestBlacklistCache(TestCase):
+
+    def setUp(self):
+        cache.delete(VERSION_CACHE_KEY)
+        self.blacklist = BlacklistCache()
+        Blacklist.objects.create(email='spam@acmecorp.com')
+
+    def test_get_blacklisted(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.blacklist.get_blacklisted(['john@acmecorp.com', 'Spam@AcmeCorp.com']),
+                             ['Spam@AcmeCorp.com'])
+            self.assertEqual(self.blacklist.get_blacklisted(['john@acmecorp.com']), [])
+            self.assertEqual(self.blacklist.get_blacklisted([]), [])
+        self.assertEqual(self.blacklist.stats(), {'hits': 2, 'misses': 1})
+
+    def test_invalidate(self):
+        other_process_blacklist = BlacklistCache()
+        self.assertFalse(other_process_blacklist.get_blacklisted(['john@acmecorp.com']))
+
+        Blacklist.objects.create(email='john@acmecorp.com')
+        self.blacklist.invalidate()
+        self.assertTrue(other_process_blacklist.get_blacklisted(['john@acmecorp.com']))
+        self.assertEqual(other_process_blacklist.misses, 2)
+
+    def test_version_evicted(self):
+        self.assertFalse(self.blacklist.get_blacklisted(['john@acmecorp.com']))
+        cache.delete(VERSION_CACHE_KEY)
+        self.assertFalse(self.blacklist.get_blacklisted(['john@acmecorp.com']))
+        self.assertEqual(self.blacklist.misses, 2)
+
+    @patch.object(settings, 'MAILER_BLACKLIST_CACHE', True)
+    def test_signals(self):
+        blacklist_cache.clear()
+        self.assertFalse(get_blacklisted(['john@acmecorp.com']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            blacklisted = Blacklist.objects.create(email='john@acmecorp.com')
+        self.assertTrue(get_blacklisted(['john@acmecorp.com']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            blacklisted.delete()
+        self.assertFalse(get_blacklisted(['john@acmecorp.com']))
+
+    @patch.object(settings, 'MAILER_BLACKLIST_CACHE', True)
+    def test_invalidated_on_commit(self):
+        blacklist_cache.clear()
+        self.assertFalse(get_blacklisted(['john@acmecorp.com']))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Blacklist.objects.create(email='john@acmecorp.com')
+            # Not committed yet, other processes can't see it.
+            self.assertFalse(get_blacklisted(['john@acmecorp.com']))
+        self.assertEqual(len(callbacks), 1)
+
+    def test_get_blacklisted_without_cache(self):
+        Blacklist.objects.create(email='@spammers.com')
+        Blacklist.objects.create(email='@*.example.com')
+        recipients = ['john@acmecorp.com', 'spam@acmecorp.com', 'john@spammers.com', 'john@mail.spammers.com',
+                      'john@example.com', 'john@mail.example.com', 'john@a.b.example.com']
+        with self.assertNumQueries(1):
+            blacklisted = get_blacklisted(recipients)
+        self.assertEqual(blacklisted, ['spam@acmecorp.com', 'john@spammers.com', 'john@mail.example.com',
+                                       'john@a.b.example.com'])
+        self.assertEqual(get_blacklisted([]), [])
+
+
+class TestBlacklist(TestCase):
+
+    def test_normalize(self):
+        blacklist = Blacklist.objects.create(email=' John@AcmeCorp.com ')
+        self.assertEqual(blacklist.address, 'john@acmecorp.com')
+
+        blacklist.email = 'Jane@AcmeCorp.com'
+        blacklist.save(update_fields=['email'])
+        blacklist.refresh_from_db()
+        self.assertEqual(blacklist.address, 'jane@acmecorp.com')
+
+    def test_unique(self):
+        Blacklist.objects.create(email='john@acmecorp.com')
+        with self.assertRaises(IntegrityError):
+            Blacklist.objects.create(email='JOHN@acmecorp.com')
+
+    def test_lookup_addresses(self):
+        self.assertEqual(Blacklist.lookup_addresses('John@Mail.Example.com'),
+                         ['john@mail.example.com', '@mail.example.com', '@*.example.com', '@*.com'])
+        self.assertEqual(Blacklist.lookup_addresses('john'), ['john'])
+
+    def test_validate(self):
+        for email in ('john@acmecorp.com', '@acmecorp.com', '@*.acmecorp.com'):
+            validate_blacklist_email(email)
+        for email in ('john', '@', '@*.', 'john@*.acmecorp.com', '@acme*.com'):
+            with self.assertRaises(ValidationError):
+                validate_blacklist_email(email)
+
+
+class TestBloomFilter(SimpleTestCase):
+
+    def test_add_contains(self):
+        bloom = BloomFilter(1000, 0.001)
+        for i in range(1000):
+            bloom.add('user%d@acmecorp.com' % i)
+        self.assertTrue(all('user%d@acmecorp.com' % i in bloom for i in range(1000)))
+        false_positives = sum('other%d@acmecorp.com' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+        self.assertEqual(bloom.count, 1000)
+
+    def test_save_load(self):
+        bloom = BloomFilter(100)
+        bloom.add('john@acmecorp.com')
+        bloom.last_pk, bloom.version = 7, 'a' * 32
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bloom')
+            bloom.save(path)
+            loaded = BloomFilter.load(path)
+
+            self.assertEqual((loaded.num_bits, loaded.num_hashes, loaded.capacity, loaded.count, loaded.last_pk,
+                              loaded.version), (bloom.num_bits, bloom.num_hashes, 100, 1, 7, 'a' * 32))
+            self.assertIn('john@acmecorp.com', loaded)
+            self.assertNotIn('jane@acmecorp.com', loaded)
+
+            # Items added after loading it don't change the file.
+            loaded.add('jane@acmecorp.com')
+            self.assertIn('jane@acmecorp.com', loaded)
+            self.assertNotIn('jane@acmecorp.com', BloomFilter.load(path))
+
+    def test_load_invalid(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bloom')
+            self.assertIsNone(BloomFilter.load(path))
+            with open(path, 'wb') as f:
+                f.write(b'foo' * 100)
+            self.assertIsNone(BloomFilter.load(path))
+
+
+@patch.object(settings, 'MAILER_BLACKLIST_FILTER', True)
+class TestBlacklistFilter(TestCase):
+
+    def setUp(self):
+        cache.delete_many([VERSION_CACHE_KEY, FILTER_VERSION_CACHE_KEY])
+        blacklist_filter.clear()
+        blacklist_filter.negatives = blacklist_filter.positives = blacklist_filter.false_positives = 0
+        Blacklist.objects.create(email='spam@acmecorp.com')
+        Blacklist.objects.create(email='@spammers.com')
+
+    def test_get_blacklisted(self):
+        blacklist_filter.get_bloom()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_blacklisted(['john@acmecorp.com', 'jane@acmecorp.com']), [])
+        with self.assertNumQueries(1):
+            self.assertEqual(get_blacklisted(['john@acmecorp.com', 'john@spammers.com']), ['john@spammers.com'])
+
+    def test_stats(self):
+        get_blacklisted(['john@acmecorp.com'])
+        get_blacklisted(['spam@acmecorp.com'])
+        with patch.object(BloomFilter, '__contains__', return_value=True):
+            get_blacklisted(['john@acmecorp.com'])
+        self.assertEqual(blacklist_filter.stats(), {'negatives': 1, 'positives': 2, 'false_positives': 1})
+
+    def test_incremental_update(self):
+        bloom = blacklist_filter.get_bloom()
+        with self.captureOnCommitCallbacks(execute=True):
+            Blacklist.objects.create(email='john@acmecorp.com')
+        self.assertEqual(get_blacklisted(['john@acmecorp.com']), ['john@acmecorp.com'])
+        self.assertIs(blacklist_filter.get_bloom(), bloom)
+        self.assertEqual(bloom.count, 3)
+
+    def test_late_commit(self):
+        Blacklist.objects.bulk_create([Blacklist(pk=10000, email='first@acmecorp.com', address='first@acmecorp.com')])
+        blacklist_filter.get_bloom()
+        # Committed after a row with a much greater primary key, like during a bulk import.
+        Blacklist.objects.bulk_create([Blacklist(pk=5000, email='late@acmecorp.com', address='late@acmecorp.com')])
+        invalidate()
+        # Checked periodically, not on every change.
+        with self.assertNumQueries(1):
+            blacklist_filter.get_bloom()
+        with patch('django_yubin.blacklist.time.monotonic', return_value=time.monotonic() + 60):
+            self.assertEqual(get_blacklisted(['late@acmecorp.com']), ['late@acmecorp.com'])
+            self.assertEqual(blacklist_filter.get_bloom().count, 4)
+
+    def test_deleted_rebuilt_by_task(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bloom')
+            reader = BlacklistFilter(path=path)
+            with patch.object(blacklist_filter, 'path', path):
+                reader.get_bloom()
+                with patch.object(blacklist_filter, 'build', wraps=blacklist_filter.build) as build_mock, \
+                        patch.object(tasks.rebuild_blacklist_filter, 'delay') as delay_mock:
+                    with self.captureOnCommitCallbacks(execute=True):
+                        Blacklist.objects.all().delete()
+                # Not built by the process that deletes them, once per transaction.
+                build_mock.assert_not_called()
+                version = cache.get(FILTER_VERSION_CACHE_KEY)
+                delay_mock.assert_called_once_with(version)
+
+                self.assertEqual(tasks.rebuild_blacklist_filter(version), 0)
+                # The rest of processes load the new filter instead of building it.
+                with patch.object(reader, 'build') as build_mock:
+                    self.assertFalse(reader.might_be_blacklisted(['spam@acmecorp.com']))
+                build_mock.assert_not_called()
+
+                # Invalidated again by a later change.
+                blacklist_filter.invalidate()
+                self.assertIsNone(tasks.rebuild_blacklist_filter(version))
+
+    def test_built_by_another_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            reader = BlacklistFilter(path=os.path.join(directory, 'bloom'))
+            cache.add('%s:build' % FILTER_VERSION_CACHE_KEY, 'version')
+            try:
+                # The database is queried meanwhile.
+                self.assertTrue(reader.might_be_blacklisted(['john@acmecorp.com']))
+                self.assertFalse(os.path.exists(reader.path))
+            finally:
+                cache.delete('%s:build' % FILTER_VERSION_CACHE_KEY)
+            self.assertFalse(reader.might_be_blacklisted(['john@acmecorp.com']))
+
+    def test_modified_rebuilds(self):
+        bloom = blacklist_filter.get_bloom()
+        blacklisted = Blacklist.objects.get(email='spam@acmecorp.com')
+        blacklisted.email = 'john@acmecorp.com'
+        with self.captureOnCommitCallbacks(execute=True):
+            blacklisted.save()
+        self.assertEqual(get_blacklisted(['john@acmecorp.com']), ['john@acmecorp.com'])
+        self.assertIsNot(blacklist_filter.get_bloom(), bloom)
+
+    def test_full_rebuilds(self):
+        bloom = blacklist_filter.get_bloom()
+        bloom.count = bloom.capacity
+        with self.captureOnCommitCallbacks(execute=True):
+            Blacklist.objects.create(email='john@acmecorp.com')
+        self.assertIsNot(blacklist_filter.get_bloom(), bloom)
+        self.assertEqual(blacklist_filter.get_bloom().count, 3)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bloom')
+            builder = BlacklistFilter(path=path)
+            self.assertEqual(builder.rebuild().count, 2)
+
+            reader = BlacklistFilter(path=path)
+            with patch.object(reader, 'build') as build_mock:
+                # The new rows and the count of the loaded ones.
+                with self.assertNumQueries(2):
+                    self.assertTrue(reader.might_be_blacklisted(['spam@acmecorp.com']))
+                    self.assertFalse(reader.might_be_blacklisted(['john@acmecorp.com']))
+            build_mock.assert_not_called()
+
+    def test_rebuild_task(self):
+        with patch.object(blacklist_filter, 'path', None):
+            self.assertEqual(tasks.rebuild_blacklist_filter(), 2)
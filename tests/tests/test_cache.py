@@ -0,0 +1,54 @@
+from django.test import SimpleTestCase
+
+from django_yubin.cache import LRUCache
+
+
+class TestLRUCache(SimpleTestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(10)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1, 4)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses, cache.size), (1, 1, 4))
+
+    def test_replace(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('a', 2, 6)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(cache.size, 6)
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.get('a')
+        cache.set('c', 3, 4)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.size, 8)
+
+    def test_too_big(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 11)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 1, 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_delete_clear(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 4)
+        cache.clear()
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 0)
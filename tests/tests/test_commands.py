@@ -1,8 +1,16 @@
+from datetime import timedelta
+from unittest.mock import patch
+
 from six import StringIO
 
+from django.core import mail
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from django_yubin import settings
+from django_yubin.models import Message, MessageArchive
 
 from .base import MessageMixin
 
@@ -40,3 +48,54 @@ class TestCommands(MessageMixin, TestCase):
             self.fail("Should fail without to address")
         except CommandError:
             pass
+
+    @patch('django_yubin.management.commands.yubin_worker.close_old_connections')
+    def test_yubin_worker(self, close_mock):
+        """
+        The ``yubin_worker`` command sends the queued mails.
+        """
+        for status in (Message.STATUS_QUEUED, Message.STATUS_QUEUED, Message.STATUS_CREATED):
+            self.create_message(status=status)
+        out = StringIO()
+        call_command('yubin_worker', batch_size=1, once=True, stdout=out)
+        self.assertEqual(int(out.getvalue().split(':')[1]), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+        call_command('yubin_worker', created_older_than=-60, once=True, stdout=out)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @patch.object(settings, 'MAILER_USE_CELERY', False)
+    @patch('django_yubin.management.commands.yubin_worker.close_old_connections')
+    def test_yubin_worker_scheduled(self, close_mock):
+        """
+        The ``yubin_worker`` command dispatches and sends the due scheduled mails.
+        """
+        message = self.create_message(status=Message.STATUS_SCHEDULED)
+        Message.objects.filter(pk=message.pk).update(send_at=now())
+        call_command('yubin_worker', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_delete_old_emails(self):
+        """
+        The ``delete_old_emails`` command deletes the old mails in batches.
+        """
+        messages = [self.create_message() for _ in range(3)]
+        Message.objects.filter(pk__in=[message.pk for message in messages[:2]]).update(
+            date_created=now() - timedelta(days=10))
+        archive = MessageArchive.objects.create(id=1000, to_address='to@abc.com', from_address='from@abc.com',
+                                                subject='Subject', date_created=now() - timedelta(days=10),
+                                                date_sent=now() - timedelta(days=10),
+                                                storage='django_yubin.storage_backends.DatabaseStorageBackend')
+        out = StringIO()
+        call_command('delete_old_emails', days=7, batch_size=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[:2], ['1 emails deleted...', '2 emails deleted...'])
+        self.assertTrue(lines[2].startswith('2 emails created before'))
+        self.assertEqual(lines[3], '1 archived emails deleted...')
+        self.assertTrue(lines[4].startswith('1 archived emails sent before'))
+        self.assertEqual(list(Message.objects.all()), [messages[2]])
+        self.assertFalse(MessageArchive.objects.filter(pk=archive.pk).exists())
+
+        archive.save()
+        call_command('delete_old_emails', days=7, archive_days=30, stdout=StringIO())
+        self.assertTrue(MessageArchive.objects.filter(pk=archive.pk).exists())
@@ -1,10 +1,18 @@
-from unittest.mock import patch
+import smtplib
+from datetime import timedelta
+from unittest.mock import ANY, MagicMock, patch
 
+from django.core import mail
+from django.core.mail import get_connection
+from django.db import connection
+from django.db.models import Q
 from django.test import TestCase
+from django.utils import timezone
 
-from django_yubin import settings
-from django_yubin.engine import send_db_message
-from django_yubin.models import Blacklist, Message
+from django_yubin import settings, tasks
+from django_yubin.engine import (ConnectionPool, connection_pool, send_db_message, send_db_messages,
+                                 send_queued_messages)
+from django_yubin.models import Blacklist, Message, RawEmailMessage, can_return_from_update
 
 from .base import MessageMixin
 
@@ -47,6 +55,17 @@ class TestSendDBMessage(MessageMixin, TestCase):
         last_log_action = self.message.log_set.first().action
         self.assertEqual(last_log_action, Message.STATUS_BLACKLISTED)
 
+    def test_send_db_message_blacklist_display_name(self):
+        Message.objects.filter(pk=self.message.pk).update(to_address='John <John@Example.com>')
+        for email in ('john@example.com', '@example.com', '@*.com'):
+            with self.subTest(email=email):
+                rule = Blacklist.objects.create(email=email)
+                Message.objects.filter(pk=self.message.pk).update(status=Message.STATUS_CREATED)
+                self.assertFalse(send_db_message(self.message.pk))
+                self.assertEqual(Message.objects.get(pk=self.message.pk).status, Message.STATUS_BLACKLISTED)
+                self.assertEqual(len(mail.outbox), 0)
+                rule.delete()
+
     def test_send_db_message_pause(self):
         pause_send_backup = settings.PAUSE_SEND
         settings.PAUSE_SEND = True
@@ -60,6 +79,21 @@ class TestSendDBMessage(MessageMixin, TestCase):
 
         settings.PAUSE_SEND = pause_send_backup
 
+    @patch.object(settings, 'MAILER_SEND_RAW', True)
+    def test_send_db_message_raw(self):
+        self.assertTrue(send_db_message(self.message.pk))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsInstance(mail.outbox[0], RawEmailMessage)
+        self.assertEqual(mail.outbox[0].recipients(), [self.message.to_address])
+        self.assertEqual(mail.outbox[0].message().as_string(), self.message.message_data)
+
+    @patch.object(settings, 'MAILER_SEND_RAW', True)
+    @patch.object(settings, 'USE_BACKEND', 'django.core.mail.backends.dummy.EmailBackend')
+    @patch.object(Message, 'get_email_message', autospec=True, side_effect=Message.get_email_message)
+    def test_send_db_message_raw_unsupported_backend(self, get_email_message_mock):
+        self.assertTrue(send_db_message(self.message.pk))
+        get_email_message_mock.assert_called_once()
+
     @patch('django_yubin.engine.get_connection', side_effect=OSError('Mock error'))
     def test_send_db_message_fail(self, get_connection_mock):
         self.assertFalse(send_db_message(self.message.pk))
@@ -69,6 +103,25 @@ class TestSendDBMessage(MessageMixin, TestCase):
         last_log_action = self.message.log_set.first().action
         self.assertEqual(last_log_action, Message.STATUS_FAILED)
 
+    def test_send_db_message_queries(self):
+        # Savepoint, lock, queued and in process update, blacklist, body, sent update, release and logs.
+        # Without RETURNING, the counters of the queued and sent updates are read with another query.
+        with self.assertNumQueries(8 if can_return_from_update(connection) else 10):
+            self.assertTrue(send_db_message(self.message.pk, 'Enqueued'))
+
+        self.message.refresh_from_db()
+        self.assertEqual((self.message.enqueued_count, self.message.sent_count), (1, 1))
+        actions = list(self.message.log_set.order_by('pk').values_list('action', flat=True))
+        self.assertEqual(actions, [Message.STATUS_QUEUED, Message.STATUS_IN_PROCESS, Message.STATUS_SENT])
+
+    @patch.object(settings, 'MAILER_LOG_LEVEL', 'WARNING')
+    def test_send_db_message_without_logs(self):
+        self.message.log_set.all().delete()
+        # Savepoint, lock, queued and in process update, blacklist, body, sent update and release.
+        with self.assertNumQueries(7 if can_return_from_update(connection) else 9):
+            self.assertTrue(send_db_message(self.message.pk, 'Enqueued'))
+        self.assertFalse(self.message.log_set.exists())
+
     def test_send_db_message(self):
         self.assertTrue(send_db_message(self.message.pk))
         self.message.refresh_from_db()
@@ -76,3 +129,190 @@ class TestSendDBMessage(MessageMixin, TestCase):
 
         last_log_action = self.message.log_set.first().action
         self.assertEqual(last_log_action, Message.STATUS_SENT)
+
+
+class TestSendDBMessages(MessageMixin, TestCase):
+    """
+    Tests engine function that sends many db messages with the same connection.
+    """
+    def setUp(self):
+        self.messages = [self.create_message(to_address='to%d@acmecorp.com' % i) for i in range(3)]
+        self.message_pks = [message.pk for message in self.messages]
+
+    @patch('django_yubin.engine.get_connection', wraps=get_connection)
+    def test_send_db_messages(self, get_connection_mock):
+        self.assertEqual(send_db_messages(self.message_pks), 3)
+        self.assertEqual(get_connection_mock.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(Message.objects.filter(status=Message.STATUS_SENT).count(), 3)
+
+    def test_send_db_messages_independent_status(self):
+        Blacklist.objects.create(email=self.messages[1].to_address)
+
+        self.assertEqual(send_db_messages(self.message_pks + [-1]), 2)
+        statuses = [Message.objects.get(pk=pk).status for pk in self.message_pks]
+        self.assertEqual(statuses, [Message.STATUS_SENT, Message.STATUS_BLACKLISTED, Message.STATUS_SENT])
+
+    @patch('django_yubin.engine.get_connection')
+    def test_send_db_messages_reconnect(self, get_connection_mock):
+        connection = MagicMock()
+        connection.send_messages.side_effect = [1, smtplib.SMTPServerDisconnected('Mock error'), 1, 1]
+        get_connection_mock.return_value = connection
+
+        self.assertEqual(send_db_messages(self.message_pks), 3)
+        self.assertEqual(connection.open.call_count, 2)
+        # Once for the reconnection and once at the end of the batch.
+        self.assertEqual(connection.close.call_count, 2)
+
+    @patch('django_yubin.engine.get_connection', side_effect=OSError('Mock error'))
+    def test_send_db_messages_connection_fail(self, get_connection_mock):
+        self.assertEqual(send_db_messages(self.message_pks), 0)
+        self.assertEqual(Message.objects.filter(status=Message.STATUS_FAILED).count(), 3)
+
+    def test_send_emails_task(self):
+        self.assertEqual(tasks.send_emails(self.message_pks), 3)
+
+
+class TestSendQueuedMessages(MessageMixin, TestCase):
+    """
+    Tests engine function that claims and sends queued db messages.
+    """
+    def setUp(self):
+        self.queued = [self.create_message(status=Message.STATUS_QUEUED) for _ in range(3)]
+        self.created = self.create_message(status=Message.STATUS_CREATED)
+
+    def test_send_queued_messages(self):
+        self.assertEqual(send_queued_messages(batch_size=2), 2)
+        self.assertEqual(send_queued_messages(batch_size=2), 1)
+        self.assertEqual(send_queued_messages(batch_size=2), 0)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(Message.objects.filter(status=Message.STATUS_SENT).count(), 3)
+        self.assertEqual(Message.objects.get(pk=self.created.pk).status, Message.STATUS_CREATED)
+
+    @patch('django_yubin.engine.send_db_messages')
+    def test_send_queued_messages_priority(self, send_mock):
+        Message.objects.filter(pk=self.queued[2].pk).update(priority=Message.PRIORITY_NOW)
+        Message.objects.filter(pk=self.queued[0].pk).update(priority=Message.PRIORITY_LOW)
+        send_queued_messages(batch_size=2)
+        send_mock.assert_called_once_with([self.queued[2].pk, self.queued[1].pk], claim=ANY)
+
+    def test_send_queued_messages_created(self):
+        created_before = self.created.date_created + timedelta(seconds=1)
+        self.assertEqual(send_queued_messages(created_before=created_before), 4)
+        self.assertFalse(Message.objects.exclude(status=Message.STATUS_SENT).exists())
+
+    @patch('django_yubin.engine.send_db_messages')
+    def test_send_queued_messages_skip_locked(self, send_mock):
+        with patch.object(Message.objects, 'select_for_update', wraps=Message.objects.select_for_update) as sfu:
+            send_queued_messages()
+        sfu.assert_called_once_with(skip_locked=True)
+        # Claimed in the same transaction, with a lease.
+        claimed = Message.objects.filter(status=Message.STATUS_IN_PROCESS, next_attempt_at__gt=timezone.now())
+        self.assertEqual(sorted(claimed.values_list('pk', flat=True)), [message.pk for message in self.queued])
+        lease = claimed.first().next_attempt_at
+        send_mock.assert_called_once_with([message.pk for message in self.queued],
+                                          claim=Q(status=Message.STATUS_IN_PROCESS, next_attempt_at=lease))
+        # Not picked by other workers.
+        self.assertEqual(send_queued_messages(), 0)
+
+    def test_send_queued_messages_expired_claim(self):
+        lease = timezone.now() - timedelta(seconds=1)
+        Message.objects.filter(pk=self.queued[0].pk).update(status=Message.STATUS_IN_PROCESS, next_attempt_at=lease)
+        Message.objects.filter(pk=self.queued[1].pk).update(status=Message.STATUS_IN_PROCESS,
+                                                            next_attempt_at=lease + timedelta(hours=1))
+        self.assertEqual(send_queued_messages(), 2)
+        self.assertEqual(Message.objects.get(pk=self.queued[0].pk).status, Message.STATUS_SENT)
+        self.assertEqual(Message.objects.get(pk=self.queued[1].pk).status, Message.STATUS_IN_PROCESS)
+        # The worker whose lease has expired doesn't send it again.
+        claim = Q(status=Message.STATUS_IN_PROCESS, next_attempt_at=lease)
+        self.assertEqual(send_db_messages([self.queued[0].pk], claim=claim), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_queued_messages_own_transactions(self):
+        with patch('django_yubin.engine.send_email_message', side_effect=[None, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                send_queued_messages()
+        # The sent message is committed, the interrupted one is rolled back to its claim.
+        self.assertEqual(Message.objects.get(pk=self.queued[0].pk).status, Message.STATUS_SENT)
+        self.assertEqual(Message.objects.get(pk=self.queued[1].pk).status, Message.STATUS_IN_PROCESS)
+        self.assertIsNotNone(Message.objects.get(pk=self.queued[1].pk).next_attempt_at)
+
+    def test_send_db_messages_claim(self):
+        # Sent by another worker after being picked.
+        Message.objects.filter(pk=self.queued[0].pk).update(status=Message.STATUS_SENT)
+        claim = Q(status=Message.STATUS_QUEUED)
+        self.assertEqual(send_db_messages([message.pk for message in self.queued], claim=claim), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class TestConnectionPool(MessageMixin, TestCase):
+    """
+    Tests the process-local pool of backend connections.
+    """
+    backend = 'django.core.mail.backends.locmem.EmailBackend'
+
+    def test_hit_miss(self):
+        pool = ConnectionPool()
+        connection = pool.acquire(self.backend)
+        pool.release(connection)
+        self.assertIs(pool.acquire(self.backend), connection)
+        self.assertIsNot(pool.acquire(self.backend), connection)
+        self.assertEqual(pool.stats(), {'hits': 1, 'misses': 2, 'reconnects': 0})
+
+    def test_options_key(self):
+        pool = ConnectionPool()
+        pool.release(pool.acquire(self.backend, fail_silently=True))
+        pool.acquire(self.backend)
+        self.assertEqual(pool.misses, 2)
+
+    def test_max_messages(self):
+        pool = ConnectionPool(max_messages=2)
+        connection = pool.acquire(self.backend)
+        pool.release(connection, messages=2)
+        self.assertIsNot(pool.acquire(self.backend), connection)
+        self.assertEqual(pool.misses, 2)
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_idle=-1)
+        connection = pool.acquire(self.backend)
+        pool.release(connection)
+        self.assertIsNot(pool.acquire(self.backend), connection)
+        self.assertEqual(pool.misses, 2)
+
+    @patch('django_yubin.engine.get_connection')
+    def test_noop_reconnect(self, get_connection_mock):
+        connection = get_connection_mock.return_value
+        connection.connection.noop.return_value = (250, b'OK')
+        pool = ConnectionPool()
+        pool.release(pool.acquire('smtp'))
+        pool.release(pool.acquire('smtp'))
+
+        connection.connection.noop.side_effect = smtplib.SMTPServerDisconnected('Mock error')
+        self.assertIs(pool.acquire('smtp'), connection)
+        self.assertEqual(pool.stats(), {'hits': 1, 'misses': 1, 'reconnects': 1})
+        self.assertEqual(connection.open.call_count, 2)
+
+    @patch('django_yubin.engine.os.getpid', return_value=-1)
+    def test_fork(self, getpid_mock):
+        pool = ConnectionPool()
+        getpid_mock.return_value = -2
+        pool.release(pool.acquire(self.backend))
+        getpid_mock.return_value = -3
+        pool.acquire(self.backend)
+        self.assertEqual(pool.stats(), {'hits': 0, 'misses': 1, 'reconnects': 0})
+
+    def test_clear(self):
+        pool = ConnectionPool()
+        connection = pool.acquire(self.backend)
+        pool.release(connection)
+        pool.clear()
+        self.assertIsNot(pool.acquire(self.backend), connection)
+
+    @patch.object(settings, 'MAILER_CONNECTION_POOL', True)
+    def test_send_db_message_pool(self):
+        connection_pool.clear()
+        hits = connection_pool.hits
+        for _ in range(2):
+            self.assertTrue(send_db_message(self.create_message().pk))
+        self.assertEqual(connection_pool.hits, hits + 1)
+        self.assertEqual(len(mail.outbox), 2)
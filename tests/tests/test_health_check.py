@@ -1,8 +1,15 @@
+from datetime import timedelta
+
 from django.test import TestCase, Client
 from django.urls import reverse
+from django.utils import timezone
+
+from django_yubin.models import Message
+
+from .base import MessageMixin
 
 
-class TestHealthCheck(TestCase):
+class TestHealthCheck(MessageMixin, TestCase):
 
     def test_health_check_view(self):
         c = Client()
@@ -11,3 +18,17 @@ class TestHealthCheck(TestCase):
         assert response.status_code == 200
         assert 'oldest_queued_email' in str(response.content)
         assert 'emails_queued_too_old' in str(response.content)
+
+    def test_health_check_scheduled(self):
+        url = reverse('yubin_health')
+        message = self.create_message(status=Message.STATUS_SCHEDULED)
+        Message.objects.filter(pk=message.pk).update(date_created=timezone.now() - timedelta(days=1),
+                                                     send_at=timezone.now() + timedelta(days=1))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Dispatched, it's pending since its sending date.
+        Message.objects.filter(pk=message.pk).update(status=Message.STATUS_CREATED,
+                                                     send_at=timezone.now() - timedelta(minutes=5))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('oldest_queued_email: 5 mins', response.content.decode())
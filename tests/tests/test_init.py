@@ -1,11 +1,15 @@
+from datetime import timedelta
 from unittest.mock import patch
 
 from django.conf import settings as django_settings
 from django.core.mail import EmailMessage
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
 
-from django_yubin import settings, queue_email_message, send_mail, mail_admins, mail_managers
-from django_yubin.models import Message
+from django_yubin import (settings, queue_email_message, queue_email_messages, send_mail, mail_admins,
+                          mail_managers)
+from django_yubin.models import Log, Message, send_emails_delay
 
 
 @patch('django_yubin.models.Message.enqueue')
@@ -65,6 +69,23 @@ class TestInit(TestCase):
 
         settings.MAILER_TEST_MODE = False
 
+    def test_queue_email_message_priority(self, enqueue_email_mock):
+        email = EmailMessage(subject='subject', body='body', from_email='mail_from@abc.com',
+                             to=['mail_to@abc.com'], headers={'X-Mail-Queue-Priority': 'low'})
+        queue_email_message(email)
+        message = Message.objects.get()
+        self.assertEqual(message.priority, Message.PRIORITY_LOW)
+        self.assertNotIn('X-Mail-Queue-Priority', message.message_data)
+        self.assertEqual(email.extra_headers, {'X-Mail-Queue-Priority': 'low'})
+
+    def test_queue_email_message_send_at(self, enqueue_email_mock):
+        send_at = timezone.now() + timedelta(days=1)
+        email = EmailMessage(subject='subject', body='body', from_email='mail_from@abc.com', to=['mail_to@abc.com'])
+        self.assertEqual(queue_email_message(email, send_at=send_at), 1)
+        message = Message.objects.get()
+        self.assertEqual((message.status, message.send_at), (Message.STATUS_SCHEDULED, send_at))
+        enqueue_email_mock.assert_not_called()
+
     def test_send_mail(self, enqueue_email_mock):
         recipient_list = ['mail_to@abc.com']
         send_mail(subject='subject', message='body', from_email='mail_from@abc.com',
@@ -100,3 +121,94 @@ class TestInit(TestCase):
         self.assertEqual(recipient_list, messages[0].recipients())
         for r in recipient_list:
             self.assertTrue(r in messages[0].message_data)
+
+
+class TestQueueEmailMessages(TestCase):
+    """
+    Yubin tests for the bulk queueing API.
+    """
+
+    @staticmethod
+    def create_emails(quantity, to=('mail_to@abc.com',)):
+        return (
+            EmailMessage(subject='subject %d' % i, body='body', from_email='mail_from@abc.com', to=list(to))
+            for i in range(quantity)
+        )
+
+    def test_queue_email_messages(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            queued = queue_email_messages(self.create_emails(5), batch_size=2)
+        self.assertEqual(queued, 5)
+        self.assertEqual(Message.objects.count(), 5)
+        self.assertEqual(Log.objects.filter(log_message="Message created").count(), 5)
+        self.assertEqual(Message.objects.for_recipient('mail_to@abc.com').count(), 5)
+
+        # One dispatch per batch.
+        self.assertEqual(len(callbacks), 3)
+        self.assertEqual(callbacks[0].func, send_emails_delay)
+        dispatched = [pk for callback in callbacks for pk in callback.args[0]]
+        self.assertEqual(sorted(dispatched), sorted(Message.objects.values_list('pk', flat=True)))
+
+    def test_queue_email_messages_no_recipients(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            queued = queue_email_messages(self.create_emails(3, to=()))
+        self.assertEqual(queued, 0)
+        self.assertEqual(len(callbacks), 0)
+        self.assertFalse(Message.objects.exists())
+
+    @staticmethod
+    def inserts(quantity):
+        """
+        Queries to insert the messages, their recipients and their bodies.
+        """
+        if connection.features.can_return_rows_from_bulk_insert:
+            return 3
+        # Messages are saved one by one to get their primary keys.
+        return 3 * quantity
+
+    def test_queue_email_messages_queries(self):
+        # Savepoint, messages, recipients, bodies and logs inserts and savepoint release.
+        with self.assertNumQueries(self.inserts(10) + 3):
+            queue_email_messages(self.create_emails(10))
+
+    @patch.object(settings, 'MAILER_LOG_LEVEL', 'WARNING')
+    def test_queue_email_messages_without_logs(self):
+        # Savepoint, messages, recipients and bodies inserts and savepoint release.
+        with self.assertNumQueries(self.inserts(10) + 2):
+            queue_email_messages(self.create_emails(10))
+        self.assertFalse(Log.objects.exists())
+        self.assertEqual(Message.objects.filter(last_log="Message created").count(), 10)
+
+    def test_queue_email_messages_priority(self):
+        emails = list(self.create_emails(3))
+        emails[0].extra_headers['X-Mail-Queue-Priority'] = 'high'
+        emails[1].extra_headers['x-mail-queue-priority'] = 'foo'
+        queue_email_messages(emails)
+        self.assertEqual(list(Message.objects.order_by('pk').values_list('priority', flat=True)),
+                         [Message.PRIORITY_HIGH, Message.PRIORITY_NORMAL, Message.PRIORITY_NORMAL])
+        self.assertNotIn(b'X-Mail-Queue-Priority', Message.objects.order_by('pk').first().message_bytes)
+        self.assertEqual(emails[0].extra_headers['X-Mail-Queue-Priority'], 'high')
+
+        queue_email_messages(self.create_emails(1), priority='now')
+        self.assertEqual(Message.objects.order_by('pk').last().priority, Message.PRIORITY_NOW)
+
+        with self.assertRaises(ValueError):
+            queue_email_messages(self.create_emails(1), priority='foo')
+
+    def test_queue_email_messages_send_at(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            queued = queue_email_messages(self.create_emails(3), send_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(queued, 3)
+        self.assertEqual(len(callbacks), 0)
+        self.assertEqual(Message.objects.filter(status=Message.STATUS_SCHEDULED).count(), 3)
+
+        # Past dates are enqueued now.
+        with self.captureOnCommitCallbacks() as callbacks:
+            queue_email_messages(self.create_emails(1), send_at=timezone.now())
+        self.assertEqual(len(callbacks), 1)
+
+    @patch('django_yubin.tasks.send_email.delay')
+    def test_send_emails_delay(self, delay_mock):
+        send_emails_delay([1, 2], log_message='log')
+        self.assertEqual(delay_mock.call_count, 2)
+        delay_mock.assert_called_with(message_pk=2, log_message='log')
@@ -1,14 +1,23 @@
+import logging
 from datetime import timedelta
 from email.mime.image import MIMEImage
 from email.generator import _fmt
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import skipUnless
 from unittest.mock import patch
 
+from django.apps import apps
 from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.db import connection
 from django.test import TestCase
 from django.utils import timezone
 
-from django_yubin import tasks
-from django_yubin.models import Message
+from django_yubin import settings, tasks
+from django_yubin.cache import LRUCache
+from django_yubin.models import (Log, Message, MessageArchive, MessageBody, RawEmailMessage, Recipient,
+                                 can_return_from_update, log_buffer, parse_recipients)
+from django_yubin.storage_backends import DatabaseStorageBackend, FileStorageBackend
 
 from .base import MessageMixin
 
@@ -51,6 +60,51 @@ class TestMessage(MessageMixin, TestCase):
         self.assertGreater(self.message.date_enqueued, now)
         self.assertEqual(self.message.enqueued_count, enqueued_count+1)
 
+    @skipUnless(can_return_from_update(connection), 'UPDATE ... RETURNING is not supported')
+    def test_mark_as_single_query(self):
+        with self.assertNumQueries(1) as context:
+            self.message.mark_as(Message.STATUS_QUEUED)
+        self.assertIn('RETURNING', context.captured_queries[0]['sql'])
+        self.assertNotIn('message_data', context.captured_queries[0]['sql'])
+        self.assertEqual(self.message.enqueued_count, 1)
+
+        with self.assertNumQueries(1):
+            self.message.mark_as(Message.STATUS_IN_PROCESS)
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.STATUS_IN_PROCESS)
+        self.assertEqual(self.message.enqueued_count, 1)
+
+    def test_mark_as_without_returning(self):
+        with patch.object(connection.features, 'can_return_columns_from_insert', False), \
+                self.assertNumQueries(2):
+            self.message.mark_as(Message.STATUS_SENT)
+        self.assertEqual(self.message.sent_count, 1)
+        self.message.refresh_from_db()
+        self.assertEqual((self.message.status, self.message.sent_count), (Message.STATUS_SENT, 1))
+
+    def test_mark_as_message_database(self):
+        queryset = Message.objects.using('default')
+        with patch.object(Message.objects, 'using', return_value=queryset) as using:
+            self.message._state.db = 'other'
+            self.message.mark_as(Message.STATUS_SENT)
+        using.assert_called_once_with('other')
+        self.message.refresh_from_db(using='default')
+        self.assertEqual(self.message.status, Message.STATUS_SENT)
+
+    def test_mark_as_enqueued(self):
+        self.message.mark_as(Message.STATUS_IN_PROCESS, enqueued=True)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.STATUS_IN_PROCESS)
+        self.assertEqual(self.message.enqueued_count, 1)
+        self.assertIsNotNone(self.message.date_enqueued)
+
+    def test_mark_as_unsaved(self):
+        message = Message(to_address='to@abc.com', message_data='Subject: Foo')
+        message.mark_as(Message.STATUS_SENT)
+        self.assertIsNotNone(message.pk)
+        self.assertEqual(message.sent_count, 1)
+
     def test_enqueue_wrong_status(self):
         self.message.mark_as(Message.STATUS_IN_PROCESS)
         self.assertFalse(self.message.enqueue())
@@ -74,22 +128,163 @@ class TestMessage(MessageMixin, TestCase):
         self.assertEqual(len(callbacks), 1)
         self.assertEqual(callbacks[0].func, tasks.send_email.delay)
 
+    @patch.object(settings, 'MAILER_CELERY_PRIORITY_QUEUES', {'high': 'mail_high'})
+    def test_enqueue_priority_queue(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(self.message.enqueue())
+        self.assertEqual(callbacks[0].func, tasks.send_email.delay)
+
+        self.message.priority = Message.PRIORITY_HIGH
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(self.message.enqueue('Log'))
+        self.assertEqual(callbacks[0].func, tasks.send_email.apply_async)
+        self.assertEqual(callbacks[0].keywords, {'kwargs': {'message_pk': self.message.pk, 'log_message': 'Log'},
+                                                 'queue': 'mail_high'})
+
+    @patch.object(settings, 'MAILER_CELERY_PRIORITY_QUEUES', {'now': 'mail_now'})
+    def test_enqueue_many_priority_queues(self):
+        messages = [self.message, self.create_message()]
+        messages[1].priority = Message.PRIORITY_NOW
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(Message.enqueue_many(messages), 2)
+        self.assertEqual([(callback.args, callback.keywords['queue']) for callback in callbacks],
+                         [(([messages[1].pk],), 'mail_now'), (([self.message.pk],), None)])
+
+    def test_get_priority(self):
+        self.assertEqual(Message.get_priority('High '), Message.PRIORITY_HIGH)
+        self.assertEqual(Message.get_priority('now-not-queued'), Message.PRIORITY_NOW)
+        self.assertEqual(Message.get_priority(5), Message.PRIORITY_LOW)
+        self.assertEqual(Message.get_priority('3'), Message.PRIORITY_NORMAL)
+        for value in ('foo', 2, None):
+            with self.assertRaises(ValueError):
+                Message.get_priority(value)
+
+    @patch.object(settings, 'MAILER_USE_CELERY', False)
+    def test_enqueue_without_celery(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(self.message.enqueue('Retry'))
+        self.assertEqual(len(callbacks), 0)
+        self.message.refresh_from_db()
+        self.assertEqual((self.message.status, self.message.enqueued_count), (Message.STATUS_QUEUED, 0))
+        self.assertEqual(self.message.log_set.first().log_message, 'Retry')
+
+    @patch.object(settings, 'MAILER_USE_CELERY', False)
+    def test_enqueue_many_without_celery(self):
+        messages = [self.message, self.create_message(status=Message.STATUS_SENT)]
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(Message.enqueue_many(messages), 1)
+        self.assertEqual(len(callbacks), 0)
+        self.assertEqual(self.message.status, Message.STATUS_QUEUED)
+        self.assertEqual(Message.objects.filter(status=Message.STATUS_QUEUED).get(), self.message)
+
+    def test_dispatch_scheduled(self):
+        self.message.delete()
+        send_at = timezone.now() - timedelta(minutes=1)
+        due = [self.create_message(status=Message.STATUS_SCHEDULED) for _ in range(5)]
+        Message.objects.filter(pk__in=[message.pk for message in due]).update(send_at=send_at)
+        later = self.create_message(status=Message.STATUS_SCHEDULED)
+        Message.objects.filter(pk=later.pk).update(send_at=send_at + timedelta(hours=1))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(Message.dispatch_scheduled(batch_size=2), 5)
+        # One dispatch per batch.
+        self.assertEqual([callback.args[0] for callback in callbacks],
+                         [[due[0].pk, due[1].pk], [due[2].pk, due[3].pk], [due[4].pk]])
+        self.assertEqual(Message.objects.filter(status=Message.STATUS_CREATED).count(), 5)
+        self.assertEqual(Message.objects.get(pk=due[0].pk).last_log, 'Scheduled sending date reached.')
+        self.assertEqual(Message.objects.get(pk=later.pk).status, Message.STATUS_SCHEDULED)
+
+        # Dispatched messages are not dispatched again.
+        self.assertEqual(Message.dispatch_scheduled(), 0)
+        self.assertEqual(tasks.dispatch_scheduled_emails(), 0)
+
+    @patch.object(settings, 'MAILER_USE_CELERY', False)
+    def test_dispatch_scheduled_without_celery(self):
+        Message.objects.filter(pk=self.message.pk).update(status=Message.STATUS_SCHEDULED, send_at=timezone.now())
+        self.assertEqual(Message.dispatch_scheduled(), 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.STATUS_QUEUED)
+
     def test_retry_messages_none(self):
         enqueued, failed = Message.retry_messages()
         self.assertEqual((enqueued, failed), (0, 0))
 
     def test_retry_messages(self):
         self.message.status = Message.STATUS_FAILED
+        self.message.next_attempt_at = timezone.now()
         self.message.save()
-        enqueued, failed = Message.retry_messages()
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueued, failed = Message.retry_messages()
         self.assertEqual((enqueued, failed), (1, 0))
 
+        # Enqueued, it's not retried again until it fails again.
+        self.assertEqual(Message.retry_messages(), (0, 0))
+
+    def test_retry_messages_lost_task(self):
+        self.message.status = Message.STATUS_FAILED
+        self.message.next_attempt_at = timezone.now()
+        self.message.save()
+        # The task is never sent.
+        with self.captureOnCommitCallbacks(execute=False):
+            self.assertEqual(Message.retry_messages(), (1, 0))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.STATUS_FAILED)
+        self.assertGreater(self.message.next_attempt_at, timezone.now())
+        self.assertEqual(Message.retry_messages(), (0, 0))
+
+        # It's retried again once the lease expires.
+        Message.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(Message.retry_messages(), (1, 0))
+
+    def test_retry_messages_not_due(self):
+        self.message.mark_as(Message.STATUS_FAILED, 'Error')
+        self.assertEqual(Message.retry_messages(), (0, 0))
+
     def test_retry_messages_max_retries(self):
         self.message.status = Message.STATUS_FAILED
         self.message.enqueued_count = 3
+        self.message.next_attempt_at = timezone.now()
         self.message.save()
         enqueued, failed = Message.retry_messages()
         self.assertEqual((enqueued, failed), (0, 0))
+        self.message.refresh_from_db()
+        self.assertIsNone(self.message.next_attempt_at)
+
+    def test_retry_messages_batches(self):
+        self.message.delete()
+        next_attempt_at = timezone.now() - timedelta(minutes=1)
+        for status in (Message.STATUS_FAILED, Message.STATUS_BLACKLISTED, Message.STATUS_FAILED, Message.STATUS_SENT):
+            self.create_message(status=status)
+        Message.objects.update(next_attempt_at=next_attempt_at)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(Message.retry_messages(batch_size=1), (3, 0))
+        self.assertEqual(len(callbacks), 3)
+
+    @patch.object(settings, 'MAILER_RETRY_BACKOFF', 60)
+    @patch.object(settings, 'MAILER_RETRY_BACKOFF_MAX', 300)
+    def test_retry_delay(self):
+        delays = []
+        for enqueued_count in range(6):
+            self.message.enqueued_count = enqueued_count
+            delays.append(self.message.get_retry_delay())
+        for delay, expected in zip(delays, (60, 60, 120, 240, 300, 300)):
+            self.assertTrue(expected / 2 <= delay <= expected, (delay, expected))
+
+    def test_mark_as_failed_schedules_retry(self):
+        self.message.enqueued_count = 1
+        self.message.mark_as(Message.STATUS_FAILED)
+        self.message.refresh_from_db()
+        delay = (self.message.next_attempt_at - timezone.now()).total_seconds()
+        self.assertTrue(settings.MAILER_RETRY_BACKOFF / 2 - 1 <= delay <= settings.MAILER_RETRY_BACKOFF)
+
+        self.message.mark_as(Message.STATUS_SENT)
+        self.message.refresh_from_db()
+        self.assertIsNone(self.message.next_attempt_at)
+
+    def test_retry_messages_scheduled(self):
+        self.message.status = Message.STATUS_SCHEDULED
+        self.message.save()
+        self.assertEqual(Message.retry_messages(), (0, 0))
 
     def test_delete_old(self):
         days = 7
@@ -103,6 +298,62 @@ class TestMessage(MessageMixin, TestCase):
         self.assertEqual(len(messages), 1)
         self.assertGreaterEqual(messages[0].date_created, timezone.now() - timedelta(days=days))
 
+    def create_old_messages(self, quantity, days=8):
+        messages = [self.create_message() for _ in range(quantity)]
+        Message.objects.filter(pk__in=[message.pk for message in messages]).update(
+            date_created=timezone.now() - timedelta(days=days))
+        return messages
+
+    @patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+    def test_delete_old_batches(self):
+        old_messages = self.create_old_messages(5)
+        for message in old_messages:
+            message.add_log('Foo')
+        progress = []
+
+        (total, deleted), cutoff_date = Message.delete_old(7, batch_size=2, progress=progress.append)
+
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(deleted, {'django_yubin.Message': 5, 'django_yubin.Log': 5,
+                                   'django_yubin.MessageBody': 5, 'django_yubin.Recipient': 5})
+        self.assertEqual(total, 20)
+        self.assertEqual(list(Message.objects.all()), [self.message])
+        self.assertFalse(Log.objects.filter(message__in=old_messages).exists())
+
+    @patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+    @patch.object(settings, 'MAILER_STORAGE_BACKEND', 'django_yubin.storage_backends.FileStorageBackend')
+    def test_delete_old_storage(self):
+        """
+        Storage objects are deleted once the batch is committed.
+        """
+        paths = [message._message_data for message in self.create_old_messages(3)]
+        storage = FileStorageBackend.storage
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Message.delete_old(7, batch_size=2)
+            self.assertTrue(all(storage.exists(path) for path in paths))
+        self.assertEqual(len(callbacks), 2)
+        self.assertFalse(any(storage.exists(path) for path in paths))
+
+    @patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+    @patch.object(FileStorageBackend, 'delete_messages_data', side_effect=OSError('Mock error'))
+    def test_delete_old_storage_error(self, delete_mock):
+        message = self.create_old_messages(1)[0]
+        Message.objects.filter(pk=message.pk).update(storage='django_yubin.storage_backends.FileStorageBackend')
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.delete_old(7)
+        delete_mock.assert_called_once()
+        self.assertFalse(Message.objects.filter(pk=message.pk).exists())
+
+    @patch('django_yubin.models.time.sleep')
+    def test_delete_old_rate(self, sleep_mock):
+        self.create_old_messages(4)
+        Message.delete_old(7, batch_size=2, rate=2)
+        # Sleeping is mocked, so it waits until 1 and 2 seconds after starting.
+        waits = [call.args[0] for call in sleep_mock.call_args_list]
+        self.assertEqual(len(waits), 2)
+        self.assertAlmostEqual(waits[0], 1, delta=0.5)
+        self.assertAlmostEqual(waits[1], 2, delta=0.5)
+
     @patch("django.core.mail.message.generator.Generator._make_boundary")
     def test_get_email_message_roundtrip(self, mock_make_boundary):
         self.maxDiff = None
@@ -197,6 +448,21 @@ class TestMessage(MessageMixin, TestCase):
             self.assertEqual(reconstructed_msg.as_string(), ref_as_string)
             reset_mock()
 
+    def test_get_raw_email_message(self):
+        email_message = EmailMessage('Subject ✉️', 'Body àäá', 'Foo <from@abc.com>', ['to@abc.com'],
+                                     cc=['cc@abc.com'], bcc=['bcc@abc.com'])
+        data = email_message.message().as_string()
+        message = Message(to_address='to@abc.com', cc_address='cc@abc.com', bcc_address='bcc@abc.com',
+                          from_address='Foo <from@abc.com>', message_data=data)
+
+        raw = message.get_raw_email_message()
+        self.assertIsInstance(raw, RawEmailMessage)
+        self.assertEqual(raw.from_email, 'Foo <from@abc.com>')
+        self.assertEqual(raw.recipients(), ['to@abc.com', 'cc@abc.com', 'bcc@abc.com'])
+        self.assertEqual(raw.message().as_string(), data)
+        self.assertEqual(raw.message().as_bytes(linesep='\r\n'),
+                         data.replace('\n', '\r\n').encode('utf-8'))
+
     def test_email_with_long_subject(self):
         email_message = EmailMessage(
             "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
@@ -219,3 +485,307 @@ class TestMessage(MessageMixin, TestCase):
         parsed_message = message.get_email_message()
 
         self.assertNotIn("\n", parsed_message.subject)
+
+
+class TestMessageParserCache(MessageMixin, TestCase):
+
+    def setUp(self):
+        self.message = self.create_message()
+
+    def test_instance_cache(self):
+        with patch.object(DatabaseStorageBackend, 'get_message_bytes',
+                          wraps=DatabaseStorageBackend.get_message_bytes) as get_mock:
+            parser = self.message.get_message_parser()
+            self.assertIs(self.message.get_message_parser(), parser)
+            self.message.get_email_message()
+            self.assertEqual(get_mock.call_count, 1)
+
+    def test_instance_cache_invalidation(self):
+        parser = self.message.get_message_parser()
+        self.message.message_data = self.message.message_data.replace('Lorem ipsum', 'Foo')
+        self.assertIsNot(self.message.get_message_parser(), parser)
+        self.assertTrue(self.message.get_message_parser().subject.startswith('Foo'))
+
+    def test_process_cache(self):
+        with patch('django_yubin.models.message_parser_cache', LRUCache(10 ** 6)) as cache:
+            parser = Message.objects.get(pk=self.message.pk).get_message_parser()
+            self.assertIs(Message.objects.get(pk=self.message.pk).get_message_parser(), parser)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            self.message.message_data = self.message.message_data
+            self.assertIsNot(Message.objects.get(pk=self.message.pk).get_message_parser(), parser)
+
+            self.message.delete()
+            self.assertEqual(cache.size, 0)
+
+    def test_process_cache_unsaved(self):
+        with patch('django_yubin.models.message_parser_cache', LRUCache(10 ** 6)) as cache:
+            Message(message_data=self.message.message_data).get_message_parser()
+            self.assertEqual(cache.size, 0)
+
+
+class TestLogBuffer(MessageMixin, TestCase):
+
+    def setUp(self):
+        self.message = self.create_message()
+        self.message.log_set.all().delete()
+
+    def test_add_log_without_buffer(self):
+        with self.assertNumQueries(1):
+            self.message.add_log('Foo')
+        self.assertEqual(self.message.log_set.count(), 1)
+
+    def test_add_log_with_buffer(self):
+        with log_buffer():
+            with self.assertNumQueries(0):
+                self.message.add_log('Foo')
+                self.message.add_log('Bar', action=Message.STATUS_SENT)
+            self.assertEqual(self.message.log_set.count(), 0)
+
+        logs = list(self.message.log_set.values_list('log_message', 'action'))
+        self.assertEqual(logs, [('Bar', Message.STATUS_SENT), ('Foo', Message.STATUS_CREATED)])
+
+    def test_buffer_flushed_on_message_database(self):
+        self.message._state.db = 'other'
+        with patch.object(Log.objects, 'using') as using:
+            with log_buffer():
+                self.message.add_log('Foo')
+        using.assert_called_once_with('other')
+        logs = using.return_value.bulk_create.call_args.args[0]
+        self.assertEqual([log.log_message for log in logs], ['Foo'])
+
+    def test_buffer_flushed_on_exception(self):
+        with self.assertRaises(ValueError):
+            with log_buffer():
+                self.message.add_log('Foo')
+                raise ValueError()
+        self.assertEqual(self.message.log_set.count(), 1)
+
+    def test_nested_buffers(self):
+        with log_buffer():
+            with log_buffer():
+                self.message.add_log('Foo')
+            self.assertEqual(self.message.log_set.count(), 0)
+            self.message.add_log('Bar')
+        self.assertEqual(self.message.log_set.count(), 2)
+
+
+class TestLogLevel(MessageMixin, TestCase):
+
+    def setUp(self):
+        self.message = self.create_message()
+        self.message.log_set.all().delete()
+
+    def test_default_level(self):
+        self.message.mark_as(Message.STATUS_SENT, 'Sent')
+        self.assertEqual(self.message.log_set.count(), 1)
+
+    @patch.object(settings, 'MAILER_LOG_LEVEL', logging.WARNING)
+    def test_only_failures(self):
+        self.message.mark_as(Message.STATUS_SENT, 'Sent')
+        self.message.add_log('Trying to send the message.')
+        self.assertEqual(self.message.log_set.count(), 0)
+
+        self.message.mark_as(Message.STATUS_FAILED, 'Connection refused')
+        self.message.add_log('Anomaly', level=logging.WARNING)
+        logs = self.message.log_set.order_by('pk').values_list('action', 'log_message')
+        self.assertEqual(list(logs), [(Message.STATUS_FAILED, 'Connection refused'),
+                                      (Message.STATUS_FAILED, 'Anomaly')])
+
+    @patch.object(settings, 'MAILER_LOG_LEVEL', 'error')
+    def test_level_name(self):
+        self.message.mark_as(Message.STATUS_FAILED, 'Connection refused')
+        self.assertEqual(self.message.log_set.count(), 0)
+
+    @patch.object(settings, 'MAILER_LOG_LEVEL', logging.WARNING)
+    def test_last_log(self):
+        self.message.mark_as(Message.STATUS_SENT, 'Message sent %s' % ('x' * 300))
+        self.message.mark_as(Message.STATUS_QUEUED)
+        self.message.refresh_from_db()
+        self.assertEqual(len(self.message.last_log), 255)
+        self.assertTrue(self.message.last_log.startswith('Message sent xxx'))
+
+
+class TestRecipient(TestCase):
+
+    def create_message(self, to_address, cc_address='', bcc_address=''):
+        return Message.objects.create(to_address=to_address, cc_address=cc_address, bcc_address=bcc_address,
+                                      from_address='from@example.com', subject='Subject', message_data='Subject: Foo')
+
+    def test_parse_recipients(self):
+        self.assertEqual(
+            parse_recipients('John <John@Example.com>, jane@example.com,, john@example.com', ' Jane@Example.com '),
+            [(Recipient.KIND_TO, 'john@example.com'), (Recipient.KIND_TO, 'jane@example.com'),
+             (Recipient.KIND_CC, 'jane@example.com')])
+
+    def test_created_with_message(self):
+        message = self.create_message('john@example.com', 'Jane <jane@example.com>', 'bcc@example.com')
+        self.assertEqual(sorted(message.recipient_set.values_list('kind', 'address')),
+                         [(Recipient.KIND_TO, 'john@example.com'), (Recipient.KIND_CC, 'jane@example.com'),
+                          (Recipient.KIND_BCC, 'bcc@example.com')])
+
+        message.subject = 'Another subject'
+        message.save()
+        self.assertEqual(message.recipient_set.count(), 3)
+
+    def test_for_recipient(self):
+        message1 = self.create_message('john@example.com', 'jane@example.com')
+        message2 = self.create_message('jane@example.com', bcc_address='John@Example.com')
+        self.create_message('foo@example.com')
+        self.assertEqual(list(Message.objects.for_recipient('JOHN@example.com ').order_by('pk')),
+                         [message1, message2])
+        self.assertEqual(list(Message.objects.filter(subject='Subject').for_recipient('jane@example.com')
+                              .order_by('pk')), [message1, message2])
+        self.assertFalse(Message.objects.for_recipient('example.com').exists())
+
+    def test_migration(self):
+        """
+        The data migration creates the recipients of the messages without them.
+        """
+        migration = import_module('django_yubin.migrations.0022_recipient')
+        message1 = self.create_message('john@example.com', 'jane@example.com')
+        message2 = self.create_message('foo@example.com')
+        message1.recipient_set.all().delete()
+
+        with patch.object(migration, 'BATCH_SIZE', 1):
+            migration.create_recipients(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(sorted(message1.recipient_set.values_list('kind', 'address')),
+                         [(Recipient.KIND_TO, 'john@example.com'), (Recipient.KIND_CC, 'jane@example.com')])
+        self.assertEqual(message2.recipient_set.count(), 1)
+
+
+class TestMessageArchive(MessageMixin, TestCase):
+
+    def create_sent_message(self, days=31):
+        message = self.create_message()
+        message.mark_as(Message.STATUS_SENT, 'Sent')
+        Message.objects.filter(pk=message.pk).update(date_sent=timezone.now() - timedelta(days=days))
+        return Message.objects.get(pk=message.pk)
+
+    def test_archive_sent(self):
+        old_messages = [self.create_sent_message() for _ in range(3)]
+        recent = self.create_sent_message(days=1)
+        created = self.create_message()
+        data = old_messages[0].message_data
+
+        self.assertEqual(Message.archive_sent(30, batch_size=2), 3)
+
+        self.assertEqual(sorted(Message.objects.values_list('pk', flat=True)), [recent.pk, created.pk])
+        self.assertFalse(Log.objects.filter(message__in=old_messages).exists())
+        self.assertFalse(MessageBody.objects.filter(message__in=old_messages).exists())
+        self.assertFalse(Recipient.objects.filter(message__in=old_messages).exists())
+
+        archive = MessageArchive.objects.get(pk=old_messages[0].pk)
+        self.assertEqual((archive.to_address, archive.subject, archive.date_sent, archive.sent_count),
+                         (old_messages[0].to_address, old_messages[0].subject, old_messages[0].date_sent, 1))
+        self.assertEqual(archive.message_data, data)
+        self.assertEqual(archive.get_message_parser().subject, 'Lorem ipsum dolor sit amet')
+        self.assertRegex(archive.log, r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\S* Sent: Sent$')
+        self.assertEqual(MessageArchive.objects.count(), 3)
+
+        self.assertEqual(Message.archive_sent(30), 0)
+
+    @patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+    @patch.object(settings, 'MAILER_STORAGE_BACKEND', 'django_yubin.storage_backends.FileStorageBackend')
+    def test_archive_sent_file_storage(self):
+        message = self.create_sent_message()
+        data, path = message.message_data, message._message_data
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.archive_sent(30)
+
+        archive = MessageArchive.objects.get()
+        self.assertEqual(archive._message_data, path)
+        self.assertEqual(archive.message_data, data)
+        archive.delete()
+        self.assertFalse(FileStorageBackend.storage.exists(path))
+
+    @patch.object(settings, 'MAILER_STORAGE_BACKEND', 'django_yubin.storage_backends.CompressedDatabaseStorageBackend')
+    def test_archive_sent_binary_body(self):
+        message = self.create_sent_message()
+        data = message.message_data
+        Message.archive_sent(30)
+
+        archive = MessageArchive.objects.get()
+        self.assertEqual(archive._message_data, '')
+        self.assertTrue(bytes(archive._binary_data).startswith(b'YUBIN zlib\n'))
+        self.assertEqual(archive.message_data, data)
+
+    @patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+    @patch.object(settings, 'MAILER_STORAGE_BACKEND', 'django_yubin.storage_backends.FileStorageBackend')
+    def test_delete_old(self):
+        old_messages = [self.create_sent_message(days=10) for _ in range(3)]
+        recent = self.create_sent_message(days=5)
+        paths = [message._message_data for message in old_messages]
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.archive_sent(1)
+        progress = []
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            (total, deleted), cutoff_date = MessageArchive.delete_old(7, batch_size=2, progress=progress.append)
+
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual((total, deleted), (3, {'django_yubin.MessageArchive': 3}))
+        self.assertEqual(list(MessageArchive.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(len(callbacks), 2)
+        self.assertFalse(any(FileStorageBackend.storage.exists(path) for path in paths))
+        self.assertTrue(FileStorageBackend.storage.exists(MessageArchive.objects.get()._message_data))
+
+    @patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+    @patch.object(settings, 'MAILER_STORAGE_BACKEND', 'django_yubin.storage_backends.FileStorageBackend')
+    def test_delete_deferred(self):
+        message = self.create_sent_message()
+        path = message._message_data
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.archive_sent(30)
+        # Like the admin, that doesn't read the emails of the listed messages.
+        MessageArchive.objects.defer('_message_data').delete()
+        self.assertFalse(FileStorageBackend.storage.exists(path))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with SQLite')
+class TestQueryPlans(TestCase):
+    """
+    The hot queries of messages and logs use their indexes instead of scanning the tables.
+    """
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'(SEARCH|SCAN) (django_yubin_\w+|U\d+) USING (COVERING )?INDEX %s\b' % index)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_health_check(self):
+        for status in (Message.STATUS_CREATED, Message.STATUS_QUEUED, Message.STATUS_IN_PROCESS):
+            messages = Message.objects.filter(status=status)
+            self.assertUsesIndex(messages.filter(send_at__isnull=True).order_by('date_created')[:1],
+                                 'django_yubin_msg_status_idx')
+            self.assertUsesIndex(messages.filter(send_at__isnull=False).order_by('send_at')[:1],
+                                 'django_yubin_msg_schedule_idx')
+
+    def test_queue(self):
+        self.assertUsesIndex(Message.objects.filter(status=Message.STATUS_QUEUED).order_by('priority', 'pk')[:100],
+                             'django_yubin_msg_queue_idx')
+
+    def test_retry(self):
+        messages = Message.objects.filter(status=Message.STATUS_FAILED, next_attempt_at__lte=timezone.now())
+        self.assertUsesIndex(messages.order_by('next_attempt_at', 'pk')[:500], 'django_yubin_msg_retry_idx')
+
+    def test_scheduled(self):
+        messages = Message.objects.filter(status=Message.STATUS_SCHEDULED, send_at__lte=timezone.now())
+        self.assertUsesIndex(messages.order_by('send_at', 'pk')[:500], 'django_yubin_msg_schedule_idx')
+
+    def test_delete_old(self):
+        self.assertUsesIndex(Message.objects.filter(date_created__lt=timezone.now()), 'django_yubin_msg_created_idx')
+        archived = MessageArchive.objects.filter(date_sent__lt=timezone.now())
+        self.assertUsesIndex(archived.order_by('date_sent', 'pk')[:1000], 'django_yubin_arch_sent_idx')
+
+    def test_admin(self):
+        self.assertUsesIndex(Message.objects.order_by('-date_created')[:100], 'django_yubin_msg_created_idx')
+        self.assertUsesIndex(Message.objects.filter(status=Message.STATUS_SENT).order_by('-date_created')[:100],
+                             'django_yubin_msg_status_idx')
+        self.assertUsesIndex(Message.objects.filter(date_sent__gte=timezone.now()).order_by(),
+                             'django_yubin_msg_sent_idx')
+        self.assertUsesIndex(Log.objects.all()[:100], 'django_yubin_log_date_idx')
+
+    def test_for_recipient(self):
+        self.assertUsesIndex(Message.objects.for_recipient('john@example.com').order_by(),
+                             'django_yubin_rcpt_address_idx')
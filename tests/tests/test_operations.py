@@ -0,0 +1,55 @@
+from unittest.mock import MagicMock
+
+from django.apps import apps
+from django.db import NotSupportedError, connection, models
+from django.db.migrations.state import ProjectState
+from django.test import SimpleTestCase, TransactionTestCase
+
+from django_yubin.operations import AddIndexConcurrently
+
+
+class TestAddIndexConcurrently(SimpleTestCase):
+
+    def setUp(self):
+        self.operation = AddIndexConcurrently('message', models.Index(fields=['subject'], name='test_subject_idx'))
+        self.state = ProjectState.from_apps(apps)
+        self.schema_editor = MagicMock()
+        self.schema_editor.connection.vendor = 'postgresql'
+        self.schema_editor.connection.alias = 'default'
+        self.schema_editor.connection.in_atomic_block = False
+
+    def test_postgresql(self):
+        self.operation.database_forwards('django_yubin', self.schema_editor, self.state, self.state)
+        self.schema_editor.add_index.assert_called_once_with(
+            self.state.apps.get_model('django_yubin', 'Message'), self.operation.index, concurrently=True)
+
+        self.operation.database_backwards('django_yubin', self.schema_editor, self.state, self.state)
+        self.schema_editor.remove_index.assert_called_once_with(
+            self.state.apps.get_model('django_yubin', 'Message'), self.operation.index, concurrently=True)
+
+    def test_postgresql_in_transaction(self):
+        self.schema_editor.connection.in_atomic_block = True
+        with self.assertRaises(NotSupportedError):
+            self.operation.database_forwards('django_yubin', self.schema_editor, self.state, self.state)
+        self.schema_editor.add_index.assert_not_called()
+
+    def test_describe(self):
+        self.assertEqual(self.operation.describe(), 'Concurrently create index test_subject_idx on message')
+
+
+class TestAddIndexConcurrentlyDatabase(TransactionTestCase):
+
+    def test_other_databases(self):
+        operation = AddIndexConcurrently('message', models.Index(fields=['subject'], name='test_subject_idx'))
+        from_state = ProjectState.from_apps(apps)
+        to_state = from_state.clone()
+        operation.state_forwards('django_yubin', to_state)
+
+        with connection.schema_editor() as schema_editor:
+            operation.database_forwards('django_yubin', schema_editor, from_state, to_state)
+        self.assertIn('test_subject_idx', connection.introspection.get_constraints(connection.cursor(),
+                                                                                   'django_yubin_message'))
+        with connection.schema_editor() as schema_editor:
+            operation.database_backwards('django_yubin', schema_editor, to_state, from_state)
+        self.assertNotIn('test_subject_idx', connection.introspection.get_constraints(connection.cursor(),
+                                                                                      'django_yubin_message'))
@@ -0,0 +1,147 @@
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase
+
+from django_yubin import ratelimit, settings, tasks
+from django_yubin.engine import send_db_message
+from django_yubin.models import Blacklist, Message
+from django_yubin.ratelimit import RateLimited, RateLimiter, parse_rate
+
+from .base import MessageMixin
+
+
+class TestRateLimiter(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/s'), (10, 1))
+        self.assertEqual(parse_rate('600/minute'), (600, 60))
+        self.assertEqual(parse_rate('1000/h'), (1000, 3600))
+        self.assertEqual(parse_rate((5, 2)), (5, 2))
+        for rate in ('10', '10/d', 'ten/s'):
+            with self.assertRaises(ValueError):
+                parse_rate(rate)
+
+    def test_get_limits(self):
+        limiter = RateLimiter('10/s', backends={'smtp': '5/s'}, domains={'gmail.com': '2/s', '*': '1/s'})
+        self.assertEqual(limiter.get_limits(['john@Gmail.com', 'jane@acmecorp.com', 'jack@gmail.com'], 'smtp'), [
+            ('global', (10, 1)),
+            ('backend:smtp', (5, 1)),
+            ('domain:acmecorp.com', (1, 1)),
+            ('domain:gmail.com', (2, 1)),
+        ])
+        self.assertEqual(limiter.get_limits(['john@gmail.com'], 'console'), [
+            ('global', (10, 1)), ('domain:gmail.com', (2, 1)),
+        ])
+        self.assertFalse(RateLimiter().enabled)
+        self.assertEqual(RateLimiter().get_limits(['john@gmail.com']), [])
+
+    def test_try_acquire(self):
+        limiter = RateLimiter('2/s')
+        limits = limiter.get_limits([])
+        self.assertEqual(limiter.try_acquire(limits, now=100.25), 0)
+        self.assertEqual(limiter.try_acquire(limits, now=100.5), 0)
+        self.assertEqual(limiter.try_acquire(limits, now=100.75), 0.25)
+        # Next window.
+        self.assertEqual(limiter.try_acquire(limits, now=101), 0)
+
+    def test_shared(self):
+        limits = RateLimiter('1/s').get_limits([])
+        self.assertEqual(RateLimiter('1/s').try_acquire(limits, now=100), 0)
+        self.assertEqual(RateLimiter('1/s').try_acquire(limits, now=100.5), 0.5)
+
+    def test_tokens_given_back(self):
+        limiter = RateLimiter('2/s', domains={'gmail.com': '1/s'})
+        self.assertEqual(limiter.try_acquire(limiter.get_limits(['john@gmail.com']), now=100), 0)
+        self.assertEqual(limiter.try_acquire(limiter.get_limits(['jane@gmail.com']), now=100), 1)
+        # The global token taken by the limited email can be used by other domains.
+        self.assertEqual(limiter.try_acquire(limiter.get_limits(['john@acmecorp.com']), now=100), 0)
+
+    @patch('django_yubin.ratelimit.time.sleep')
+    def test_acquire_waits(self, sleep_mock):
+        limiter = RateLimiter('1/s')
+        with patch.object(limiter, 'try_acquire', side_effect=[0.25, 0.5, 0]):
+            self.assertEqual(limiter.acquire(['john@gmail.com']), 0.75)
+        self.assertEqual([call.args for call in sleep_mock.call_args_list], [(0.25,), (0.5,)])
+        self.assertEqual(limiter.acquire(['john@gmail.com']), 0)
+        self.assertEqual(limiter.stats(), {'waits': 1, 'wait_time': 0.75, 'max_wait_time': 0.75, 'requeues': 0})
+
+    @patch('django_yubin.ratelimit.time.sleep')
+    def test_acquire_max_wait(self, sleep_mock):
+        limiter = RateLimiter('1/s')
+        with patch.object(limiter, 'try_acquire', side_effect=[0.5, 0.75]):
+            with self.assertRaises(RateLimited) as cm:
+                limiter.acquire(['john@gmail.com'], max_wait=1)
+        self.assertEqual(cm.exception.wait, 0.75)
+        sleep_mock.assert_called_once_with(0.5)
+        self.assertEqual(limiter.stats()['requeues'], 1)
+
+
+class TestSendRateLimited(MessageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.message = self.create_message()
+
+    @patch.object(ratelimit, 'rate_limiter', RateLimiter('1/h'))
+    @patch.object(tasks.send_email, 'apply_async')
+    def test_requeued(self, apply_async_mock):
+        self.assertTrue(send_db_message(self.create_message().pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(send_db_message(self.message.pk, log_message='Retried'))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.STATUS_CREATED)
+        self.assertEqual(self.message.enqueued_count, 0)
+        self.assertTrue(self.message.log_set.first().log_message.startswith('Sending rate limited, retrying in'))
+        self.assertEqual(len(mail.outbox), 1)
+
+        kwargs = apply_async_mock.call_args.kwargs
+        self.assertEqual(kwargs['kwargs'], {'message_pk': self.message.pk, 'log_message': 'Retried'})
+        self.assertGreater(kwargs['countdown'], settings.MAILER_RATE_LIMIT_MAX_WAIT)
+        self.assertIsNone(kwargs['queue'])
+
+    @patch.object(ratelimit, 'rate_limiter', RateLimiter('1/h'))
+    def test_not_sent_without_limit(self):
+        Blacklist.objects.create(email=self.message.to_address)
+        with patch.object(settings, 'PAUSE_SEND', True):
+            self.assertFalse(send_db_message(self.create_message(to_address='paused@example.com').pk))
+        self.assertFalse(send_db_message(self.message.pk))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.STATUS_BLACKLISTED)
+
+        # Neither the paused nor the blacklisted message have used the limit.
+        self.assertTrue(send_db_message(self.create_message(to_address='john@example.com').pk))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @patch.object(ratelimit, 'rate_limiter', RateLimiter('1/h'))
+    def test_not_sent_without_claim(self):
+        # Locked by another worker.
+        with patch.object(Message.objects, 'select_for_update', return_value=Message.objects.none()):
+            self.assertFalse(send_db_message(self.message.pk, claim=Q(status=Message.STATUS_CREATED)))
+        self.assertTrue(send_db_message(self.create_message(to_address='john@example.com').pk))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @patch.object(settings, 'MAILER_USE_CELERY', False)
+    @patch('django_yubin.ratelimit.time.sleep')
+    def test_waits_without_celery(self, sleep_mock):
+        # The message is unlocked while it waits.
+        savepoints = len(connection.savepoint_ids)
+        sleep_mock.side_effect = lambda wait: self.assertEqual(len(connection.savepoint_ids), savepoints)
+        limiter = RateLimiter('1/h')
+        with patch.object(ratelimit, 'rate_limiter', limiter), \
+                patch.object(limiter, 'try_acquire', side_effect=[60, 0]):
+            self.assertTrue(send_db_message(self.message.pk))
+        sleep_mock.assert_called_once_with(60)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(limiter.stats()['wait_time'], 60)
+        # Logged once.
+        other = self.create_message()
+        self.assertTrue(send_db_message(other.pk))
+        self.assertEqual(self.message.log_set.count(), other.log_set.count())
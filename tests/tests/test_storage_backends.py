@@ -1,9 +1,23 @@
-from django.test import TestCase
+import os
+from datetime import timedelta
+from importlib import import_module
+from types import SimpleNamespace
+from unittest.mock import patch
 
-from django_yubin import settings
-from django_yubin.models import Message
-from django_yubin.storage_backends import (DatabaseStorageBackend, FileStorageBackend,
-                                           StorageBackendException, db2file, file2db)
+from django.apps import apps
+from django.core.mail import EmailMessage
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from django_yubin import queue_email_messages, settings
+from django_yubin.models import Blob, Message, MessageArchive, MessageBody
+from django_yubin.storage_backends import (CompressedDatabaseStorageBackend, CompressedFileStorageBackend,
+                                           CompressedStorageBackendMixin, DatabaseStorageBackend,
+                                           DeduplicatedDatabaseStorageBackend, DeduplicatedFileStorageBackend,
+                                           DeduplicatedStorageBackendMixin, FileStorageBackend,
+                                           StorageBackendException, compress_message_data, decompress_message_data,
+                                           db2file, file2db)
 
 from .base import MessageMixin
 
@@ -30,7 +44,7 @@ class TestDatabaseStorageBackend(TestBaseStorageBackend):
     def test_get_message_data(self):
         backend_message = DatabaseStorageBackend.get_message_data(self.message)
         self.assertEqual(self.message.message_data, backend_message)
-        self.assertEqual(self.message._message_data, backend_message)
+        self.assertEqual(self.message.get_body_data(), backend_message)
 
     def test_set_message_data(self):
         new_value = 'Foo 🙂 mèssage'
@@ -39,9 +53,47 @@ class TestDatabaseStorageBackend(TestBaseStorageBackend):
         self.assertEqual(updated_value, new_value)
         self.assertEqual(self.message.message_data, new_value)
 
+    def test_get_message_bytes(self):
+        backend_message = DatabaseStorageBackend.get_message_bytes(self.message)
+        self.assertEqual(self.message.message_bytes, backend_message)
+        self.assertEqual(self.message.get_body_data().encode('utf-8'), backend_message)
+
+    def test_set_message_bytes(self):
+        new_value = 'Foo 🙂 mèssage'
+        DatabaseStorageBackend.set_message_bytes(self.message, new_value.encode('utf-8'))
+        self.assertEqual(self.message.get_body_data(), new_value)
+        self.assertEqual(self.message.message_bytes, new_value.encode('utf-8'))
+
     def test_delete_message_data(self):
         self.assertIsNone(DatabaseStorageBackend.delete_message_data(self.message))
 
+    def test_message_body(self):
+        self.assertEqual(Message.objects.filter(pk=self.message.pk).values_list('_message_data', flat=True).get(), '')
+        self.assertEqual(MessageBody.objects.get(message=self.message).data, self.message.message_data)
+
+        message = Message.objects.get(pk=self.message.pk)
+        message.message_data = 'Foo 🙂 mèssage'
+        message.save()
+        self.assertEqual(MessageBody.objects.get(message=self.message).data, 'Foo 🙂 mèssage')
+        self.message.delete()
+        self.assertFalse(MessageBody.objects.exists())
+
+    def test_legacy_message(self):
+        """
+        Messages saved by previous versions are read from the message row, and moved to their
+        body when they are saved again.
+        """
+        data = self.message.message_data
+        MessageBody.objects.all().delete()
+        Message.objects.filter(pk=self.message.pk).update(_message_data=data)
+
+        message = Message.objects.get(pk=self.message.pk)
+        self.assertEqual(message.message_data, data)
+        message.message_data = 'Foo 🙂 mèssage'
+        message.save()
+        self.assertEqual(Message.objects.filter(pk=self.message.pk).values_list('_message_data', flat=True).get(), '')
+        self.assertEqual(Message.objects.get(pk=self.message.pk).message_data, 'Foo 🙂 mèssage')
+
 
 class TestFileStorageBackend(TestBaseStorageBackend):
     storage_backend = 'django_yubin.storage_backends.FileStorageBackend'
@@ -59,13 +111,352 @@ class TestFileStorageBackend(TestBaseStorageBackend):
         self.assertEqual(self.message.message_data, new_value)
         self.assertEqual(self.message._message_data, FileStorageBackend.get_path(self.message))
 
+    def test_get_message_bytes(self):
+        backend_message = FileStorageBackend.get_message_bytes(self.message)
+        self.assertEqual(self.message.message_bytes, backend_message)
+        self.assertEqual(self.message.message_data.encode('utf-8'), backend_message)
+
+    def test_set_message_bytes(self):
+        new_value = 'Foo 🙂 mèssage'.encode('utf-8')
+        old_path = self.message._message_data
+        FileStorageBackend.set_message_bytes(self.message, new_value)
+        self.assertEqual(FileStorageBackend.get_message_bytes(self.message), new_value)
+        self.assertNotEqual(self.message._message_data, old_path)
+        self.assertFalse(FileStorageBackend.storage.exists(old_path))
+
     def test_delete_message_data(self):
         FileStorageBackend.delete_message_data(self.message)
         with self.assertRaises(FileNotFoundError):
             FileStorageBackend.get_message_data(self.message)
 
+    @patch.object(settings, 'MAILER_STORAGE_DELETE_THREADS', 2)
+    def test_delete_messages_data(self):
+        messages = [self.message, self.create_message(), self.create_message()]
+        paths = [message._message_data for message in messages]
+        storage_delete = FileStorageBackend.storage.delete
+
+        def delete(path):
+            if path == paths[0]:
+                raise OSError('Mock error')
+            storage_delete(path)
+
+        with patch.object(FileStorageBackend.storage, 'delete', side_effect=delete) as delete_mock:
+            FileStorageBackend.delete_messages_data(messages)
+        self.assertEqual(sorted(call.args[0] for call in delete_mock.call_args_list), sorted(paths))
+        self.assertEqual([FileStorageBackend.storage.exists(path) for path in paths], [True, False, False])
+        FileStorageBackend.delete_message_data(self.message)
+
+
+class TestCompression(SimpleTestCase):
+    data = 'Subject: Foo 🙂 mèssage\n\n{}'.format('Lorem ipsum ' * 100).encode('utf-8')
+
+    def test_compress(self):
+        for codec in ('zlib', 'lzma'):
+            for text in (False, True):
+                with self.subTest(codec=codec, text=text):
+                    compressed = compress_message_data(self.data, codec, text)
+                    self.assertLess(len(compressed), len(self.data))
+                    self.assertEqual(decompress_message_data(compressed), self.data)
+                    if text:
+                        compressed.decode('ascii')
+
+    def test_decompress_uncompressed(self):
+        self.assertEqual(decompress_message_data(self.data), self.data)
+
+
+class TestCompressedDatabaseStorageBackend(TestBaseStorageBackend):
+    storage_backend = 'django_yubin.storage_backends.CompressedDatabaseStorageBackend'
+
+    def test_get_set_message_data(self):
+        new_value = 'Foo 🙂 mèssage'
+        CompressedDatabaseStorageBackend.set_message_data(self.message, new_value)
+        self.assertTrue(self.message.get_body_bytes().startswith(b'YUBIN zlib\n'))
+        self.assertEqual(CompressedDatabaseStorageBackend.get_message_data(self.message), new_value)
+        self.assertEqual(CompressedDatabaseStorageBackend.get_message_bytes(self.message),
+                         new_value.encode('utf-8'))
+
+    def test_binary_body(self):
+        """
+        Compressed emails are saved as bytes in the binary field of the bodies.
+        """
+        body = MessageBody.objects.get(message=self.message)
+        self.assertEqual(body.data, '')
+        self.assertTrue(bytes(body.binary_data).startswith(b'YUBIN zlib\n'))
+        self.assertEqual(Message.objects.get(pk=self.message.pk).message_bytes, self.message.message_bytes)
+
+    def test_text_compressed_message(self):
+        """
+        Emails compressed as base64 text, like the text storage backends do, are readable.
+        """
+        data = self.message.message_bytes
+        DatabaseStorageBackend.set_message_data(self.message, compress_message_data(data, text=True).decode('ascii'))
+        self.message.save()
+        self.assertEqual(Message.objects.get(pk=self.message.pk).message_bytes, data)
+
+    def test_saved_message(self):
+        message = Message.objects.get(pk=self.message.pk)
+        self.assertEqual(message.storage, self.storage_backend)
+        self.assertEqual(message.message_data, self.message.message_data)
+        self.assertEqual(message.get_message_parser().subject, 'Lorem ipsum dolor sit amet')
+
+    def test_uncompressed_message(self):
+        new_value = 'Foo 🙂 mèssage'
+        DatabaseStorageBackend.set_message_data(self.message, new_value)
+        self.assertEqual(CompressedDatabaseStorageBackend.get_message_data(self.message), new_value)
+
+    @patch.object(settings, 'MAILER_STORAGE_COMPRESSION', 'lzma')
+    def test_lzma(self):
+        new_value = 'Foo 🙂 mèssage'
+        CompressedDatabaseStorageBackend.set_message_data(self.message, new_value)
+        self.assertTrue(self.message.get_body_bytes().startswith(b'YUBIN lzma\n'))
+        self.assertEqual(CompressedDatabaseStorageBackend.get_message_data(self.message), new_value)
+
+
+class TestCompressedFileStorageBackend(TestBaseStorageBackend):
+    storage_backend = 'django_yubin.storage_backends.CompressedFileStorageBackend'
+
+    def test_get_set_message_bytes(self):
+        new_value = 'Foo 🙂 mèssage'.encode('utf-8')
+        CompressedFileStorageBackend.set_message_bytes(self.message, new_value)
+        self.assertTrue(FileStorageBackend.get_message_bytes(self.message).startswith(b'YUBIN zlib\n'))
+        self.assertEqual(CompressedFileStorageBackend.get_message_bytes(self.message), new_value)
+        self.assertEqual(CompressedFileStorageBackend.get_message_data(self.message), new_value.decode('utf-8'))
+
+    def test_uncompressed_message(self):
+        new_value = 'Foo 🙂 mèssage'.encode('utf-8')
+        FileStorageBackend.set_message_bytes(self.message, new_value)
+        self.assertEqual(CompressedFileStorageBackend.get_message_bytes(self.message), new_value)
+
+
+class DeduplicatedCompressedFileStorageBackend(DeduplicatedStorageBackendMixin, CompressedStorageBackendMixin,
+                                               FileStorageBackend):
+    pass
+
+
+class DeduplicatedCompressedDatabaseStorageBackend(DeduplicatedStorageBackendMixin, CompressedStorageBackendMixin,
+                                                   DatabaseStorageBackend):
+    pass
+
+
+@patch.object(settings, 'MAILER_STORAGE_DELETE', True)
+class TestDeduplicatedStorageBackend(TestCase):
+    storage_backends = (
+        'django_yubin.storage_backends.DeduplicatedDatabaseStorageBackend',
+        'django_yubin.storage_backends.DeduplicatedFileStorageBackend',
+        'tests.tests.test_storage_backends.DeduplicatedCompressedFileStorageBackend',
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.attachment = os.urandom(20 * 1024)
+
+    def create_message(self, storage, to='to@abc.com'):
+        email_message = EmailMessage('Subject 🙂', 'Body àäá', 'from@abc.com', [to])
+        email_message.attach('big.pdf', self.attachment, 'application/pdf')
+        email_message.attach('small.txt', 'Small àäá', 'text/plain')
+        data = email_message.message().as_bytes()
+        message = Message.objects.create(to_address=to, from_address='from@abc.com', subject='Subject',
+                                         storage=storage, message_bytes=data)
+        return message, data
+
+    def test_deduplicate(self):
+        for storage in self.storage_backends:
+            with self.subTest(storage=storage):
+                message1, data1 = self.create_message(storage)
+                message2, data2 = self.create_message(storage, to='to2@abc.com')
+                blob = Blob.objects.get()
+                self.assertEqual(blob.ref_count, 2)
+                self.assertGreater(blob.size, len(self.attachment))
+
+                for message, data in ((message1, data1), (message2, data2)):
+                    message = Message.objects.get(pk=message.pk)
+                    self.assertEqual(message.message_bytes, data)
+                    self.assertEqual(message.get_message_parser().attachments[0]['filename'], 'big.pdf')
+
+                message1.delete()
+                self.assertEqual(Blob.objects.get().ref_count, 1)
+                message2.delete()
+                self.assertFalse(Blob.objects.exists())
+
+    def test_queue_email_messages(self):
+        email_messages = []
+        for i in range(3):
+            email_message = EmailMessage('Subject', 'Body', 'from@abc.com', ['to%d@abc.com' % i])
+            email_message.attach('big.pdf', self.attachment, 'application/pdf')
+            email_messages.append(email_message)
+        storage = 'django_yubin.storage_backends.DeduplicatedDatabaseStorageBackend'
+        with patch.object(settings, 'MAILER_STORAGE_BACKEND', storage):
+            with patch.object(Blob.objects, 'filter', wraps=Blob.objects.filter) as filter_mock:
+                queue_email_messages(email_messages)
+            # The update of the references and the creation of the blob.
+            self.assertEqual(filter_mock.call_count, 1)
+            self.assertEqual(Blob.objects.get().ref_count, 3)
+
+            Blob.objects.all().delete()
+            with patch.object(Message, 'save_bodies', side_effect=DatabaseError):
+                with self.assertRaises(DatabaseError):
+                    queue_email_messages(email_messages)
+            # Rolled back with the messages.
+            self.assertFalse(Blob.objects.exists())
+
+    def test_stored_data(self):
+        message, data = self.create_message('django_yubin.storage_backends.DeduplicatedFileStorageBackend')
+        stored = FileStorageBackend.get_message_bytes(message)
+        self.assertLess(len(stored), len(data) // 10)
+        self.assertIn(Blob.objects.get().digest.encode('ascii'), stored)
+        self.assertIn('Small àäá'.encode('utf-8'), stored)
+
+    def test_set_message_data_again(self):
+        message, data = self.create_message('django_yubin.storage_backends.DeduplicatedDatabaseStorageBackend')
+        message.message_data = 'Subject: Foo'
+        self.assertFalse(Blob.objects.exists())
+        message.message_bytes = data
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_missing_blob(self):
+        message, data = self.create_message('django_yubin.storage_backends.DeduplicatedFileStorageBackend')
+        Blob.objects.all().delete()
+        with self.assertRaises(StorageBackendException):
+            DeduplicatedFileStorageBackend.get_message_bytes(message)
+
+    def test_delete_old(self):
+        for storage in self.storage_backends:
+            with self.subTest(storage=storage):
+                messages = [self.create_message(storage, to='to%d@abc.com' % i)[0] for i in range(3)]
+                Message.objects.filter(pk__in=[message.pk for message in messages[:2]]).update(
+                    date_created=timezone.now() - timedelta(days=10))
+                with self.captureOnCommitCallbacks(execute=True):
+                    Message.delete_old(7)
+                self.assertEqual(Blob.objects.get().ref_count, 1)
+                messages[2].delete()
+                self.assertFalse(Blob.objects.exists())
+
+    def test_prepare_delete_messages_data(self):
+        storage = 'django_yubin.storage_backends.DeduplicatedDatabaseStorageBackend'
+        pks = [self.create_message(storage, to='to%d@abc.com' % i)[0].pk for i in range(3)]
+        messages = list(Message.objects.filter(pk__in=pks))
+        # The bodies of all the messages.
+        with self.assertNumQueries(1):
+            DeduplicatedDatabaseStorageBackend.prepare_delete_messages_data(messages)
+        digest = Blob.objects.get().digest
+        self.assertEqual([message._blob_digests for message in messages], [[digest]] * 3)
+
+    def test_archive(self):
+        for storage in self.storage_backends:
+            with self.subTest(storage=storage):
+                message, data = self.create_message(storage)
+                Message.objects.filter(pk=message.pk).update(status=Message.STATUS_SENT,
+                                                             date_sent=timezone.now() - timedelta(days=31))
+                with self.captureOnCommitCallbacks(execute=True):
+                    Message.archive_sent(30)
+                self.assertEqual(Blob.objects.get().ref_count, 1)
+                archive = MessageArchive.objects.get()
+                self.assertEqual(archive.message_bytes, data)
+                archive.delete()
+                self.assertFalse(Blob.objects.exists())
+
+    def test_archive_delete_old(self):
+        for storage in self.storage_backends:
+            with self.subTest(storage=storage):
+                messages = [self.create_message(storage, to='to%d@abc.com' % i)[0] for i in range(2)]
+                Message.objects.update(status=Message.STATUS_SENT, date_sent=timezone.now() - timedelta(days=31))
+                with self.captureOnCommitCallbacks(execute=True):
+                    Message.archive_sent(30)
+                    MessageArchive.objects.filter(pk=messages[0].pk).update(
+                        date_sent=timezone.now() - timedelta(days=91))
+                    MessageArchive.delete_old(90)
+                self.assertEqual(Blob.objects.get().ref_count, 1)
+                with self.captureOnCommitCallbacks(execute=True):
+                    MessageArchive.delete_old(0)
+                self.assertFalse(Blob.objects.exists())
+
+    def test_forged_blob_header(self):
+        for storage in self.storage_backends:
+            with self.subTest(storage=storage):
+                message, data = self.create_message(storage)
+                digest = Blob.objects.get().digest
+                email_message = EmailMessage('Subject', 'Body', 'from@abc.com', ['to2@abc.com'])
+                email_message.attach('forged.pdf', b'Forged', 'application/pdf')
+                mime_message = email_message.message()
+                mime_message.get_payload()[1]['X-Yubin-Blob'] = digest
+                forged = Message.objects.create(to_address='to2@abc.com', from_address='from@abc.com',
+                                                subject='Subject', storage=storage,
+                                                message_bytes=mime_message.as_bytes())
+
+                forged = Message.objects.get(pk=forged.pk)
+                self.assertNotIn(digest.encode('ascii'), forged.message_bytes)
+                self.assertNotIn(self.attachment, forged.get_message_parser().attachments[0]['payload'].encode())
+                forged.delete()
+                self.assertEqual(Blob.objects.get().ref_count, 1)
+                self.assertEqual(Message.objects.get(pk=message.pk).message_bytes, data)
+                message.delete()
+
+    def test_small_parts(self):
+        with patch.object(settings, 'MAILER_STORAGE_BLOB_MIN_SIZE', 10 ** 6):
+            message, data = self.create_message('django_yubin.storage_backends.DeduplicatedFileStorageBackend')
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(FileStorageBackend.get_message_bytes(message), data)
+
 
 class TestMigrations(MessageMixin, TestCase):
+    def test_move_bodies(self):
+        """
+        The data migration moves the emails of the database storage backends to their bodies, and
+        back when it's reverted.
+        """
+        migration = import_module('django_yubin.migrations.0021_message_body')
+        schema_editor = SimpleNamespace(connection=connection)
+        db_message = self.create_message()
+        data = db_message.message_data
+        settings.MAILER_STORAGE_BACKEND = 'django_yubin.storage_backends.FileStorageBackend'
+        file_message = self.create_message()
+        settings.MAILER_STORAGE_BACKEND = 'django_yubin.storage_backends.DatabaseStorageBackend'
+        file_path = file_message._message_data
+
+        migration.restore_bodies(apps, schema_editor)
+        self.assertFalse(MessageBody.objects.exists())
+        self.assertEqual(Message.objects.get(pk=db_message.pk)._message_data, data)
+
+        with patch.object(migration, 'BATCH_SIZE', 1):
+            migration.move_bodies(apps, schema_editor)
+        self.assertEqual(MessageBody.objects.get().data, data)
+        self.assertEqual(Message.objects.get(pk=db_message.pk)._message_data, '')
+        self.assertEqual(Message.objects.get(pk=db_message.pk).message_data, data)
+        self.assertEqual(Message.objects.get(pk=file_message.pk)._message_data, file_path)
+
+    def test_restore_text_bodies(self):
+        """
+        Reverting the binary bodies migration moves emails saved as bytes back to the text fields,
+        in the form of the text compressed storage backends.
+        """
+        migration = import_module('django_yubin.migrations.0024_binary_body')
+        settings.MAILER_STORAGE_BACKEND = 'django_yubin.storage_backends.CompressedDatabaseStorageBackend'
+        message = self.create_message()
+        settings.MAILER_STORAGE_BACKEND = 'django_yubin.storage_backends.DatabaseStorageBackend'
+        data = message.message_bytes
+
+        with patch.object(migration, 'BATCH_SIZE', 1):
+            migration.restore_text_bodies(apps, SimpleNamespace(connection=connection))
+        body = MessageBody.objects.get(message=message)
+        self.assertIsNone(body.binary_data)
+        self.assertTrue(body.data.startswith('YUBIN zlib+base64\n'))
+        self.assertEqual(Message.objects.get(pk=message.pk).message_bytes, data)
+
+    def test_move_bodies_storages(self):
+        """
+        The data migration knows the database storage backends of this app, and finds custom ones
+        by their base classes.
+        """
+        migration = import_module('django_yubin.migrations.0021_message_body')
+        self.assertTrue(migration.is_database_storage('django_yubin.storage_backends.DatabaseStorageBackend'))
+        self.assertFalse(migration.is_database_storage('django_yubin.storage_backends.FileStorageBackend'))
+        self.assertFalse(migration.is_database_storage(
+            'tests.tests.test_storage_backends.DeduplicatedCompressedFileStorageBackend'))
+        self.assertTrue(migration.is_database_storage(
+            'tests.tests.test_storage_backends.DeduplicatedCompressedDatabaseStorageBackend'))
+        self.assertFalse(migration.is_database_storage('tests.tests.test_storage_backends.Missing'))
+
     def test_db2file(self):
         """
         The ``db2file`` migrates emails from database to filesystem.